@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import bisect
+import threading
+from collections import Counter
+from trace_log import TRACE_LOG
+from retrieval_cache import normalize_query
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+ROLLUP_FILE = os.getenv("MAPA_ROLLUP_FILE", os.path.join("logs", "rollups.json"))
+MINUTE_RETENTION = 24 * 60          # minute buckets kept (one day)
+HOUR_RETENTION = 30 * 24            # hour buckets kept (thirty days)
+TOP_QUERIES_KEPT = 2000             # distinct queries tracked before the rarest are dropped
+STAGES = ("retrieval_ms", "queue_ms", "first_token_ms", "total_ms")
+
+# Latency histogram bucket upper bounds (ms); percentiles are read from these
+LATENCY_BOUNDS = [5, 10, 25, 50, 100, 250, 500, 750, 1000, 1500, 2000, 3000, 5000, 7500, 10000, 15000, 30000, 60000]
+
+def _empty_bucket() -> dict:
+    return {
+        "requests": 0, "errors": 0, "degraded": 0, "idk": 0, "failed_retrievals": 0, "cache_hits": 0,
+        "latency": {stage: [0] * (len(LATENCY_BOUNDS) + 1) for stage in STAGES},
+    }
+
+def percentile(histogram, q: float, bounds=LATENCY_BOUNDS):
+    """Upper bound (ms) of the histogram bucket holding the q-th percentile"""
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(histogram):
+        seen += count
+        if seen >= rank:
+            return bounds[i] if i < len(bounds) else float("inf")
+    return float("inf")
+
+def _trim_counter(counter: Counter, keep: int):
+    if len(counter) > keep:
+        for key, _ in counter.most_common()[keep:]:
+            del counter[key]
+
+# -----------------------------
+# INCREMENTAL ROLLUPS OVER THE TRACE LOG
+# Only lines appended since the last refresh are read; state persists with its byte offset.
+# -----------------------------
+class Rollups:
+
+    def __init__(self, log_path: str = TRACE_LOG, state_path: str = ROLLUP_FILE):
+        self.log_path = log_path
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        self.offset = state.get("offset", 0)
+        self.minutes = state.get("minutes", {})
+        self.hours = state.get("hours", {})
+        self.top_queries = Counter(state.get("top_queries", {}))
+        self.unanswered = Counter(state.get("unanswered", {}))
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "offset": self.offset,
+                "minutes": self.minutes,
+                "hours": self.hours,
+                "top_queries": dict(self.top_queries),
+                "unanswered": dict(self.unanswered),
+            }, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _add(self, record: dict):
+        ts = time.localtime(record.get("ts", time.time()))
+        for buckets, key in ((self.minutes, time.strftime("%Y-%m-%d %H:%M", ts)),
+                             (self.hours, time.strftime("%Y-%m-%d %H:00", ts))):
+            bucket = buckets.setdefault(key, _empty_bucket())
+            bucket["requests"] += 1
+            bucket["errors"] += bool(record.get("error"))
+            bucket["degraded"] += bool(record.get("degraded"))
+            bucket["idk"] += bool(record.get("idk"))
+            bucket["failed_retrievals"] += not record.get("error") and record.get("docs", 0) == 0
+            bucket["cache_hits"] += bool(record.get("retrieval_cache_hit"))
+            for stage in STAGES:
+                value = (record.get("timings") or {}).get(stage)
+                if isinstance(value, (int, float)):
+                    bucket["latency"][stage][bisect.bisect_left(LATENCY_BOUNDS, value)] += 1
+
+        query = normalize_query(record.get("query") or "")
+        if query:
+            self.top_queries[query] += 1
+            if record.get("idk") or record.get("degraded") or (not record.get("error") and record.get("docs", 0) == 0):
+                self.unanswered[query] += 1
+
+    def refresh(self) -> int:
+        """Fold new trace lines into the rollups; returns how many were added"""
+        with self._lock:
+            try:
+                size = os.path.getsize(self.log_path)
+            except OSError:
+                return 0
+            if size < self.offset:
+                # Log was rotated or truncated: start over on the new file
+                self.offset = 0
+            added = 0
+            with open(self.log_path, "rb") as f:
+                f.seek(self.offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break   # a write in progress; pick it up next time
+                    self.offset += len(line)
+                    try:
+                        self._add(json.loads(line))
+                        added += 1
+                    except ValueError:
+                        continue
+            if added:
+                for buckets, keep in ((self.minutes, MINUTE_RETENTION), (self.hours, HOUR_RETENTION)):
+                    for key in sorted(buckets)[:-keep]:
+                        del buckets[key]
+                _trim_counter(self.top_queries, TOP_QUERIES_KEPT)
+                _trim_counter(self.unanswered, TOP_QUERIES_KEPT)
+                self._save()
+            return added
+
+    # -----------------------------
+    # VIEWS
+    # -----------------------------
+    def _window(self, granularity: str, last: int, now: float = None):
+        """(buckets, keys in the last N minutes/hours of wall-clock time, oldest first).
+        Quiet periods have no buckets, so counting buckets would reach further back."""
+        buckets, unit, fmt = ((self.hours, 3600, "%Y-%m-%d %H:00") if granularity == "hour"
+                              else (self.minutes, 60, "%Y-%m-%d %H:%M"))
+        now = time.time() if now is None else now
+        cutoff = time.strftime(fmt, time.localtime(now - (last - 1) * unit))
+        return buckets, [key for key in sorted(buckets) if key >= cutoff]
+
+    def series(self, granularity: str = "hour", last: int = 48, now: float = None):
+        buckets, keys = self._window(granularity, last, now)
+        rows = []
+        for key in keys:
+            b = buckets[key]
+            rows.append({
+                "time": key,
+                "requests": b["requests"],
+                "errors": b["errors"],
+                "degraded": b["degraded"],
+                "idk_rate": round(b["idk"] / b["requests"], 3) if b["requests"] else 0.0,
+                "cache_hit_rate": round(b["cache_hits"] / b["requests"], 3) if b["requests"] else 0.0,
+                "p95_total_ms": percentile(b["latency"]["total_ms"], 0.95),
+            })
+        return rows
+
+    def summary(self, granularity: str = "hour", last: int = 24, now: float = None) -> dict:
+        """Totals and per-stage p50/p95 over the last N minutes or hours"""
+        buckets, keys = self._window(granularity, last, now)
+        totals = _empty_bucket()
+        for key in keys:
+            b = buckets[key]
+            for field in ("requests", "errors", "degraded", "idk", "failed_retrievals", "cache_hits"):
+                totals[field] += b[field]
+            for stage in STAGES:
+                totals["latency"][stage] = [x + y for x, y in zip(totals["latency"][stage], b["latency"][stage])]
+        requests = totals["requests"]
+        return {
+            "requests": requests,
+            "errors": totals["errors"],
+            "degraded": totals["degraded"],
+            "failed_retrievals": totals["failed_retrievals"],
+            "idk_rate": round(totals["idk"] / requests, 3) if requests else 0.0,
+            "cache_hit_rate": round(totals["cache_hits"] / requests, 3) if requests else 0.0,
+            "stages": [
+                {"stage": stage.replace("_ms", ""),
+                 "p50_ms": percentile(totals["latency"][stage], 0.5),
+                 "p95_ms": percentile(totals["latency"][stage], 0.95)}
+                for stage in STAGES
+            ],
+        }
+
+    def top(self, which: str = "queries", n: int = 10):
+        counter = self.top_queries if which == "queries" else self.unanswered
+        return [{"query": q, "count": c} for q, c in counter.most_common(n)]
+
+_rollups = None
+_rollups_lock = threading.Lock()
+
+def get_rollups() -> Rollups:
+    """One Rollups per process; every admin page view shares its offset"""
+    global _rollups
+    with _rollups_lock:
+        if _rollups is None:
+            _rollups = Rollups()
+    return _rollups
@@ -0,0 +1,232 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.documents import Document
+from index_store import INDEX_ROOT, RETRIEVER_K, read_current_version, version_path
+from retrieval_cache import normalize_query
+from trace_log import TRACE_LOG, is_idk
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+BANK_FILE = "answer_bank.json"          # lives in the index version directory, so a re-index drops it
+BANK_TRACE = os.path.join("logs", "answer_bank.jsonl")
+BANK_WORKERS = int(os.getenv("MAPA_BANK_WORKERS", "4"))             # concurrent LLM calls while building
+BANK_TOP_LOGGED = int(os.getenv("MAPA_BANK_TOP_LOGGED", "50"))      # most frequent logged questions added
+BANK_MIN_ASKED = int(os.getenv("MAPA_BANK_MIN_ASKED", "3"))         # ...if asked at least this often
+BANK_MIN_SUPPORT = float(os.getenv("MAPA_BANK_MIN_SUPPORT", "0.6"))  # share of grounded sentences to keep an answer
+RECHECK_SECONDS = 60                    # how often a version without a bank is looked at again
+
+# -----------------------------
+# MINING LIKELY QUESTIONS
+# -----------------------------
+def logged_questions(path: str = TRACE_LOG, top: int = BANK_TOP_LOGGED, min_asked: int = BANK_MIN_ASKED):
+    """Most frequent questions in the request trace (first wording seen for each)"""
+    counts, wording = Counter(), {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                query = record.get("query") or ""
+                key = normalize_query(query)
+                if key and not record.get("error"):
+                    counts[key] += 1
+                    wording.setdefault(key, query.strip())
+    except OSError:
+        return []
+    return [wording[key] for key, n in counts.most_common(top) if n >= min_asked]
+
+def mine_questions(faq_path: str = "qa_data.pdf", trace_path: str = TRACE_LOG, top: int = BANK_TOP_LOGGED):
+    """FAQ questions plus the most asked logged ones, without normalized duplicates"""
+    from faq_extract import load_faq
+    questions, seen = [], set()
+    candidates = [row["question"] for row in load_faq(faq_path)] if os.path.exists(faq_path) else []
+    for question in candidates + logged_questions(trace_path, top):
+        key = normalize_query(question)
+        if key and key not in seen:
+            seen.add(key)
+            questions.append(question)
+    return questions
+
+# -----------------------------
+# BUILD (offline, per index version)
+# -----------------------------
+def _doc_to_dict(doc):
+    return {"page_content": doc.page_content, "metadata": doc.metadata}
+
+def build_bank(version: str, questions, embeddings, provider, root: str = INDEX_ROOT,
+               workers: int = BANK_WORKERS, min_support: float = BANK_MIN_SUPPORT) -> dict:
+    """Generate grounded answers for questions against one index version and store them in it"""
+    from engine import make_offline_engine
+
+    engine = make_offline_engine(embeddings, version, root, RETRIEVER_K, provider, workers, BANK_TRACE)
+
+    def one(question):
+        try:
+            answer = engine.answer(question, channel="bank")
+        except Exception as e:
+            logging.error(e)
+            return question, None, "error"
+        if answer.degraded or is_idk(answer.text):
+            return question, None, "no answer"
+        grounding = answer.grounding_result(timeout=60)
+        if grounding is None or grounding.supported_ratio() < min_support:
+            return question, None, "ungrounded"
+        return question, {
+            "question": question,
+            "answer": answer.text,
+            "documents": [_doc_to_dict(d) for d in answer.documents],
+            "grounding": grounding.to_dict(),
+            "generated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }, "ok"
+
+    # Concurrency is capped twice: worker threads here, LLM slots in the engine's scheduler
+    entries, outcomes = {}, Counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for question, entry, outcome in pool.map(one, questions):
+            outcomes[outcome] += 1
+            if entry:
+                entries[normalize_query(question)] = entry
+
+    bank = {"version": version, "built": time.strftime("%Y-%m-%dT%H:%M:%S"), "entries": entries,
+            "outcomes": dict(outcomes)}
+    _write(bank, version, root)
+    return bank
+
+def _write(bank: dict, version: str, root: str):
+    path = os.path.join(version_path(version, root), BANK_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(bank, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def read_bank(version: str, root: str = INDEX_ROOT):
+    try:
+        with open(os.path.join(version_path(version, root), BANK_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def carry_forward(previous: str, version: str, retriever, root: str = INDEX_ROOT):
+    """Copy previous's bank into version (built from it by an ingest job), keeping only the
+    entries whose question still retrieves the same chunks there. No LLM calls; the dropped
+    questions are answered live until the bank is rebuilt. None if previous had no bank."""
+    bank = read_bank(previous, root) if previous else None
+    if bank is None:
+        return None
+    entries, outcomes = {}, Counter()
+    for key, entry in bank["entries"].items():
+        try:
+            found = {d.page_content for d in retriever.invoke(entry["question"])}
+        except Exception as e:
+            logging.error(e)
+            found = None
+        if found == {d["page_content"] for d in entry["documents"]}:
+            entries[key] = entry
+            outcomes["carried"] += 1
+        else:
+            outcomes["invalidated"] += 1
+    carried = {"version": version, "built": bank.get("built"), "carried_from": previous, "entries": entries,
+               "outcomes": dict(outcomes)}
+    _write(carried, version, root)
+    return carried
+
+# -----------------------------
+# SERVE-TIME LOOKUP
+# Only the served version's bank is kept in memory, one per index root (knowledge base);
+# a new version means a new (or no) bank.
+# -----------------------------
+class AnswerBank:
+
+    def __init__(self, root: str = INDEX_ROOT):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        self._banks = {}                # root -> (version, entries, checked_at)
+        self._lock = threading.Lock()
+
+    def _load(self, version: str, root: str):
+        now = time.monotonic()
+        loaded, entries, checked_at = self._banks.get(root, (None, {}, 0.0))
+        if version == loaded and (entries or now - checked_at < RECHECK_SECONDS):
+            return entries
+        entries = (read_bank(version, root) or {}).get("entries", {})
+        self._banks[root] = (version, entries, now)
+        return entries
+
+    def lookup(self, version: str, *queries, root: str = None):
+        """Stored entry for the first of queries (e.g. original, English form) in the bank"""
+        with self._lock:
+            entries = self._load(version, root or self.root)
+        for query in queries:
+            entry = entries.get(normalize_query(query or ""))
+            if entry is not None:
+                self.hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    @staticmethod
+    def documents(entry):
+        return [Document(page_content=d["page_content"], metadata=d.get("metadata") or {}) for d in entry["documents"]]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        version, entries, _ = self._banks.get(self.root, (None, {}, 0.0))
+        return {
+            "version": version,
+            "entries": len(entries),
+            "banks": len(self._banks),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+# -----------------------------
+# CLI: python answer_bank.py [--version V] [--provider fake]
+# -----------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-generate answers for the most likely questions")
+    parser.add_argument("--root", default=INDEX_ROOT)
+    parser.add_argument("--version", help="index version (default: CURRENT)")
+    parser.add_argument("--provider", default=os.getenv("MAPA_LLM_PROVIDER", "gemini"), help="gemini or fake")
+    parser.add_argument("--workers", type=int, default=BANK_WORKERS)
+    parser.add_argument("--top-logged", type=int, default=BANK_TOP_LOGGED)
+    parser.add_argument("--min-support", type=float, default=BANK_MIN_SUPPORT,
+                        help="0 keeps every non-degraded answer (e.g. with the fake provider)")
+    args = parser.parse_args(argv)
+    build_for_version(args.version or read_current_version(args.root), args.root, args.provider,
+                      args.workers, args.top_logged, args.min_support)
+
+def build_for_version(version: str, root: str = INDEX_ROOT, provider_name: str = "gemini",
+                      workers: int = BANK_WORKERS, top_logged: int = BANK_TOP_LOGGED,
+                      min_support: float = BANK_MIN_SUPPORT, embeddings=None):
+    import google.generativeai as genai
+    from dotenv import load_dotenv
+    from index_store import make_embeddings
+    from llm_adapter import make_provider
+
+    if version is None:
+        sys.exit("No index version: run `python index_store.py build` first")
+    if provider_name == "gemini":
+        load_dotenv()
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+    questions = mine_questions(top=top_logged)
+    started = time.perf_counter()
+    bank = build_bank(version, questions, embeddings or make_embeddings(), make_provider(provider_name),
+                      root, workers, min_support)
+    print(f"answer bank for {version}: {len(bank['entries'])} of {len(questions)} questions "
+          f"{bank['outcomes']} in {time.perf_counter() - started:.1f}s")
+    return bank
+
+if __name__ == "__main__":
+    main()
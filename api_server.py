@@ -0,0 +1,209 @@
+import os
+import json
+import uuid
+import asyncio
+import logging
+import argparse
+import threading
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from engine import KnowledgeBaseNotReady, get_engine
+from knowledge_bases import UnknownKnowledgeBase
+from rate_limit import RateLimited
+from retrieval_depth import DEPTH_STATS
+from metrics import CONTENT_TYPE, REGISTRY
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+API_HOST = os.getenv("MAPA_API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("MAPA_API_PORT", "0"))          # 0 = don't start next to the UI
+MAX_CONCURRENCY = int(os.getenv("MAPA_API_CONCURRENCY", "16"))
+QUEUE_TIMEOUT = float(os.getenv("MAPA_API_QUEUE_TIMEOUT", "10"))
+API_KEYS_FILE = os.getenv("MAPA_API_KEYS", "api_keys.json")   # {"<key>": "<user>"}
+
+def load_api_keys(path: str = API_KEYS_FILE) -> dict:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.error(e)
+        return {}
+
+API_KEYS = load_api_keys()
+
+# -----------------------------
+# REQUEST/RESPONSE MODELS
+# -----------------------------
+class AskRequest(BaseModel):
+    query: str
+    history: list = []     # same shape as the UI: [{"user": ...}, {"assistant": ...}]
+    stream: bool = False
+    kb: str = ""           # knowledge base name; empty = the caller's (see knowledge_bases.json)
+
+def _answer_payload(answer) -> dict:
+    """Blocks (up to the grounding wait) for citations; call it off the event loop"""
+    grounding = answer.grounding_result()
+    return {
+        "request_id": answer.request_id,
+        "answer": answer.text,
+        "index_version": answer.index_version,
+        "knowledge_base": answer.knowledge_base,
+        "sources": answer.sources(),
+        "timings": answer.timings,
+        "degraded": answer.degraded or None,
+        "cited_answer": grounding.cited_text() if grounding else None,
+        "grounding": grounding.to_dict() if grounding else None,
+    }
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# -----------------------------
+# APP
+# -----------------------------
+api = FastAPI(title="MAPA API")
+_slots = None
+
+def _get_slots():
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(MAX_CONCURRENCY)
+    return _slots
+
+def _error(status: int, message: str, request_id: str, headers=None):
+    return JSONResponse({"error": message, "request_id": request_id}, status_code=status,
+                        headers={"X-Request-ID": request_id, **(headers or {})})
+
+class Unauthorized(Exception):
+    """Authorization header with a key that isn't in API_KEYS"""
+
+def _api_user(request: Request) -> str:
+    """Who a request is rate limited and routed as: the user its API key belongs to, else
+    its client address. Nothing the client merely claims (a user header) is trusted."""
+    authorization = request.headers.get("Authorization", "")
+    if authorization:
+        scheme, _, key = authorization.partition(" ")
+        user = API_KEYS.get(key.strip()) if scheme.lower() == "bearer" else None
+        if user is None:
+            raise Unauthorized()
+        return user
+    return f"api:{request.client.host if request.client else 'unknown'}"
+
+# Plain def: FastAPI runs these in its threadpool. get_engine() may load the index, and
+# current() or a scrape can go over the retrieval daemon's socket; neither may block the loop.
+@api.get("/healthz")
+def healthz():
+    handle = get_engine().index.current()
+    return {"ok": handle is not None, "index_version": handle.version if handle else None}
+
+@api.get("/v1/stats")
+def stats():
+    engine = get_engine()
+    return {**engine.limits_report(), "caches": engine.cache_report(), "retrieval_depth": DEPTH_STATS.report()}
+
+@api.get("/metrics")
+def metrics():
+    get_engine()  # registers the serving gauges
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+@api.post("/v1/ask")
+async def ask(body: AskRequest, request: Request):
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    if not body.query.strip():
+        return _error(400, "query is required", request_id)
+    slots = _get_slots()
+    try:
+        await asyncio.wait_for(slots.acquire(), QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        return _error(503, "server busy, retry later", request_id)
+
+    # Until a branch below takes over the slot, any exit (an index that fails to load, a
+    # knowledge base not ready, a 4xx) must give it back
+    try:
+        user = _api_user(request)
+        engine = await run_in_threadpool(get_engine)
+        kb = await run_in_threadpool(engine.route, user, body.kb)
+        if body.stream:
+            # Rate limit is checked up front so a rejected stream gets a real 429
+            engine.limiter.check(user)
+    except Unauthorized:
+        slots.release()
+        return _error(401, "invalid API key", request_id)
+    except UnknownKnowledgeBase:
+        slots.release()
+        return _error(404, f"unknown knowledge base {body.kb!r}", request_id)
+    except RateLimited as e:
+        slots.release()
+        return _error(429, str(e), request_id, {"Retry-After": str(int(e.retry_after) + 1)})
+    except KnowledgeBaseNotReady as e:
+        slots.release()
+        return _error(503, str(e), request_id)
+    except BaseException:
+        slots.release()
+        raise
+
+    if not body.stream:
+        try:
+            answer = await run_in_threadpool(engine.answer, body.query, body.history, request_id, user,
+                                             channel="api", kb=kb)
+            return JSONResponse(await run_in_threadpool(_answer_payload, answer), headers={"X-Request-ID": request_id})
+        except RateLimited as e:
+            return _error(429, str(e), request_id, {"Retry-After": str(int(e.retry_after) + 1)})
+        except KnowledgeBaseNotReady as e:
+            return _error(503, str(e), request_id)
+        except Exception as e:
+            logging.error(e)
+            return _error(502, "error while generating response", request_id)
+        finally:
+            slots.release()
+
+    async def events():
+        # The slot is held until the last token has been sent
+        try:
+            async for kind, value in iterate_in_threadpool(
+                    engine.stream(body.query, body.history, request_id, user, check_rate=False, kb=kb)):
+                if kind == "meta":
+                    yield _sse("meta", {"request_id": request_id, "index_version": value.index_version,
+                                        "knowledge_base": value.knowledge_base, "sources": value.sources()})
+                elif kind == "token":
+                    yield _sse("token", {"text": value})
+                else:
+                    # Tokens are already out; only the done event waits for grounding
+                    yield _sse("done", await run_in_threadpool(_answer_payload, value))
+        except KnowledgeBaseNotReady as e:
+            yield _sse("error", {"request_id": request_id, "error": str(e)})
+        except Exception as e:
+            logging.error(e)
+            yield _sse("error", {"request_id": request_id, "error": "error while generating response"})
+        finally:
+            slots.release()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"X-Request-ID": request_id, "Cache-Control": "no-cache"})
+
+# -----------------------------
+# RUNNING
+# -----------------------------
+def start_in_background(host: str = API_HOST, port: int = API_PORT):
+    """Serve the API from a thread of the Streamlit process, sharing its engine"""
+    server = uvicorn.Server(uvicorn.Config(api, host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="mapa-api", daemon=True)
+    thread.start()
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MAPA HTTP/JSON API")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT or 8000)
+    args = parser.parse_args(argv)
+    get_engine()  # load the index before accepting traffic
+    uvicorn.run(api, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
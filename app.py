@@ -7,15 +7,23 @@ import json
 import zipfile
 import streamlit as st
 from dotenv import load_dotenv
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_chroma import Chroma
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_google_genai import GoogleGenerativeAI
-from langchain_huggingface import HuggingFaceEmbeddings
 import google.generativeai as genai
+from engine import KnowledgeBaseNotReady, get_engine
+from retrieval_server import SOCKET_PATH
+from rate_limit import RateLimited
+from pipeline import warm_session
+import api_server
+import metrics
+from chat_store import CHAT_STORE
+from chat_history import CHAT_HISTORY, CHATS_PER_PAGE
+from analytics import get_rollups
+from grounding import GROUNDING_WAIT_SECONDS
+from rerun_profiler import PROFILER
+from ingest_queue import INGEST_QUEUE, STAGES
+from index_store import INDEX_ROOT
+
+# Opt-in (MAPA_RERUN_PROFILE): times the named sections of this script on every rerun
+PROFILER.begin("setup")
 
 # -----------------------------
 # PAGE CONFIG
@@ -86,6 +94,7 @@ def ensure_chroma_db():
             st.error("chroma_db.zip not found.")
             st.stop()
 
+PROFILER.mark("ensure_chroma_db")
 with st.spinner("Extracting Chroma database... Please wait."):
     ensure_chroma_db()
 
@@ -119,27 +128,32 @@ def save_users(users_dict):
         return False
 
 # Load users at startup
+PROFILER.mark("load_users")
 USERS = load_users()
 
 # -----------------------------
 # SESSION STATE
 # -----------------------------
+PROFILER.mark("session_state")
 if "page" not in st.session_state:
     st.session_state.page = "landing"
 if "authenticated" not in st.session_state:
     st.session_state.authenticated = False
 if "username" not in st.session_state:
     st.session_state.username = ""
-if "history" not in st.session_state:
-    st.session_state.history = []  # active chat messages
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
 
-# Multi-chat state
-if "chats" not in st.session_state:
-    st.session_state.chats = []        # [{id,title,history}]
+# Multi-chat state: only the active id; the chat list is paged out of CHAT_HISTORY,
+# message bodies live in CHAT_STORE
 if "active_chat_id" not in st.session_state:
-    cid = str(uuid.uuid4())
-    st.session_state.active_chat_id = cid
-    st.session_state.chats.append({"id": cid, "title": "New chat", "history": []})
+    st.session_state.active_chat_id = str(uuid.uuid4())
+
+# Sidebar chat list: current page and the search it belongs to
+if "chat_page" not in st.session_state:
+    st.session_state.chat_page = 0
+if "chat_search_seen" not in st.session_state:
+    st.session_state.chat_search_seen = ""
 
 # Rename dialog state
 if "renaming_chat_id" not in st.session_state:
@@ -147,17 +161,23 @@ if "renaming_chat_id" not in st.session_state:
 if "rename_temp_title" not in st.session_state:
     st.session_state.rename_temp_title = ""
 
-if "retriever" not in st.session_state:
-    st.session_state.retriever = None
-if "pdfs_loaded" not in st.session_state:
-    st.session_state.pdfs_loaded = False
 if "context_menu_chat_id" not in st.session_state:
     st.session_state.context_menu_chat_id = None
 
+CHAT_STORE.touch(st.session_state.session_id)
+
 # Sign up mode state
 if "show_signup" not in st.session_state:
     st.session_state.show_signup = False
 
+# Grounding check still running for the last answer: {"chat_id", "future"}
+if "pending_grounding" not in st.session_state:
+    st.session_state.pending_grounding = None
+
+# Background warm-up runs once per login
+if "session_warmed" not in st.session_state:
+    st.session_state.session_warmed = False
+
 # -----------------------------
 # LANDING PAGE
 # -----------------------------
@@ -363,9 +383,12 @@ def login_page():
 # LOGOUT
 # -----------------------------
 def logout():
+    CHAT_STORE.drop_session(st.session_state.session_id)
     st.session_state.authenticated = False
     st.session_state.username = ""
-    st.session_state.history = []
+    st.session_state.active_chat_id = str(uuid.uuid4())
+    st.session_state.chat_page = 0
+    st.session_state.session_warmed = False
     st.session_state.page = "landing"
     st.rerun()
 
@@ -378,47 +401,160 @@ def delete_account(username):
     if username in current_users:
         del current_users[username]
         if save_users(current_users):
+            CHAT_HISTORY.delete_user(username)
             return True
     return False
 
 # -----------------------------
-# LOAD PDFs
+# CHAT MESSAGES
 # -----------------------------
-def load_local_pdfs(paths):
-    documents = []
-    for pdf_path in paths:
-        if os.path.exists(pdf_path):
-            try:
-                loader = PyPDFLoader(pdf_path)
-                docs = loader.load()
-                documents.extend(docs)
-            except Exception:
-                pass
-    return documents
+def _chat_messages(chat_id):
+    """Messages of a chat: the in-memory store, or the stored history after eviction or a new login"""
+    messages = CHAT_STORE.messages(chat_id)
+    if not messages:
+        messages = CHAT_HISTORY.messages(chat_id)
+        for m in messages:
+            CHAT_STORE.append(st.session_state.session_id, chat_id, m)
+    return messages
 
 # -----------------------------
-# EMBEDDINGS & VECTORSTORE
+# ADMIN ANALYTICS PAGE
 # -----------------------------
-@st.cache_resource(show_spinner=False)
-def get_embeddings():
-    return HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+def admin_page():
+    st.markdown("## 📊 Analytics")
+    if st.button("← Back to chat"):
+        st.session_state.page = "chatbot"
+        st.rerun()
+
+    rollups = get_rollups()
+    rollups.refresh()
+    granularity = st.radio("Window", ["Last 24 hours", "Last 60 minutes", "Last 30 days"], horizontal=True)
+    unit, last = {"Last 24 hours": ("hour", 24), "Last 60 minutes": ("minute", 60),
+                  "Last 30 days": ("hour", 30 * 24)}[granularity]
+    summary = rollups.summary(unit, last)
 
+    cols = st.columns(5)
+    cols[0].metric("Requests", summary["requests"])
+    cols[1].metric("\"Don't know\" rate", f"{summary['idk_rate']:.1%}")
+    cols[2].metric("Degraded", summary["degraded"])
+    cols[3].metric("Failed retrievals", summary["failed_retrievals"])
+    cols[4].metric("Retrieval cache hits", f"{summary['cache_hit_rate']:.1%}")
+
+    series = rollups.series(unit, last)
+    if series:
+        st.markdown("#### Traffic")
+        st.bar_chart(series, x="time", y=["requests", "errors", "degraded"])
+        st.markdown("#### Rates")
+        st.line_chart(series, x="time", y=["idk_rate", "cache_hit_rate"])
+
+    st.markdown("#### Latency by stage (ms)")
+    st.dataframe(summary["stages"], use_container_width=True, hide_index=True)
+
+    col_top, col_idk = st.columns(2)
+    with col_top:
+        st.markdown("#### Top questions")
+        st.dataframe(rollups.top("queries", 15), use_container_width=True, hide_index=True)
+    with col_idk:
+        st.markdown("#### Top unanswered")
+        st.dataframe(rollups.top("unanswered", 15), use_container_width=True, hide_index=True)
+
+    st.markdown("#### Rerun profile")
+    if not PROFILER.enabled:
+        st.caption("Off. Set MAPA_RERUN_PROFILE=sections (or cprofile) to time each section of a rerun.")
+        return
+    profile = PROFILER.report()
+    rerun = profile["rerun"]
+    st.caption(f"Since {profile['since']}: {rerun['count']} completed reruns, mean {rerun['mean_ms']} ms, "
+               f"p95 {rerun['p95_ms']} ms · {profile['reruns'].get('interrupted', 0)} cut short by st.rerun()")
+    st.dataframe(profile["sections"], use_container_width=True, hide_index=True)
+    if profile["functions"]:
+        st.markdown(f"##### Slowest functions ({profile['sampled_reruns']} sampled reruns, ms per rerun)")
+        st.dataframe(profile["functions"], use_container_width=True, hide_index=True)
+    col_save, col_reset = st.columns(2)
+    with col_save:
+        if st.button("💾 Save report", use_container_width=True):
+            PROFILER.save()
+            st.success(f"Saved to {PROFILER.report_path}")
+    with col_reset:
+        if st.button("↺ Reset profile", use_container_width=True):
+            PROFILER.reset()
+            st.rerun()
+
+# -----------------------------
+# ADMIN DOCUMENTS PAGE (upload -> background ingestion jobs)
+# -----------------------------
+def documents_page():
+    st.markdown("## 📥 Documents")
+    if st.button("← Back to chat", key="documents_back"):
+        st.session_state.page = "chatbot"
+        st.rerun()
+
+    registry = rag_engine.knowledge_bases.registry if rag_engine and rag_engine.knowledge_bases else None
+    # Thin clients run no workers; the retrieval daemon ingests from the same job database
+    workers = INGEST_QUEUE.started or bool(SOCKET_PATH)
+    if not workers:
+        st.warning("No ingestion workers run in this process. Start one with `python ingest_queue.py work`.")
+    elif SOCKET_PATH:
+        st.caption(f"Jobs run in the retrieval daemon; it must share `{INGEST_QUEUE.path}`.")
+    uploads = st.file_uploader("PDFs to add", type=["pdf"], accept_multiple_files=True, disabled=not workers)
+    kb = "default"
+    if registry and len(registry.bases) > 1:
+        kb = st.selectbox("Knowledge base", registry.names(), format_func=lambda name: registry.bases[name].title)
+    if st.button("Queue for indexing", disabled=not (uploads and workers)):
+        root = registry.get(kb).root if registry else INDEX_ROOT
+        job_id = INGEST_QUEUE.submit([(f.name, f.getvalue()) for f in uploads], kb, root)
+        st.success(f"Queued as job {job_id}. Chat keeps using the current index until it is published.")
+    _ingest_jobs()
+
+@st.fragment(run_every=3)
+def _ingest_jobs():
+    # Refreshes on its own while the rest of the page stays put
+    jobs = INGEST_QUEUE.jobs()
+    if not jobs:
+        st.caption("No ingestion jobs yet.")
+        return
+    for job in jobs:
+        stage = job["progress"].get(job["stage"] or "", {})
+        st.markdown(f"**{', '.join(job['files'])}** · {job['kb']} · {job['state']}"
+                    + (f" → version `{job['version']}`" if job["state"] == "done" else ""))
+        if job["state"] == "running" and stage.get("total"):
+            st.progress(stage["done"] / stage["total"],
+                        text=f"{job['stage']}: {stage['done']}/{stage['total']} "
+                             f"({STAGES.index(job['stage']) + 1}/{len(STAGES)})")
+        rates = [f"{name} {rate}/s" for name, rate in job["throughput"].items() if rate]
+        if rates:
+            st.caption(" · ".join(rates))
+        if job["state"] == "failed":
+            st.error(job["error"] or "Failed")
+            if st.button("↻ Resume", key=f"retry_{job['id']}"):
+                INGEST_QUEUE.retry(job["id"])
+
+# -----------------------------
+# RAG ENGINE (index, embeddings, LLM; shared with the HTTP API)
+# -----------------------------
 @st.cache_resource(show_spinner=False)
-def build_vectorstore(_docs):
-    splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=120)
-    split_docs = splitter.split_documents(_docs)
-    embeddings = get_embeddings()
-    vectorstore = Chroma.from_documents(split_docs, embeddings, persist_directory="./chroma_db")
-    return vectorstore
+def get_rag_engine():
+    engine = get_engine()
+    if api_server.API_PORT:
+        # Headless API in this process, so it shares the same index and caches
+        api_server.start_in_background()
+    if metrics.METRICS_PORT:
+        # Scrape target for the UI process (the API also serves /metrics)
+        metrics.start_in_background()
+    return engine
 
 # -----------------------------
 # ROUTING
 # -----------------------------
 if st.session_state.page == "landing":
+    PROFILER.mark("landing_page")
     landing_page()
+    PROFILER.end()
     st.stop()
 if st.session_state.page == "login":
+    PROFILER.mark("login_page")
     login_page()
+    PROFILER.end()
     st.stop()
 if not st.session_state.authenticated:
     st.session_state.page = "landing"
@@ -427,20 +563,28 @@ if not st.session_state.authenticated:
 # -----------------------------
 # CHATBOT PAGE
 # -----------------------------
+PROFILER.mark("engine")
 st.markdown("<style>.stApp { background: white; }</style>", unsafe_allow_html=True)
 
-# Load PDFs (only once)
-if not st.session_state.pdfs_loaded:
-    pdfs = ["qa_data.pdf", "llama2-deep-dataset.pdf"]
-    data = load_local_pdfs(pdfs)
-    if data:
-        vectorstore = build_vectorstore(data)
-        st.session_state.retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 8})
-        st.session_state.pdfs_loaded = True
+# Shared index (built once per process, swapped in the background on re-index)
+try:
+    with st.spinner("Loading knowledge base..."):
+        rag_engine = get_rag_engine()
+except Exception as e:
+    rag_engine = None
+    logging.error(e)
+
+# Warm the embedding model, index pages and LLM connection right after login,
+# so the first question isn't the slowest one
+if rag_engine and not st.session_state.session_warmed:
+    warm_handle = rag_engine.index.current()
+    warm_session(rag_engine.embeddings, warm_handle.retriever if warm_handle else None)
+    st.session_state.session_warmed = True
 
 # -----------------------------
 # FIXED SIDEBAR STYLING
 # -----------------------------
+PROFILER.mark("sidebar_css")
 with st.sidebar:
     st.markdown("""
     <style>
@@ -533,24 +677,86 @@ with st.sidebar:
     </style>
     """, unsafe_allow_html=True)
 
+    PROFILER.mark("sidebar_status")
     # Username tile
     st.markdown(f"<div class='usernameTile'>👤 {st.session_state.username}</div>", unsafe_allow_html=True)
 
-    # New Chat button
+    # Knowledge base picker, only when more than one college/campus corpus is registered;
+    # it starts on the one the user is assigned to
+    kb_registry = rag_engine.knowledge_bases.registry if rag_engine and rag_engine.knowledge_bases else None
+    if kb_registry and len(kb_registry.bases) > 1:
+        kb_names = kb_registry.names()
+        st.selectbox(
+            "Knowledge base",
+            kb_names,
+            index=kb_names.index(kb_registry.route(st.session_state.username)),
+            format_func=lambda name: kb_registry.bases[name].title,
+            key="knowledge_base"
+        )
+
+    # Memory report (admin only)
+    if st.session_state.username == "admin":
+        mine = CHAT_STORE.session_report(st.session_state.session_id)
+        total = CHAT_STORE.report()
+        st.caption(
+            f"Session: {mine['messages']} msgs, {mine['bytes'] / 1024:.1f} KB · "
+            f"Store: {total['sessions']} sessions, {total['bytes'] / 2**20:.1f}/{total['max_bytes'] / 2**20:.0f} MB"
+        )
+        if rag_engine:
+            limits = rag_engine.limits_report()
+            st.caption(
+                f"LLM: {limits['llm']['in_flight']}/{limits['llm']['slots']} busy, {limits['llm']['queued']} queued · "
+                f"rate-limited {limits['rate']['rejected']} of {limits['rate']['allowed'] + limits['rate']['rejected']}"
+            )
+            caches = rag_engine.cache_report()
+            st.caption(" · ".join(
+                f"{name.replace('_', ' ')} cache {c['hit_rate']:.0%} hits"
+                + (f", {c['bytes'] / 2**20:.1f} MB" if "bytes" in c else "")
+                for name, c in caches.items()
+            ))
+
+        if st.button("📊  Analytics", key="btn_analytics", use_container_width=True):
+            st.session_state.page = "admin"
+            st.rerun()
+        if st.button("📥  Documents", key="btn_documents", use_container_width=True):
+            st.session_state.page = "documents"
+            st.rerun()
+
+    PROFILER.mark("chat_list")
+    # New Chat button (the chat is stored once it has a first message)
     if st.button("➕  New Chat", key="btn_new_chat", use_container_width=True):
-        cid = str(uuid.uuid4())
-        st.session_state.chats.append({"id": cid, "title": "New chat", "history": []})
-        st.session_state.active_chat_id = cid
-        st.session_state.history = []
+        st.session_state.active_chat_id = str(uuid.uuid4())
+        st.session_state.chat_page = 0
         st.rerun()
 
     # Section title
     st.markdown("<div class='menuSectionTitle'>Recent Chats</div>", unsafe_allow_html=True)
 
+    # Search box: a new query starts again from the first page
+    chat_query = st.text_input(
+        "Search chats",
+        key="chat_search",
+        placeholder="🔍 Search your chats...",
+        label_visibility="collapsed"
+    ).strip()
+    if chat_query != st.session_state.chat_search_seen:
+        st.session_state.chat_search_seen = chat_query
+        st.session_state.chat_page = 0
+
+    # Only the current page is read and rendered, however many chats there are
+    if chat_query:
+        page_chats, chat_total = CHAT_HISTORY.search(st.session_state.username, chat_query, st.session_state.chat_page)
+    else:
+        page_chats, chat_total = CHAT_HISTORY.recent(st.session_state.username, st.session_state.chat_page)
+    page_count = max(1, -(-chat_total // CHATS_PER_PAGE))
+    if st.session_state.chat_page >= page_count:
+        st.session_state.chat_page = page_count - 1
+        st.rerun()
+    if chat_query and not chat_total:
+        st.caption("No chats match your search.")
+
     # Chats list
-    for idx, chat in enumerate(st.session_state.chats[::-1]):
-        is_active = chat["id"] == st.session_state.active_chat_id
-        
+    for chat in page_chats:
         col1, col2 = st.columns([5, 1])
         
         with col1:
@@ -560,7 +766,6 @@ with st.sidebar:
                 use_container_width=True
             ):
                 st.session_state.active_chat_id = chat["id"]
-                st.session_state.history = chat["history"][:]
                 st.session_state.context_menu_chat_id = None
                 st.rerun()
         
@@ -571,6 +776,9 @@ with st.sidebar:
                 else:
                     st.session_state.context_menu_chat_id = chat["id"]
                 st.rerun()
+
+        if chat.get("snippet"):
+            st.caption(chat["snippet"])
         
         # Context menu
         if st.session_state.context_menu_chat_id == chat["id"]:
@@ -585,15 +793,10 @@ with st.sidebar:
             
             with delete_col:
                 if st.button("🗑️ Delete", key=f"ctx_delete_{chat['id']}", use_container_width=True):
-                    st.session_state.chats = [c for c in st.session_state.chats if c["id"] != chat["id"]]
-                    if not st.session_state.chats:
-                        new_id = str(uuid.uuid4())
-                        st.session_state.chats.append({"id": new_id, "title": "New chat", "history": []})
-                        st.session_state.active_chat_id = new_id
-                        st.session_state.history = []
-                    else:
-                        st.session_state.active_chat_id = st.session_state.chats[-1]["id"]
-                        st.session_state.history = [*st.session_state.chats[-1]["history"]]
+                    CHAT_HISTORY.delete_chat(chat["id"])
+                    CHAT_STORE.delete_chat(chat["id"])
+                    if st.session_state.active_chat_id == chat["id"]:
+                        st.session_state.active_chat_id = str(uuid.uuid4())
                     st.session_state.context_menu_chat_id = None
                     st.rerun()
 
@@ -611,13 +814,13 @@ with st.sidebar:
                 if st.button("💾 Save", key=f"save_{chat['id']}", use_container_width=True):
                     title = (new_title or "").strip()
                     if not title:
-                        for m in chat["history"]:
+                        for m in _chat_messages(chat["id"]):
                             if "user" in m:
                                 title = m["user"].splitlines()[0][:42]
                                 break
                         if not title:
                             title = "New chat"
-                    chat["title"] = title if len(title) <= 48 else (title[:47] + "…")
+                    CHAT_HISTORY.rename(chat["id"], title if len(title) <= 48 else (title[:47] + "…"))
                     st.session_state.renaming_chat_id = None
                     st.session_state.rename_temp_title = ""
                     st.rerun()
@@ -627,6 +830,23 @@ with st.sidebar:
                     st.session_state.rename_temp_title = ""
                     st.rerun()
 
+    # Pager
+    if page_count > 1:
+        prev_col, page_col, next_col = st.columns([1, 2, 1])
+        with prev_col:
+            if st.button("◀", key="chat_page_prev", use_container_width=True,
+                         disabled=st.session_state.chat_page == 0):
+                st.session_state.chat_page -= 1
+                st.rerun()
+        with page_col:
+            st.caption(f"Page {st.session_state.chat_page + 1} of {page_count}")
+        with next_col:
+            if st.button("▶", key="chat_page_next", use_container_width=True,
+                         disabled=st.session_state.chat_page >= page_count - 1):
+                st.session_state.chat_page += 1
+                st.rerun()
+
+    PROFILER.mark("sidebar_account")
     # Logout button
     st.markdown("<div style='margin-top: 24px;'></div>", unsafe_allow_html=True)
     if st.button("🚪  Logout", use_container_width=True):
@@ -660,10 +880,30 @@ with st.sidebar:
                 st.session_state.show_delete_confirmation = False
                 st.rerun()
 
+if st.session_state.page == "admin":
+    if st.session_state.username == "admin":
+        PROFILER.mark("admin_page")
+        admin_page()
+        PROFILER.end()
+        st.stop()
+    st.session_state.page = "chatbot"
+
+if st.session_state.page == "documents":
+    if st.session_state.username == "admin":
+        PROFILER.mark("documents_page")
+        documents_page()
+        PROFILER.end()
+        st.stop()
+    st.session_state.page = "chatbot"
+
 # -----------------------------
 # WELCOME HEADER
 # -----------------------------
-if len(st.session_state.history) == 0:
+PROFILER.mark("history")
+# Active conversation, read from the shared store for this rerun only
+history = _chat_messages(st.session_state.active_chat_id)
+
+if len(history) == 0:
     st.markdown("""
     <div style="min-height:58vh; display:flex; align-items:center; justify-content:center;">
         <div style="padding:28px 22px; border-radius:18px; background:white; max-width:900px; width:100%;">
@@ -680,9 +920,9 @@ if len(st.session_state.history) == 0:
 # -----------------------------
 # CHAT HISTORY
 # -----------------------------
-if st.session_state.history:
+if history:
     st.markdown("### 💬 Chat History")
-    for chat in st.session_state.history:
+    for chat in history:
         if "user" in chat:
             st.markdown(f"""
             <div style='background: #f0f0f0; color: #1a1a1a; padding: 15px 20px; 
@@ -698,7 +938,7 @@ if st.session_state.history:
             <div style='background: white; color: #1a1a1a; padding: 15px 20px; 
                         border-radius: 20px 20px 20px 5px; margin: 10px auto 10px 0; 
                         max-width: 80%; border: 1px solid #e2e8f0;'>
-                <strong>{logo_html}MAPA:</strong> {chat['assistant']}
+                <strong>{logo_html}MAPA:</strong> {chat.get('assistant_cited') or chat['assistant']}
             </div>
             """, unsafe_allow_html=True)
 
@@ -706,51 +946,90 @@ if st.session_state.history:
 # -----------------------------
 # HELPERS
 # -----------------------------
-def _sync_active_chat_to_store():
-    for c in st.session_state.chats:
-        if c["id"] == st.session_state.active_chat_id:
-            c["history"] = st.session_state.history[:]
-            if c["title"] == "New chat":
-                for m in c["history"]:
-                    if "user" in m:
-                        t = m["user"].strip().splitlines()[0]
-                        c["title"] = (t[:48] + "…") if len(t) > 49 else t
-                        break
-            break
+def _append_to_active_chat(message):
+    CHAT_STORE.append(st.session_state.session_id, st.session_state.active_chat_id, message)
+    try:
+        CHAT_HISTORY.append(st.session_state.username, st.session_state.active_chat_id, message)
+    except Exception as e:
+        logging.error(e)
+
+def _cited_html(grounding) -> str:
+    """Answer sentences with their source; unsupported ones highlighted"""
+    parts = []
+    for s in grounding.sentences:
+        if s["supported"]:
+            parts.append(f"{s['text']} <span style='color:#888; font-size:12px;'>{s['citation']}</span>")
+        elif s["supported"] is False:
+            parts.append(f"<span style='background:#fff4e5;' title='Not found in the retrieved documents'>{s['text']}</span>")
+        else:
+            parts.append(s["text"])
+    return " ".join(parts)
 
 # -----------------------------
 # CHAT INPUT + RAG
 # -----------------------------
+PROFILER.mark("chat_input")
 query = st.chat_input("Ask MAPA")
 
-if query and st.session_state.retriever:
-    st.session_state.history.append({"user": query})
-    _sync_active_chat_to_store()
-
-    system_prompt = (
-        "You are MAPA, an AI assistant for Mapua University. "
-        "Use the retrieved context to answer concisely. "
-        "If you don't know, say you don't know.\n\n{context}"
-    )
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
-        ("human", "{input}")
-    ])
-    llm = GoogleGenerativeAI(model="gemini-2.0-flash-exp", temperature=0)
-    rag_chain = (
-        {"context": st.session_state.retriever, "input": RunnablePassthrough()}
-        | prompt
-        | llm
-        | StrOutputParser()
-    )
+if query and rag_engine:
+    queue_notice = st.empty()
+
+    def _show_queue_position(position):
+        queue_notice.info(f"⏳ MAPA is busy — you're #{position} in line.")
+
     try:
         with st.spinner(" Thinking..."):
-            response = rag_chain.invoke(query)
-            st.session_state.history.append({"assistant": response})
-            _sync_active_chat_to_store()
+            answer = rag_engine.answer(query, history, user=st.session_state.username, on_wait=_show_queue_position,
+                                       kb=st.session_state.get("knowledge_base"))
+            queue_notice.empty()
+            if answer.degraded and answer.generation is not None:
+                # Show the extractive answer now; swap in the LLM's if it lands before the ceiling
+                queue_notice.info(answer.text)
+                answer.upgrade()
+                queue_notice.empty()
+            _append_to_active_chat({"user": query})
+            message = {"assistant": answer.text, "index_version": answer.index_version}
+            if answer.degraded:
+                message["degraded"] = answer.degraded
+            elif answer.timings.get("upgraded"):
+                rag_engine.ground(answer)
+            _append_to_active_chat(message)
+            if answer.grounding is not None:
+                st.session_state.pending_grounding = {"chat_id": st.session_state.active_chat_id,
+                                                      "future": answer.grounding}
             st.rerun()
+    except RateLimited as e:
+        # Rejected before any work was done; the question is not kept
+        st.warning(f"⏳ You're sending questions too quickly. Please try again in {e.retry_after:.0f} seconds.")
+    except KnowledgeBaseNotReady:
+        st.error("⚠️ Knowledge base is not ready yet. The documents are still being indexed; please try again in a minute.")
     except Exception as e:
+        _append_to_active_chat({"user": query})
         st.error("⚠️ Error while generating response.")
         logging.error(e)
-elif query and not st.session_state.retriever:
-    st.error("⚠️ Knowledge base is not ready. Please ensure PDF files are loaded correctly.")
\ No newline at end of file
+elif query and not rag_engine:
+    st.error("⚠️ Knowledge base is not ready. Please ensure PDF files are loaded correctly.")
+
+# -----------------------------
+# CITATIONS (verified after the answer is already on screen)
+# -----------------------------
+PROFILER.mark("citations")
+pending = st.session_state.pending_grounding
+if pending:
+    st.session_state.pending_grounding = None
+    amended = False
+    try:
+        grounding = pending["future"].result(GROUNDING_WAIT_SECONDS)
+        fields = {"assistant_cited": _cited_html(grounding)}
+        if grounding.unsupported():
+            fields["unsupported"] = len(grounding.unsupported())
+        amended = CHAT_STORE.amend_last(pending["chat_id"], fields)
+        CHAT_HISTORY.amend_last(pending["chat_id"], fields)
+    except Exception as e:
+        # The plain answer stays; citations are an extra
+        logging.error(e)
+    if amended and pending["chat_id"] == st.session_state.active_chat_id:
+        PROFILER.end()
+        st.rerun()
+
+PROFILER.end()
@@ -0,0 +1,140 @@
+"""Recall@k / query latency / index memory of each ANN backend as the corpus grows.
+
+    python benchmarks/bench_ann.py --sizes 10000 100000 500000 --ef 16 64 128
+
+Vectors are synthetic 384-dim clusters (MiniLM-shaped), so the sweep runs in minutes
+without embedding a real corpus. Exact brute force is the recall reference.
+The int8/binary rows are the quantized backends: "mem MB" is what stays resident, the
+float16 rescoring file is memory-mapped and only its shortlisted rows are read.
+Cold load compares reading those files with reading the float32 matrix.
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vector_backends import ExactIndex, IVFPQIndex, QuantizedIndex, faiss, _normalize
+
+try:
+    import hnswlib  # ships with chromadb (chroma-hnswlib)
+except ImportError:
+    hnswlib = None
+
+DIM = 384
+
+def synthetic_corpus(n: int, queries: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(8, n // 200), DIM)).astype(np.float32)
+    labels = rng.integers(0, len(centers), size=n + queries)
+    points = centers[labels] + 0.35 * rng.normal(size=(n + queries, DIM)).astype(np.float32)
+    points = _normalize(points)
+    return points[:n], points[n:]
+
+def recall_at_k(found, truth, k: int) -> float:
+    return float(np.mean([len(set(f[:k]) & set(t[:k])) / k for f, t in zip(found, truth)]))
+
+def time_queries(search, queries, k: int):
+    results, latencies = [], []
+    for q in queries:
+        started = time.perf_counter()
+        ids, _ = search(q, k)
+        latencies.append(time.perf_counter() - started)
+        results.append(list(ids))
+    latencies = np.array(latencies) * 1000
+    return results, float(np.percentile(latencies, 50)), float(np.percentile(latencies, 95))
+
+class HNSWIndex:
+    """The same hnswlib index Chroma builds, constructed directly so parameters can be swept"""
+
+    def __init__(self, vectors, m: int, ef_construction: int, ef_search: int):
+        self.m = m
+        self.index = hnswlib.Index(space="cosine", dim=vectors.shape[1])
+        self.index.init_index(max_elements=len(vectors), M=m, ef_construction=ef_construction)
+        self.index.add_items(vectors, np.arange(len(vectors)))
+        self.index.set_ef(ef_search)
+        self.n = len(vectors)
+
+    def search(self, query, k: int):
+        ids, distances = self.index.knn_query(query, k=k)
+        return ids[0], 1 - distances[0]
+
+    def nbytes(self) -> int:
+        # float32 vectors + level-0 links (2*M ids) + upper levels (~M ids / ln M share)
+        return self.n * (DIM * 4 + 2 * self.m * 4 + self.m * 4 // 2)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="*", default=[10_000, 50_000, 200_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=100)
+    parser.add_argument("--ef", type=int, nargs="*", default=[16, 64, 128])
+    parser.add_argument("--nprobe", type=int, nargs="*", default=[4, 16])
+    parser.add_argument("--rescore", type=int, nargs="*", default=[0],
+                        help="shortlist factors for int8/binary (0 = configured default)")
+    args = parser.parse_args()
+
+    print(f"{'n':>9} {'backend':<28}{'recall@k':>9}{'p50 ms':>9}{'p95 ms':>9}{'mem MB':>9}{'build s':>9}")
+    for n in args.sizes:
+        vectors, queries = synthetic_corpus(n, args.queries)
+        rows = []
+
+        started = time.perf_counter()
+        exact = ExactIndex(vectors)
+        build = time.perf_counter() - started
+        truth, p50, p95 = time_queries(exact.search, queries, args.k)
+        rows.append(("exact", 1.0, p50, p95, exact.nbytes(), build))
+
+        if hnswlib is not None:
+            for ef in args.ef:
+                started = time.perf_counter()
+                index = HNSWIndex(vectors, args.m, args.ef_construction, ef)
+                build = time.perf_counter() - started
+                found, p50, p95 = time_queries(index.search, queries, args.k)
+                rows.append((f"hnsw M={args.m} ef={ef}", recall_at_k(found, truth, args.k), p50, p95, index.nbytes(), build))
+
+        if faiss is not None:
+            for nprobe in args.nprobe:
+                started = time.perf_counter()
+                index = IVFPQIndex(vectors, nprobe=nprobe)
+                build = time.perf_counter() - started
+                found, p50, p95 = time_queries(index.search, queries, args.k)
+                rows.append((f"ivfpq nprobe={nprobe}", recall_at_k(found, truth, args.k), p50, p95, index.nbytes(), build))
+
+        workdir = tempfile.mkdtemp(prefix="mapa-quantized-")
+        started = time.perf_counter()
+        QuantizedIndex.write(workdir, vectors, range(n))
+        build = time.perf_counter() - started
+        loads = {}
+        for kind in ("int8", "binary"):
+            for factor in args.rescore:
+                started = time.perf_counter()
+                index = QuantizedIndex.load(workdir, kind, factor)
+                loads[kind] = time.perf_counter() - started
+                found, p50, p95 = time_queries(index.search, queries, args.k)
+                rows.append((f"{kind} rescore x{index.rescore}", recall_at_k(found, truth, args.k), p50, p95, index.nbytes(), build))
+        mapped = index.mapped_bytes()
+        np.save(os.path.join(workdir, "float32.npy"), vectors)
+        started = time.perf_counter()
+        np.load(os.path.join(workdir, "float32.npy"))
+        loads["float32"] = time.perf_counter() - started
+        shutil.rmtree(workdir, ignore_errors=True)
+
+        for name, recall, p50, p95, nbytes, build in rows:
+            print(f"{n:>9} {name:<28}{recall:>9.3f}{p50:>9.2f}{p95:>9.2f}{nbytes / 2**20:>9.1f}{build:>9.1f}")
+        print(f"{'':>9} float16 rescoring file {mapped / 2**20:.1f} MB (mapped); cold load "
+              + ", ".join(f"{kind} {s * 1000:.0f} ms" for kind, s in loads.items()))
+
+    if hnswlib is None:
+        print("hnswlib not installed: HNSW rows skipped")
+    if faiss is None:
+        print("faiss not installed: IVF-PQ rows skipped (pip install faiss-cpu)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Tagalog/Taglish retrieval: added query latency and how close results get to the English question's.
+
+    python benchmarks/bench_bilingual.py                 # lexicon mapping, current index
+    python benchmarks/bench_bilingual.py --llm           # also Gemini translation (needs GOOGLE_API_KEY)
+    python benchmarks/bench_bilingual.py --latency-only  # no model or index needed
+
+Quality is overlap@k with the chunks retrieved for the English wording of the same question,
+for the raw mixed-language query (what MAPA did before) and for the translated one.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from language import QueryTranslator, detect_language
+
+# (mixed-language question, English wording)
+QUESTIONS = [
+    ("Paano mag-enroll sa first term?", "How do I enroll for the first term?"),
+    ("Magkano po ang tuition fee ng BS Data Science?", "How much is the tuition fee for BS Data Science?"),
+    ("Saan ako magbabayad ng tuition?", "Where do I pay my tuition?"),
+    ("Pwede ba mag-drop ng subject after the deadline?", "Can I drop a subject after the deadline?"),
+    ("Kailan magsisimula ang klase ngayong taon?", "When do classes start this year?"),
+    ("Ano ang mga requirements para sa enrollment?", "What are the requirements for enrollment?"),
+    ("Mayroon bang scholarship para sa mga dean's lister?", "Is there a scholarship for dean's listers?"),
+    ("Paano ko malalaman kung enrolled na ako?", "How do I check if I am already enrolled?"),
+    ("Saan ang comfort room sa ground floor?", "Where is the comfort room on the ground floor?"),
+    ("Ilang units ang pwedeng kunin per term?", "How many units can I take per term?"),
+    ("Sino ang lalapitan ko para magpalit ng schedule?", "Who do I approach for a schedule change?"),
+    ("Paano ayusin ang IP na grade?", "How do I fix an IP grade?"),
+    ("Magkano ang minimum na downpayment para ma-enroll?", "What is the minimum down payment to be enrolled?"),
+    ("May robotics org ba sa Mapua?", "Is there a robotics organization at Mapua?"),
+    ("Anong programming languages ang pag-aaralan namin?", "What programming languages will we study?"),
+    ("Kailangan ba ng advanced math sa curriculum?", "Is advanced math needed in the curriculum?"),
+    ("Pano mag-apply ng scholarship?", "How do I apply for a scholarship?"),
+    ("Saan ipapasa ang mga papeles ng freshman?", "Where do freshmen submit their documents?"),
+    ("What are the requirements sa DL at PL?", "What are the requirements for the Dean's List and President's List?"),
+    ("Is it possible to change section kung may opening?", "Is it possible to change sections if there is an opening?"),
+]
+
+def pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def overlap(found, reference) -> float:
+    keys = {d.page_content for d in reference}
+    return sum(d.page_content in keys for d in found) / len(reference) if reference else 0.0
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm", action="store_true", help="also measure Gemini translation")
+    parser.add_argument("--latency-only", action="store_true")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    modes = ["lexicon"] + (["llm"] if args.llm else [])
+    translators = {}
+    if args.llm:
+        import google.generativeai as genai
+        from dotenv import load_dotenv
+        from llm_adapter import GeminiProvider
+        load_dotenv()
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        translators["llm"] = QueryTranslator("llm", GeminiProvider(), timeout=10.0)
+    translators["lexicon"] = QueryTranslator("lexicon")
+
+    detected = [detect_language(q) for q, _ in QUESTIONS]
+    print(f"Detected: {detected.count('tl')} tl, {detected.count('taglish')} taglish, {detected.count('en')} missed as en")
+    for _, english in QUESTIONS:
+        if detect_language(english) != "en":
+            print(f"  English question flagged as {detect_language(english)}: {english}")
+
+    print(f"\n{'mode':<9}{'cold p50 ms':>12}{'cold p95 ms':>12}{'warm p50 ms':>12}")
+    for mode in modes:
+        translator = translators[mode]
+        cold = []
+        for query, _ in QUESTIONS:
+            started = time.perf_counter()
+            translator.translate(query)
+            cold.append((time.perf_counter() - started) * 1000)
+        warm = []
+        for _ in range(max(1, args.repeat // len(QUESTIONS))):
+            for query, _ in QUESTIONS:
+                started = time.perf_counter()
+                translator.translate(query)
+                warm.append((time.perf_counter() - started) * 1000)
+        print(f"{mode:<9}{pct(cold, 0.5):>12.3f}{pct(cold, 0.95):>12.3f}{pct(warm, 0.5):>12.4f}")
+
+    if args.latency_only:
+        return
+
+    from index_store import IndexWatcher, make_embeddings
+    watcher = IndexWatcher(make_embeddings())
+    watcher.refresh()
+    handle = watcher.current()
+    if handle is None:
+        sys.exit("No published index: run `python index_store.py build` first")
+    retriever = handle.retriever
+
+    print(f"\nOverlap@k with the English question's chunks (index {handle.version})")
+    print(f"{'query':<52}{'raw':>6}" + "".join(f"{m:>9}" for m in modes))
+    totals = {"raw": [], **{m: [] for m in modes}}
+    for query, english in QUESTIONS:
+        reference = retriever.invoke(english)
+        raw = overlap(retriever.invoke(query), reference)
+        totals["raw"].append(raw)
+        cells = []
+        for mode in modes:
+            score = overlap(retriever.invoke(translators[mode].translate(query).text), reference)
+            totals[mode].append(score)
+            cells.append(f"{score:>9.2f}")
+        print(f"{query[:50]:<52}{raw:>6.2f}" + "".join(cells))
+    print(f"{'mean':<52}{statistics.mean(totals['raw']):>6.2f}"
+          + "".join(f"{statistics.mean(totals[m]):>9.2f}" for m in modes))
+
+if __name__ == "__main__":
+    main()
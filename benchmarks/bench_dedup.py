@@ -0,0 +1,84 @@
+"""Near-duplicate chunk removal: index size reduction and retrieval diversity, before and after.
+
+    python benchmarks/bench_dedup.py                                  # the default PDFs
+    python benchmarks/bench_dedup.py memo1.pdf memo2.pdf --thresholds 0.7 0.8 0.9
+    python benchmarks/bench_dedup.py --size-only                      # no embedding model needed
+
+The PDFs are split the way index_store does. For each threshold it reports the chunks and
+characters left. Diversity is measured on the eval question set: of the top-k chunks
+retrieved for a question, the share that are distinct passages (not near-duplicates of a
+higher-ranked result) and the number of distinct source pages.
+"""
+import os
+import sys
+import json
+import time
+import copy
+import argparse
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from dedup import DEDUP_THRESHOLD, dedupe, near_duplicate_groups
+from index_store import DEFAULT_PDFS, CHUNK_SIZE, CHUNK_OVERLAP, RETRIEVER_K, load_local_pdfs
+from vector_backends import ExactIndex
+
+def split(paths):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return splitter.split_documents(load_local_pdfs(paths))
+
+def questions(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["question"] for line in f if line.strip()]
+
+def diversity(chunks, embeddings, query_vectors, k: int, threshold: float):
+    """(mean distinct-passage share of the top k, mean distinct pages in the top k)"""
+    index = ExactIndex(np.asarray(embeddings.embed_documents([c.page_content for c in chunks])))
+    distinct, pages = [], []
+    for query in query_vectors:
+        ids, _ = index.search(query, k)
+        found = [chunks[i] for i in ids]
+        groups = near_duplicate_groups([c.page_content for c in found], threshold)
+        distinct.append(len(groups) / len(found))
+        pages.append(len({(c.metadata.get("source"), c.metadata.get("page")) for c in found}))
+    return float(np.mean(distinct)), float(np.mean(pages))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdfs", nargs="*", default=DEFAULT_PDFS)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.7, DEDUP_THRESHOLD, 0.9])
+    parser.add_argument("--questions", default=os.path.join(ROOT, "eval", "questions.jsonl"))
+    parser.add_argument("--k", type=int, default=RETRIEVER_K)
+    parser.add_argument("--size-only", action="store_true", help="skip the retrieval diversity part")
+    args = parser.parse_args()
+
+    chunks = split([os.path.join(ROOT, p) if not os.path.isabs(p) else p for p in args.pdfs])
+    runs = [("none", chunks, 0.0)]
+    for threshold in args.thresholds:
+        started = time.perf_counter()
+        kept, _ = dedupe(copy.deepcopy(chunks), threshold)
+        runs.append((f"{threshold:.2f}", kept, time.perf_counter() - started))
+
+    embeddings = query_vectors = None
+    if not args.size_only:
+        from index_store import make_embeddings
+        embeddings = make_embeddings()
+        query_vectors = np.asarray([embeddings.embed_query(q) for q in questions(args.questions)])
+
+    chars = sum(len(c.page_content) for c in chunks)
+    print(f"{'threshold':>9} {'chunks':>8} {'size':>7} {'chars':>9} {'dedup s':>8} "
+          f"{'distinct@k':>11} {'pages@k':>8}")
+    for name, kept, seconds in runs:
+        kept_chars = sum(len(c.page_content) for c in kept)
+        line = (f"{name:>9} {len(kept):>8} {len(kept) / len(chunks):>7.1%} {kept_chars:>9} "
+                f"{seconds:>8.2f}")
+        if embeddings is not None:
+            share, pages = diversity(kept, embeddings, query_vectors, args.k, DEDUP_THRESHOLD)
+            line += f" {share:>11.3f} {pages:>8.2f}"
+        print(line)
+    print(f"\n{len(chunks)} chunks, {chars} characters before dedup")
+
+if __name__ == "__main__":
+    main()
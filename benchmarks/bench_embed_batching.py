@@ -0,0 +1,97 @@
+"""Query-embedding throughput/latency: one forward pass per query vs the shared dispatcher.
+
+    python benchmarks/bench_embed_batching.py --users 30 --queries 5
+    python benchmarks/bench_embed_batching.py --simulated    # no model download
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embed_batcher import EmbeddingDispatcher
+
+QUESTIONS = [
+    "When is enrollment for the first term?",
+    "How do I apply for a leave of absence?",
+    "What are the requirements for the Dean's List?",
+    "Where can I get my certificate of registration?",
+    "How many units can I overload?",
+    "What is the grading system?",
+]
+
+class SimulatedEmbeddings:
+    """Stand-in with a fixed per-pass overhead plus per-sentence cost, like a small encoder on CPU"""
+
+    def __init__(self, overhead_ms: float = 8.0, per_item_ms: float = 1.5):
+        self.overhead = overhead_ms / 1000.0
+        self.per_item = per_item_ms / 1000.0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:  # one forward pass at a time, like a single CPU model
+            time.sleep(self.overhead + self.per_item * len(texts))
+        return [[0.0] * 384 for _ in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+def run(embed, users: int, queries: int):
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(users)
+
+    def worker(i):
+        barrier.wait()
+        for j in range(queries):
+            started = time.perf_counter()
+            embed(QUESTIONS[(i + j) % len(QUESTIONS)])
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(users)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "qps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=30)
+    parser.add_argument("--queries", type=int, default=5)
+    parser.add_argument("--wait-ms", type=float, nargs="*", default=[1, 4, 10])
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--simulated", action="store_true")
+    args = parser.parse_args()
+
+    if args.simulated:
+        base = SimulatedEmbeddings()
+    else:
+        from index_store import make_embeddings
+        base = make_embeddings()
+        base.embed_query("warm up")
+
+    print(f"{args.users} concurrent users x {args.queries} queries")
+    print(f"{'mode':<24}{'qps':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    result = run(base.embed_query, args.users, args.queries)
+    print(f"{'unbatched':<24}{result['qps']:>10.1f}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}")
+    for wait_ms in args.wait_ms:
+        dispatcher = EmbeddingDispatcher(base, wait_ms, args.max_batch)
+        result = run(dispatcher.embed, args.users, args.queries)
+        label = f"batched wait={wait_ms:g}ms"
+        print(f"{label:<24}{result['qps']:>10.1f}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+              f"   avg batch {dispatcher.stats()['avg_batch']}")
+
+if __name__ == "__main__":
+    main()
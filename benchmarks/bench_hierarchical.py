@@ -0,0 +1,89 @@
+"""Two-stage (section -> chunk) retrieval against flat exact search as the corpus grows.
+
+    python benchmarks/bench_hierarchical.py --sizes 10000 50000 200000 --top-sections 4 6 12
+
+The corpus is synthetic 384-dim vectors with a topic structure like the handbooks': each
+"PDF" covers a few topics, each section (SECTION_PAGES pages) stays on one of them and
+its chunks scatter around it. Flat exact search is the reference for recall@k; "on-topic"
+is the share of returned chunks from the query's own topic, for both methods.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vector_backends import ExactIndex, HierarchicalIndex, _normalize
+from sections import SECTION_PAGES
+
+DIM = 384
+CHUNKS_PER_PAGE = 3
+PAGES_PER_PDF = 120
+SECTION_DRIFT = 0.5        # distance of a section's center from its topic (unit vectors)
+CHUNK_SPREAD = 0.8         # distance of a chunk (or query) from its center
+
+def synthetic_corpus(n: int, queries: int, seed: int = 0):
+    """(vectors, metadatas, topic per chunk, query vectors, topic per query)"""
+    rng = np.random.default_rng(seed)
+    noise = lambda count: rng.normal(size=(count, DIM)) / np.sqrt(DIM)     # unit-norm on average
+    topics = _normalize(rng.normal(size=(max(16, n // 300), DIM)))
+    sections = n // (SECTION_PAGES * CHUNKS_PER_PAGE) + 1
+    section_topics = rng.integers(0, len(topics), size=sections)
+    # A section drifts a little from its topic; its chunks scatter around the section
+    section_centers = _normalize(topics[section_topics] + SECTION_DRIFT * noise(sections))
+    rows = np.arange(n)
+    section_of = rows // (SECTION_PAGES * CHUNKS_PER_PAGE)
+    vectors = _normalize(section_centers[section_of] + CHUNK_SPREAD * noise(n))
+    metadatas = []
+    for r in rows:
+        page = r // CHUNKS_PER_PAGE
+        metadatas.append({"source": f"pdf_{page // PAGES_PER_PDF}.pdf", "page": int(page % PAGES_PER_PDF)})
+    query_topics = rng.integers(0, len(topics), size=queries)
+    query_vectors = _normalize(topics[query_topics] + CHUNK_SPREAD * noise(queries))
+    return vectors, metadatas, section_topics[section_of], query_vectors, query_topics
+
+def time_queries(search, queries, k: int):
+    results, latencies = [], []
+    for q in queries:
+        started = time.perf_counter()
+        ids, _ = search(q, k)
+        latencies.append(time.perf_counter() - started)
+        results.append(list(ids))
+    latencies = np.array(latencies) * 1000
+    return results, float(np.percentile(latencies, 50)), float(np.percentile(latencies, 95))
+
+def recall_at_k(found, truth, k: int) -> float:
+    return float(np.mean([len(set(f[:k]) & set(t[:k])) / k for f, t in zip(found, truth)]))
+
+def on_topic(found, chunk_topics, query_topics) -> float:
+    return float(np.mean([np.mean(chunk_topics[list(f)] == t) for f, t in zip(found, query_topics)]))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 200000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--top-sections", type=int, nargs="+", default=[4, 6, 12])
+    args = parser.parse_args()
+
+    print(f"{'chunks':>8} {'method':<14} {'sections':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'recall@k':>9} {'on-topic':>9} {'build s':>8}")
+    for n in args.sizes:
+        vectors, metadatas, chunk_topics, queries, query_topics = synthetic_corpus(n, args.queries)
+        exact = ExactIndex(vectors)
+        truth, p50, p95 = time_queries(exact.search, queries, args.k)
+        print(f"{n:>8} {'flat exact':<14} {'':>8} {p50:>8.2f} {p95:>8.2f} {1.0:>9.3f} "
+              f"{on_topic(truth, chunk_topics, query_topics):>9.3f} {'':>8}")
+        for top in args.top_sections:
+            started = time.perf_counter()
+            index = HierarchicalIndex(vectors, metadatas, top_sections=top)
+            build = time.perf_counter() - started
+            found, p50, p95 = time_queries(index.search, queries, args.k)
+            print(f"{n:>8} {f'sections@{top}':<14} {len(index.sections):>8} {p50:>8.2f} {p95:>8.2f} "
+                  f"{recall_at_k(found, truth, args.k):>9.3f} "
+                  f"{on_topic(found, chunk_topics, query_topics):>9.3f} {build:>8.2f}")
+
+if __name__ == "__main__":
+    main()
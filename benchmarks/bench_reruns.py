@@ -0,0 +1,90 @@
+"""Rerun cost of app.py by section, driven headlessly with Streamlit's AppTest.
+
+    python benchmarks/bench_reruns.py                                    # 30 reruns, 300 stored chats
+    python benchmarks/bench_reruns.py --baseline logs/rerun_baseline.json --update-baseline
+    python benchmarks/bench_reruns.py --baseline logs/rerun_baseline.json   # exits 1 on a regression
+
+The chatbot page is rerun as a logged-in student with a seeded chat history, so the CSS,
+sidebar, chat list and history sections cost what they would for a heavy user. Plain reruns
+are mixed with chat searches and page flips. Run it before deploying a change to app.py.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reruns", type=int, default=30)
+    parser.add_argument("--chats", type=int, default=300, help="stored chats of the benchmark user")
+    parser.add_argument("--messages", type=int, default=20, help="messages in the open chat")
+    parser.add_argument("--cprofile", action="store_true", help="also sample reruns with cProfile")
+    parser.add_argument("--baseline")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    # Read by rerun_profiler and chat_history at import time
+    workdir = tempfile.mkdtemp(prefix="mapa-reruns-")
+    os.environ["MAPA_RERUN_PROFILE"] = "cprofile" if args.cprofile else "sections"
+    os.environ["MAPA_RERUN_CPROFILE_EVERY"] = "5"
+    os.environ["MAPA_CHAT_DB"] = os.path.join(workdir, "chats.db")
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    os.chdir(ROOT)
+
+    from streamlit.testing.v1 import AppTest
+    from chat_history import CHAT_HISTORY
+    from rerun_profiler import PROFILER, compare, format_report
+
+    started = time.perf_counter()
+    for i in range(args.chats):
+        messages = args.messages if i == 0 else 2
+        for m in range(messages // 2):
+            CHAT_HISTORY.append("bench", f"chat-{i}", {"user": f"How do I pay tuition for term {i}, question {m}?"})
+            CHAT_HISTORY.append("bench", f"chat-{i}", {"assistant": "Tuition is paid at the cashier or online. " * 8})
+    print(f"Seeded {args.chats} chats in {time.perf_counter() - started:.1f}s")
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=300)
+    at.session_state["authenticated"] = True
+    at.session_state["username"] = "bench"
+    at.session_state["page"] = "chatbot"
+    at.session_state["session_warmed"] = True
+    at.session_state["active_chat_id"] = "chat-0"
+    at.run()                   # first run loads the engine; not counted
+    PROFILER.reset()
+
+    for i in range(args.reruns):
+        if i % 10 == 5:
+            at.text_input(key="chat_search").input("cashier").run()
+        elif i % 10 == 6:
+            at.text_input(key="chat_search").input("").run()
+        elif i % 10 == 8:
+            try:
+                at.button(key="chat_page_next").click().run()
+            except KeyError:
+                at.run()
+        else:
+            at.run()
+        if at.exception:
+            sys.exit(f"app.py raised: {at.exception[0].message}")
+
+    report = PROFILER.report()
+    print(format_report(report))
+    if not args.baseline:
+        return 0
+    if args.update_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        lines, regressed = compare(json.load(f), report)
+    print("\n" + "\n".join(lines))
+    return 1 if regressed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
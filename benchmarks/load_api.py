@@ -0,0 +1,77 @@
+"""Concurrent load against the headless API (no browser needed).
+
+    python api_server.py --port 8000 &
+    python benchmarks/load_api.py --url http://127.0.0.1:8000 --users 20 --queries 5
+"""
+import json
+import time
+import argparse
+import statistics
+import threading
+import urllib.error
+import urllib.request
+
+QUESTIONS = [
+    "When is enrollment for the first term?",
+    "How do I apply for a leave of absence?",
+    "What are the requirements for the Dean's List?",
+    "Where can I get my certificate of registration?",
+    "How many units can I overload?",
+]
+
+def ask(url: str, query: str, stream: bool):
+    """Returns (status, seconds to first byte, total seconds)"""
+    body = json.dumps({"query": query, "stream": stream}).encode("utf-8")
+    request = urllib.request.Request(url + "/v1/ask", data=body, headers={"Content-Type": "application/json"})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=120) as response:
+            first = None
+            while True:
+                chunk = response.read1(4096) if stream else response.read()
+                if first is None:
+                    first = time.perf_counter() - started
+                if not chunk or not stream:
+                    break
+            return response.status, first, time.perf_counter() - started
+    except urllib.error.HTTPError as e:
+        return e.code, None, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=5)
+    parser.add_argument("--stream", action="store_true")
+    args = parser.parse_args()
+
+    results = []
+    lock = threading.Lock()
+
+    def user(i):
+        for j in range(args.queries):
+            result = ask(args.url, QUESTIONS[(i + j) % len(QUESTIONS)], args.stream)
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(args.users)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    ok = sorted(total for status, _, total in results if status == 200)
+    first = sorted(f for status, f, _ in results if status == 200 and f is not None)
+    statuses = {}
+    for status, _, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    print(f"{len(results)} requests in {elapsed:.1f}s ({len(results) / elapsed:.2f} req/s), statuses {statuses}")
+    if ok:
+        print(f"total  p50 {statistics.median(ok) * 1000:.0f}ms  p95 {ok[int(len(ok) * 0.95) - 1] * 1000:.0f}ms")
+    if first and args.stream:
+        print(f"first byte  p50 {statistics.median(first) * 1000:.0f}ms  p95 {first[int(len(first) * 0.95) - 1] * 1000:.0f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+CHAT_DB = os.getenv("MAPA_CHAT_DB", "chat_history.db")
+CHATS_PER_PAGE = int(os.getenv("MAPA_CHATS_PER_PAGE", "10"))
+TITLE_WEIGHT = 5.0           # bm25 weight of a title match relative to a message match
+SNIPPET_TOKENS = 12
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    seq INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    username TEXT NOT NULL,
+    title TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chats_by_user ON chats (username, updated DESC);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    chat_seq INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_chat ON messages (chat_seq, id);
+-- One document per message (rowid = messages.id) and one per chat title (rowid = -chats.seq),
+-- so appending a message indexes only that message; hits are grouped by chat at query time.
+-- owner is a hashed username token so a search only walks the student's own posting lists.
+CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5 (owner, title, body, chat UNINDEXED,
+                                                           tokenize = 'unicode61 remove_diacritics 2');
+"""
+
+def owner_token(username: str) -> str:
+    return "u" + hashlib.sha1(username.encode("utf-8")).hexdigest()[:16]
+
+def match_expression(query: str) -> str:
+    """Every word of the query as a quoted prefix term (FTS5 syntax in the input is not interpreted)"""
+    words = re.findall(r"\w+", query.lower())
+    return " ".join(f'"{w}"*' for w in words)
+
+def message_text(message: dict) -> str:
+    # Plain text only: the cited HTML version of an answer is not searched
+    return "\n".join(message[k] for k in ("user", "assistant") if isinstance(message.get(k), str))
+
+def title_from(text: str) -> str:
+    t = text.strip().splitlines()[0] if text.strip() else ""
+    return (t[:48] + "…") if len(t) > 49 else (t or "New chat")
+
+# -----------------------------
+# PERSISTED CHAT HISTORY + FULL-TEXT INDEX
+# CHAT_STORE stays the in-memory working set; this is what survives restarts and logouts.
+# -----------------------------
+class ChatHistory:
+
+    def __init__(self, path: str = CHAT_DB):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _seq(self, db, chat_id: str):
+        row = db.execute("SELECT seq FROM chats WHERE id = ?", (chat_id,)).fetchone()
+        return row[0] if row else None
+
+    # -----------------------------
+    # WRITES
+    # -----------------------------
+    def append(self, username: str, chat_id: str, message: dict):
+        """Store a message; the chat is created (titled after its first question) on its first message"""
+        text = message_text(message)
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            with db:
+                seq = self._seq(db, chat_id)
+                if seq is None:
+                    title = title_from(message.get("user", ""))
+                    seq = db.execute("INSERT INTO chats (id, username, title, created, updated) VALUES (?, ?, ?, ?, ?)",
+                                     (chat_id, username, title, now, now)).lastrowid
+                    db.execute("INSERT INTO message_fts (rowid, owner, title, body, chat) VALUES (?, ?, ?, '', ?)",
+                               (-seq, owner_token(username), title, seq))
+                else:
+                    db.execute("UPDATE chats SET updated = ? WHERE seq = ?", (now, seq))
+                message_id = db.execute("INSERT INTO messages (chat_seq, data) VALUES (?, ?)",
+                                        (seq, json.dumps(message, ensure_ascii=False))).lastrowid
+                if text:
+                    db.execute("INSERT INTO message_fts (rowid, owner, title, body, chat) VALUES (?, ?, '', ?, ?)",
+                               (message_id, owner_token(username), text, seq))
+
+    def amend_last(self, chat_id: str, fields: dict) -> bool:
+        """Mirror of ChatStore.amend_last for the stored copy (searchable text is unchanged)"""
+        with self._lock:
+            db = self._db()
+            with db:
+                row = db.execute(
+                    "SELECT m.id, m.data FROM messages m JOIN chats c ON c.seq = m.chat_seq "
+                    "WHERE c.id = ? ORDER BY m.id DESC LIMIT 1", (chat_id,)).fetchone()
+                if row is None:
+                    return False
+                message = json.loads(row[1])
+                message.update(fields)
+                db.execute("UPDATE messages SET data = ? WHERE id = ?", (json.dumps(message, ensure_ascii=False), row[0]))
+                return True
+
+    def rename(self, chat_id: str, title: str):
+        with self._lock:
+            db = self._db()
+            with db:
+                seq = self._seq(db, chat_id)
+                if seq is not None:
+                    db.execute("UPDATE chats SET title = ? WHERE seq = ?", (title, seq))
+                    db.execute("UPDATE message_fts SET title = ? WHERE rowid = ?", (title, -seq))
+
+    def delete_chat(self, chat_id: str):
+        with self._lock:
+            db = self._db()
+            with db:
+                seq = self._seq(db, chat_id)
+                if seq is not None:
+                    self._delete_seq(db, seq)
+
+    def delete_user(self, username: str):
+        with self._lock:
+            db = self._db()
+            with db:
+                for (seq,) in db.execute("SELECT seq FROM chats WHERE username = ?", (username,)).fetchall():
+                    self._delete_seq(db, seq)
+
+    def _delete_seq(self, db, seq: int):
+        db.execute("DELETE FROM message_fts WHERE rowid IN (SELECT id FROM messages WHERE chat_seq = ?) OR rowid = ?",
+                   (seq, -seq))
+        db.execute("DELETE FROM messages WHERE chat_seq = ?", (seq,))
+        db.execute("DELETE FROM chats WHERE seq = ?", (seq,))
+
+    # -----------------------------
+    # READS: one page at a time
+    # -----------------------------
+    def messages(self, chat_id: str):
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT m.data FROM messages m JOIN chats c ON c.seq = m.chat_seq WHERE c.id = ? ORDER BY m.id",
+                (chat_id,)).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def recent(self, username: str, page: int = 0, per_page: int = CHATS_PER_PAGE):
+        """([{id, title, updated}], total chats) for one page, newest first"""
+        with self._lock:
+            db = self._db()
+            total = db.execute("SELECT count(*) FROM chats WHERE username = ?", (username,)).fetchone()[0]
+            rows = db.execute("SELECT id, title, updated FROM chats WHERE username = ? "
+                              "ORDER BY updated DESC LIMIT ? OFFSET ?",
+                              (username, per_page, page * per_page)).fetchall()
+        return [{"id": r[0], "title": r[1], "updated": r[2]} for r in rows], total
+
+    def search(self, username: str, query: str, page: int = 0, per_page: int = CHATS_PER_PAGE):
+        """([{id, title, updated, snippet}], total matches) for one page, best match first"""
+        expression = match_expression(query)
+        if not expression:
+            return [], 0
+        match = f'owner:"{owner_token(username)}" AND {{title body}}: ({expression})'
+        # A chat ranks by its best-matching message (or title) and shows that one's snippet.
+        # LIMIT -1 keeps SQLite from flattening the subquery: bm25() and snippet() only work
+        # in the full-text query itself, not under the GROUP BY.
+        with self._lock:
+            db = self._db()
+            total = db.execute("SELECT count(DISTINCT chat) FROM message_fts WHERE message_fts MATCH ?",
+                               (match,)).fetchone()[0]
+            rows = db.execute(
+                f"SELECT c.id, c.title, c.updated, hits.snippet, min(hits.score) AS best FROM ("
+                f"  SELECT chat, bm25(message_fts, 0.0, {TITLE_WEIGHT}, 1.0, 0.0) AS score, "
+                f"  CASE WHEN body = '' THEN snippet(message_fts, 1, '**', '**', '…', {SNIPPET_TOKENS}) "
+                f"  ELSE snippet(message_fts, 2, '**', '**', '…', {SNIPPET_TOKENS}) END AS snippet "
+                f"  FROM message_fts WHERE message_fts MATCH ? LIMIT -1"
+                f") AS hits JOIN chats c ON c.seq = hits.chat "
+                f"GROUP BY hits.chat ORDER BY best LIMIT ? OFFSET ?",
+                (match, per_page, page * per_page)).fetchall()
+        return [{"id": r[0], "title": r[1], "updated": r[2], "snippet": r[3]} for r in rows], total
+
+CHAT_HISTORY = ChatHistory()
@@ -0,0 +1,145 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+MAX_BYTES = int(float(os.getenv("MAPA_CHAT_STORE_MB", "64")) * 1024 * 1024)
+IDLE_SECONDS = float(os.getenv("MAPA_SESSION_IDLE_MINUTES", "60")) * 60
+SWEEP_SECONDS = 60
+MESSAGE_OVERHEAD = 200   # rough per-message cost of the dict, keys and list slot
+
+def message_bytes(message: dict) -> int:
+    size = MESSAGE_OVERHEAD
+    for key, value in message.items():
+        size += len(key) + (len(value.encode("utf-8")) if isinstance(value, str) else 64)
+    return size
+
+# -----------------------------
+# SHARED, BOUNDED MESSAGE STORE
+# Sessions keep only chat ids and titles; message bodies live here, once per process.
+# -----------------------------
+class ChatStore:
+
+    def __init__(self, max_bytes: int = MAX_BYTES, idle_seconds: float = IDLE_SECONDS):
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.evicted_chats = 0
+        self.evicted_sessions = 0
+        self._chats = OrderedDict()      # chat_id -> {"session", "messages", "bytes"}, LRU order
+        self._sessions = {}              # session_id -> {"last_seen", "chats"}
+        self._bytes = 0
+        self._last_sweep = time.monotonic()
+        self._lock = threading.Lock()
+
+    def touch(self, session_id: str):
+        """Mark a session active; also sweeps idle sessions now and then"""
+        now = time.monotonic()
+        with self._lock:
+            self._sessions.setdefault(session_id, {"last_seen": now, "chats": set()})["last_seen"] = now
+            if now - self._last_sweep > SWEEP_SECONDS:
+                self._last_sweep = now
+                self._evict_idle(now)
+
+    def messages(self, chat_id: str, last: int = 0):
+        with self._lock:
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                return []
+            self._chats.move_to_end(chat_id)
+            return chat["messages"][-last:] if last else chat["messages"][:]
+
+    def append(self, session_id: str, chat_id: str, message: dict):
+        size = message_bytes(message)
+        with self._lock:
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = {"session": session_id, "messages": [], "bytes": 0}
+                self._sessions.setdefault(session_id, {"last_seen": time.monotonic(), "chats": set()})["chats"].add(chat_id)
+            chat["messages"].append(message)
+            chat["bytes"] += size
+            self._bytes += size
+            self._chats.move_to_end(chat_id)
+            self._evict_over_budget(keep=chat_id)
+
+    def amend_last(self, chat_id: str, fields: dict) -> bool:
+        """Add fields to the newest message of a chat (e.g. citations that arrive after rendering)"""
+        with self._lock:
+            chat = self._chats.get(chat_id)
+            if chat is None or not chat["messages"]:
+                return False
+            message = chat["messages"][-1]
+            before = message_bytes(message)
+            message.update(fields)
+            delta = message_bytes(message) - before
+            chat["bytes"] += delta
+            self._bytes += delta
+            self._evict_over_budget(keep=chat_id)
+            return True
+
+    def delete_chat(self, chat_id: str):
+        with self._lock:
+            self._remove_chat(chat_id)
+
+    def drop_session(self, session_id: str):
+        with self._lock:
+            self._drop_session(session_id)
+
+    def _remove_chat(self, chat_id: str):
+        chat = self._chats.pop(chat_id, None)
+        if chat is not None:
+            self._bytes -= chat["bytes"]
+            session = self._sessions.get(chat["session"])
+            if session:
+                session["chats"].discard(chat_id)
+        return chat
+
+    def _drop_session(self, session_id: str):
+        session = self._sessions.pop(session_id, None)
+        for chat_id in list(session["chats"]) if session else []:
+            self._remove_chat(chat_id)
+
+    def _evict_idle(self, now: float):
+        for session_id, session in list(self._sessions.items()):
+            if now - session["last_seen"] > self.idle_seconds:
+                self._drop_session(session_id)
+                self.evicted_sessions += 1
+
+    def _evict_over_budget(self, keep: str):
+        # Least recently used conversations go first; the one being written stays
+        for chat_id in list(self._chats):
+            if self._bytes <= self.max_bytes:
+                break
+            if chat_id != keep:
+                self._remove_chat(chat_id)
+                self.evicted_chats += 1
+
+    # -----------------------------
+    # MEMORY REPORTS
+    # -----------------------------
+    def session_report(self, session_id: str) -> dict:
+        with self._lock:
+            session = self._sessions.get(session_id) or {"chats": set(), "last_seen": None}
+            chats = [self._chats[c] for c in session["chats"] if c in self._chats]
+            return {
+                "chats": len(chats),
+                "messages": sum(len(c["messages"]) for c in chats),
+                "bytes": sum(c["bytes"] for c in chats),
+                "idle_seconds": round(time.monotonic() - session["last_seen"]) if session["last_seen"] else None,
+            }
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "chats": len(self._chats),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evicted_chats": self.evicted_chats,
+                "evicted_sessions": self.evicted_sessions,
+            }
+
+# One store per process, shared by every Streamlit session
+CHAT_STORE = ChatStore()
@@ -0,0 +1,148 @@
+import os
+import re
+import zlib
+import numpy as np
+
+# -----------------------------
+# CONFIG
+# Near-duplicate chunks (headers, footers, policy paragraphs copied across memos, and the
+# overlap between neighbouring chunks of such text) are collapsed before embedding.
+# -----------------------------
+DEDUP_ENABLED = os.getenv("MAPA_DEDUP", "1") != "0"
+DEDUP_THRESHOLD = float(os.getenv("MAPA_DEDUP_THRESHOLD", "0.8"))   # Jaccard similarity of shingle sets
+SHINGLE_WORDS = 5
+NUM_PERM = 128
+BANDS = 32                     # 32 bands x 4 rows: pairs at Jaccard 0.8 collide with p > 0.999
+MAX_PROVENANCE = 20            # other places listed in a canonical chunk's "also_in"
+_PRIME = 4294967311            # first prime above 2^32; with a < 2^32, a * x + b fits in uint64
+_WORD = re.compile(r"\w+")
+
+def shingles(text: str, words: int = SHINGLE_WORDS):
+    """Hashes of the word n-grams of a chunk (case and punctuation ignored)"""
+    tokens = _WORD.findall(text.lower())
+    if len(tokens) < words:
+        return {zlib.crc32(" ".join(tokens).encode("utf-8"))} if tokens else set()
+    return {zlib.crc32(" ".join(tokens[i:i + words]).encode("utf-8")) for i in range(len(tokens) - words + 1)}
+
+def _permutations(num_perm: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    return (rng.integers(1, 2 ** 32 - 1, size=num_perm, dtype=np.uint64),
+            rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64))
+
+def minhash(shingle_set, a, b):
+    """MinHash signature: the smallest hash of the set under each of the permutations"""
+    if not shingle_set:
+        return np.full(len(a), _PRIME, dtype=np.uint64)
+    x = np.fromiter(shingle_set, dtype=np.uint64, count=len(shingle_set))
+    return ((np.outer(x, a) + b) % _PRIME).min(axis=0)
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+def _location(doc) -> str:
+    source = os.path.basename(str(doc.metadata.get("source") or "document"))
+    page = doc.metadata.get("page")
+    return f"{source} p.{int(page) + 1}" if isinstance(page, (int, float)) else source
+
+# -----------------------------
+# DEDUP: LSH candidates, verified on exact shingle Jaccard against a group's canonical
+# Only canonical chunks are indexed, so a chain A~B~C never pulls C into A's group
+# unless C is itself a near-duplicate of A.
+# -----------------------------
+class NearDuplicateIndex:
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD, num_perm: int = NUM_PERM, bands: int = BANDS):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.a, self.b = _permutations(num_perm)
+        self.absorbed = {}          # key of an indexed canonical -> places of the chunks dropped for it
+        self._buckets = {}
+        self._sets = {}
+
+    def __len__(self):
+        return len(self._sets)
+
+    def _band_keys(self, shingle_set):
+        signature = minhash(shingle_set, self.a, self.b)
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def check(self, key, text: str):
+        """Key of the indexed canonical this text is a near-duplicate of; if there is none
+        the text becomes a canonical itself under key, and None is returned"""
+        shingle_set = shingles(text)
+        if not shingle_set:
+            return None
+        band_keys = self._band_keys(shingle_set)
+        best, best_score = None, self.threshold
+        for band_key in band_keys:
+            for candidate in self._buckets.get(band_key, ()):
+                score = jaccard(shingle_set, self._sets[candidate])
+                if score >= best_score:
+                    best, best_score = candidate, score
+        if best is not None:
+            return best
+        self._sets[key] = shingle_set
+        for band_key in band_keys:
+            self._buckets.setdefault(band_key, []).append(key)
+        return None
+
+def near_duplicate_groups(texts, threshold: float = DEDUP_THRESHOLD,
+                          num_perm: int = NUM_PERM, bands: int = BANDS):
+    """Groups of indexes (in input order, each group sorted) whose texts are near-duplicates
+    of the group's first text"""
+    index = NearDuplicateIndex(threshold, num_perm, bands)
+    groups = {}
+    for i, text in enumerate(texts):
+        match = index.check(i, text)
+        groups.setdefault(i if match is None else match, []).append(i)
+    return list(groups.values())
+
+def dedupe(docs, threshold: float = DEDUP_THRESHOLD, index: NearDuplicateIndex = None):
+    """(kept chunks, report). The first chunk of each near-duplicate group is kept and
+    records where its copies were (metadata "also_in" and "duplicates").
+    An index already holding the chunks of a published version (keyed by their ids) also
+    drops chunks that duplicate those; their places are left in index.absorbed."""
+    index = index or NearDuplicateIndex(threshold)
+    existing = len(index)
+    groups, absorbed = {}, 0
+    for i, doc in enumerate(docs):
+        key = ("new", i)
+        match = index.check(key, doc.page_content)
+        if match is None:
+            groups[key] = [i]
+        elif match in groups:
+            groups[match].append(i)
+        else:
+            index.absorbed.setdefault(match, []).append(_location(doc))
+            absorbed += 1
+    kept = []
+    for group in groups.values():
+        canonical = docs[group[0]]
+        if len(group) > 1:
+            places = []
+            for i in group[1:]:
+                place = _location(docs[i])
+                if place != _location(canonical) and place not in places:
+                    places.append(place)
+            # Chroma metadata values must be scalars
+            canonical.metadata["duplicates"] = len(group) - 1
+            canonical.metadata["also_in"] = "; ".join(places[:MAX_PROVENANCE])
+        kept.append(canonical)
+    chars_in = sum(len(d.page_content) for d in docs)
+    chars_out = sum(len(d.page_content) for d in kept)
+    report = {
+        "threshold": threshold,
+        "chunks_in": len(docs),
+        "chunks_out": len(kept),
+        "removed": len(docs) - len(kept),
+        "groups": sum(1 for g in groups.values() if len(g) > 1),
+        "largest_group": max((len(g) for g in groups.values()), default=0),
+        "chars_in": chars_in,
+        "chars_out": chars_out,
+        "reduction": round(1 - len(kept) / len(docs), 4) if docs else 0.0,
+    }
+    if existing:
+        report["indexed_chunks"] = existing
+        report["duplicates_of_index"] = absorbed
+    return kept, report
@@ -0,0 +1,92 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from langchain_core.embeddings import Embeddings
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+BATCH_WAIT_MS = float(os.getenv("MAPA_EMBED_BATCH_WAIT_MS", "4"))
+MAX_BATCH = int(os.getenv("MAPA_EMBED_MAX_BATCH", "32"))
+
+# -----------------------------
+# PROCESS-WIDE QUERY EMBEDDING DISPATCHER
+# -----------------------------
+class EmbeddingDispatcher:
+    """Collects query embeddings requested by concurrent sessions and runs them
+    as one embed_documents() forward pass instead of many batch-of-1 passes."""
+
+    def __init__(self, base: Embeddings, batch_wait_ms: float = BATCH_WAIT_MS, max_batch: int = MAX_BATCH):
+        self.base = base
+        self.batch_wait = batch_wait_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="mapa-embed-dispatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str):
+        return self.submit(text).result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        # One window from the first item: later arrivals don't extend it
+        deadline = time.monotonic() + self.batch_wait
+        try:
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                batch.append(self._queue.get(timeout=remaining))
+        except queue.Empty:
+            pass
+        # Anything already waiting rides along, up to the cap
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                vectors = self.base.embed_documents([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "queries": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
+
+class BatchedEmbeddings(Embeddings):
+    """Embeddings wrapper whose embed_query goes through the shared dispatcher.
+    Document embedding (index builds) is already batched and passes straight through."""
+
+    def __init__(self, base: Embeddings, batch_wait_ms: float = BATCH_WAIT_MS, max_batch: int = MAX_BATCH):
+        self.base = base
+        self.dispatcher = EmbeddingDispatcher(base, batch_wait_ms, max_batch)
+
+    def embed_documents(self, texts):
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.dispatcher.embed(text)
@@ -0,0 +1,400 @@
+import os
+import time
+import uuid
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from index_store import INDEX_ROOT, DEFAULT_PDFS, IndexWatcher, make_embeddings, read_current_version, RETRIEVER_K
+from ingest_queue import INGEST_QUEUE
+from metrics import REGISTRY, observe_answer, serving_samples
+from retrieval_server import RemoteIndex, SOCKET_PATH
+from embed_batcher import BatchedEmbeddings
+from pipeline import POOL, HotChunks, build_layout, history_messages
+from llm_adapter import LLMAdapter, estimate_tokens, make_provider
+from rate_limit import FairScheduler, QueueTimeout, RateLimiter
+from extractive import extractive_answer
+from retrieval_cache import CachedEmbeddings, RetrievalCache
+from trace_log import TRACE, TraceLog, answer_record
+from grounding import GROUNDING_WAIT_SECONDS, Grounding, GroundingVerifier
+from language import QueryTranslator
+from answer_bank import AnswerBank
+from knowledge_bases import DEFAULT_KB, KnowledgeBasePool, UnknownKnowledgeBase
+
+# -----------------------------
+# LATENCY BUDGET
+# -----------------------------
+# Both measured from the start of the request: retrieval and queueing for a slot count too
+FIRST_TOKEN_SECONDS = float(os.getenv("MAPA_FIRST_TOKEN_SECONDS", "6"))   # then fall back to extractive
+ANSWER_CEILING_SECONDS = float(os.getenv("MAPA_ANSWER_CEILING_SECONDS", "15"))
+
+def _left(started: float, seconds: float) -> float:
+    return max(0.0, started + seconds - time.perf_counter())
+
+# -----------------------------
+# RESULTS & ERRORS
+# -----------------------------
+class KnowledgeBaseNotReady(RuntimeError):
+    """No index version is loaded yet"""
+
+@dataclass
+class Answer:
+    request_id: str
+    text: str
+    index_version: str
+    documents: list = field(default_factory=list)
+    timings: dict = field(default_factory=dict)
+    degraded: str = ""          # why an extractive answer was served: "timeout", "error", "busy"
+    retrieval_cache_hit: bool = False
+    tokens: dict = field(default_factory=dict)     # estimated "prompt" / "output" tokens
+    language: str = "en"        # "en", "taglish" or "tl"
+    search_query: str = ""      # what retrieval used: the question, mapped into English if needed
+    from_bank: bool = False     # precomputed at index build time, no retrieval or LLM call
+    knowledge_base: str = DEFAULT_KB
+    generation: object = field(default=None, repr=False)
+    deadline: float = 0.0
+    grounding: object = field(default=None, repr=False)     # Future of a grounding.Grounding
+
+    def grounding_result(self, timeout: float = GROUNDING_WAIT_SECONDS):
+        """Sentence-level support and citations, or None if not checked / not ready in time"""
+        if self.grounding is None:
+            return None
+        try:
+            return self.grounding.result(timeout)
+        except Exception as e:
+            logging.error(e)
+            return None
+
+    def upgrade(self) -> bool:
+        """Wait (until the answer ceiling) for the LLM answer to replace the extractive one"""
+        if not self.degraded or self.generation is None:
+            return False
+        if self.generation.done.wait(max(0.0, self.deadline - time.perf_counter())) and self.generation.ok():
+            self.text = self.generation.text()
+            self.degraded = ""
+            self.timings["upgraded"] = True
+            return True
+        return False
+
+    def sources(self):
+        """Unique (source, page) pairs of the retrieved chunks, in rank order"""
+        seen = []
+        for doc in self.documents:
+            ref = {"source": doc.metadata.get("source"), "page": doc.metadata.get("page")}
+            if doc.metadata.get("also_in"):
+                ref["also_in"] = doc.metadata["also_in"]
+            if ref not in seen:
+                seen.append(ref)
+        return seen
+
+# -----------------------------
+# GENERATION RUNNING OFF THE CALLER'S THREAD, so the caller can keep a deadline
+# -----------------------------
+class _Generation:
+
+    def __init__(self, adapter, layout, scheduler):
+        self.parts = []
+        self.chunks = queue.Queue()
+        self.first_token = threading.Event()
+        self.done = threading.Event()
+        self.error = None
+        self._adapter = adapter
+        self._layout = layout
+        self._scheduler = scheduler
+        threading.Thread(target=self._run, name="mapa-generation", daemon=True).start()
+
+    def _run(self):
+        # The caller acquired the LLM slot; it is released when generation really ends
+        try:
+            for chunk in self._adapter.stream(self._layout):
+                self.parts.append(chunk)
+                self.chunks.put(chunk)
+                self.first_token.set()
+        except Exception as e:
+            self.error = e
+            logging.error(e)
+        finally:
+            self._scheduler.release()
+            self.first_token.set()
+            self.done.set()
+            self.chunks.put(None)
+
+    def ok(self) -> bool:
+        return self.error is None and bool(self.parts)
+
+    def text(self) -> str:
+        return "".join(self.parts)
+
+# -----------------------------
+# ENGINE: retrieval + generation, shared by the Streamlit UI and the HTTP API
+# -----------------------------
+class MapaEngine:
+
+    def __init__(self, index, embeddings=None, provider=None, limiter=None, scheduler=None, retrieval_cache=None,
+                 knowledge_bases=None):
+        self.index = index              # IndexWatcher or RemoteIndex: anything with current()
+        self.knowledge_bases = knowledge_bases     # KnowledgeBasePool for the other corpora, if any
+        self.embeddings = embeddings    # None when a retrieval daemon owns the model
+        self.retrieval_cache = retrieval_cache or RetrievalCache()
+        self.limiter = limiter or RateLimiter()
+        self.scheduler = scheduler or FairScheduler()
+        self.adapter = LLMAdapter(provider or make_provider())
+        self.hot_chunks = HotChunks()
+        self._kb_hot_chunks = {}        # per non-default knowledge base, so corpora never share a prefix
+        self.grounder = GroundingVerifier(embeddings)
+        self.trace = TRACE
+        self.translator = QueryTranslator(provider=self.adapter.provider)
+        self.answer_bank = AnswerBank(getattr(index, "root", INDEX_ROOT))
+
+    def route(self, user=None, requested=None) -> str:
+        """Knowledge base for a request: the one asked for, else the user's, else the default.
+        Raises UnknownKnowledgeBase for a name that isn't registered."""
+        if self.knowledge_bases is None:
+            if requested and requested != DEFAULT_KB:
+                raise UnknownKnowledgeBase(requested)
+            return DEFAULT_KB
+        return self.knowledge_bases.registry.route(user, requested)
+
+    def _hot(self, kb: str) -> HotChunks:
+        if kb == DEFAULT_KB:
+            return self.hot_chunks
+        if kb not in self._kb_hot_chunks:
+            self._kb_hot_chunks[kb] = HotChunks(self.hot_chunks.size)
+        return self._kb_hot_chunks[kb]
+
+    def _prepare(self, query: str, history, request_id, user, check_rate=True, kb=None):
+        if user and check_rate:
+            self.limiter.check(user)
+        kb = self.route(user, kb)
+        # Pin one index version for the whole request; a swap only affects the next query
+        handle = self.index.current() if kb == DEFAULT_KB else self.knowledge_bases.current(kb)
+        if handle is None:
+            raise KnowledgeBaseNotReady("Knowledge base is not ready")
+        # Tagalog/Taglish questions are searched in English: the index has one English embedding space
+        translation = self.translator.translate(query)
+        # Banked answers are for standalone questions; a follow-up may lean on the chat so far.
+        # They are in English, and a Tagalog/Taglish question is answered in its own language.
+        entry = None
+        if self.answer_bank is not None and not history and translation.language == "en":
+            entry = self.answer_bank.lookup(handle.version, query, root=handle.root)
+        if entry is not None:
+            return self._banked(entry, request_id, handle.version, translation, kb), None, []
+        # Retrieval starts immediately (or is already cached) and overlaps with prompt/history preparation
+        retrieval, hit = self.retrieval_cache.retrieve(POOL, handle.retriever, translation.text, handle.version, RETRIEVER_K)
+        answer = Answer(request_id=request_id or uuid.uuid4().hex, text="", index_version=handle.version,
+                        retrieval_cache_hit=hit, language=translation.language, search_query=translation.text,
+                        knowledge_base=kb)
+        if translation.language != "en":
+            answer.timings["translate_ms"] = translation.elapsed_ms
+        return answer, retrieval, history_messages(history)
+
+    @staticmethod
+    def _banked(entry, request_id, version, translation, kb) -> Answer:
+        answer = Answer(request_id=request_id or uuid.uuid4().hex, text=entry["answer"], index_version=version,
+                        documents=AnswerBank.documents(entry), language=translation.language,
+                        search_query=translation.text, from_bank=True, knowledge_base=kb)
+        answer.grounding = Future()
+        answer.grounding.set_result(Grounding.from_dict(entry["grounding"]))
+        return answer
+
+    def _retrieve(self, answer, retrieval, query: str, history_turns, started):
+        """Wait for the documents and lay out the prompt around them"""
+        answer.documents = retrieval.result()
+        # Behind a retrieval daemon the search reports the version it actually used
+        answer.index_version = getattr(answer.documents, "version", None) or answer.index_version
+        answer.timings["retrieval_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        hot_chunks = self._hot(answer.knowledge_base)
+        hot_chunks.record(answer.index_version, answer.documents)
+        layout = build_layout(hot_chunks.current(), answer.documents, history_turns, query)
+        answer.tokens["prompt"] = estimate_tokens(layout.as_text())
+        return layout
+
+    def _degrade(self, answer, query: str, reason: str, generation=None):
+        # Sentences are matched against the English chunks, so use the English form of the question
+        answer.text = extractive_answer(answer.search_query or query, answer.documents)
+        answer.degraded = reason
+        answer.generation = generation
+        return answer
+
+    def ground(self, answer):
+        """Check the final LLM text against its chunks in the background; the caller
+        renders the answer meanwhile and picks up answer.grounding when it is done"""
+        if answer.degraded or not answer.text or not answer.documents:
+            # Extractive answers are quoted from the chunks and already cited
+            answer.grounding = None
+        elif answer.language != "en":
+            # Tagalog/Taglish answers can't be matched against the English chunks sentence
+            # by sentence; every one would come back [unverified]
+            answer.grounding = None
+        else:
+            answer.grounding = POOL.submit(self.grounder.verify, answer.text, answer.documents)
+        return answer.grounding
+
+    def _start_generation(self, answer, layout, user, on_wait, started):
+        """Queue for a slot and start generating; returns None if no slot came up
+        before the first-token deadline"""
+        answer.deadline = started + ANSWER_CEILING_SECONDS
+        try:
+            self.scheduler.acquire(user or "anonymous", on_wait, timeout=_left(started, FIRST_TOKEN_SECONDS))
+        except QueueTimeout:
+            return None
+        finally:
+            answer.timings["queue_ms"] = round((time.perf_counter() - started) * 1000
+                                               - answer.timings["retrieval_ms"], 1)
+        return _Generation(self.adapter, layout, self.scheduler)
+
+    def answer(self, query: str, history=(), request_id=None, user=None, on_wait=None, channel="ui",
+               kb=None) -> Answer:
+        """Generated answer, or an extractive one (answer.degraded set) if the LLM misses
+        its first-token deadline, fails, or can't be scheduled. A late LLM answer can still
+        replace it via answer.upgrade() until the ceiling.
+        on_wait(position) is called while the request queues for an LLM slot.
+        kb names the knowledge base; by default the user's (see route())."""
+        answer = None
+        try:
+            answer = self._answer(query, history, request_id, user, on_wait, kb)
+        except Exception as e:
+            self.trace.write(answer_record(answer, query, user, channel, e))
+            observe_answer(answer, channel, e)
+            raise
+        self.trace.write(answer_record(answer, query, user, channel))
+        observe_answer(answer, channel)
+        return answer
+
+    def _answer(self, query, history, request_id, user, on_wait, kb):
+        started = time.perf_counter()
+        answer, retrieval, history_turns = self._prepare(query, list(history), request_id, user, kb=kb)
+        if answer.from_bank:
+            answer.timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            return answer
+        layout = self._retrieve(answer, retrieval, query, history_turns, started)
+        generation = self._start_generation(answer, layout, user, on_wait, started)
+        if generation is None:
+            self._degrade(answer, query, "busy")
+        elif not generation.first_token.wait(_left(started, FIRST_TOKEN_SECONDS)):
+            self._degrade(answer, query, "timeout", generation)
+        else:
+            answer.timings["first_token_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            if not generation.done.wait(max(0.0, answer.deadline - time.perf_counter())):
+                self._degrade(answer, query, "timeout")
+            elif not generation.ok():
+                self._degrade(answer, query, "error")
+            else:
+                answer.text = generation.text()
+                answer.tokens["output"] = estimate_tokens(answer.text)
+                self.ground(answer)
+        answer.timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return answer
+
+    def stream(self, query: str, history=(), request_id=None, user=None, check_rate=True, channel="api", kb=None):
+        """Yield ("meta", Answer), then ("token", str) chunks, then ("done", Answer).
+        Falls back to one extractive chunk under the same deadlines as answer(), and
+        stops at the answer ceiling. Pass check_rate=False if the caller already took
+        the user's rate token."""
+        answer = None
+        try:
+            for kind, value in self._stream(query, history, request_id, user, check_rate, kb):
+                if kind == "meta":
+                    answer = value
+                yield kind, value
+        except Exception as e:
+            self.trace.write(answer_record(answer, query, user, channel, e))
+            observe_answer(answer, channel, e)
+            raise
+        self.trace.write(answer_record(answer, query, user, channel))
+        observe_answer(answer, channel)
+
+    def _stream(self, query, history, request_id, user, check_rate, kb):
+        started = time.perf_counter()
+        answer, retrieval, history_turns = self._prepare(query, list(history), request_id, user, check_rate, kb)
+        if answer.from_bank:
+            answer.timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            yield "meta", answer
+            yield "token", answer.text
+            yield "done", answer
+            return
+        layout = self._retrieve(answer, retrieval, query, history_turns, started)
+        yield "meta", answer
+        generation = self._start_generation(answer, layout, user, None, started)
+        if (generation is None or not generation.first_token.wait(_left(started, FIRST_TOKEN_SECONDS))
+                or not generation.parts):
+            reason = "busy" if generation is None else ("error" if generation.error else "timeout")
+            self._degrade(answer, query, reason)
+            yield "token", answer.text
+        else:
+            answer.timings["first_token_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            while True:
+                try:
+                    chunk = generation.chunks.get(timeout=max(0.0, answer.deadline - time.perf_counter()))
+                except queue.Empty:
+                    answer.timings["truncated"] = True
+                    break
+                if chunk is None:
+                    break
+                yield "token", chunk
+            answer.text = generation.text()
+            answer.tokens["output"] = estimate_tokens(answer.text)
+            self.ground(answer)
+        answer.timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        yield "done", answer
+
+    def cache_report(self) -> dict:
+        report = {"retrieval": self.retrieval_cache.stats()}
+        if isinstance(self.embeddings, CachedEmbeddings):
+            report["query_embeddings"] = self.embeddings.cache.stats()
+        report["grounding_vectors"] = self.grounder.cache.stats()
+        report["query_translation"] = self.translator.stats()
+        if self.answer_bank is not None:
+            report["answer_bank"] = self.answer_bank.stats()
+        report["prompt_prefix"] = self.adapter.stats()
+        if self.knowledge_bases is not None:
+            report["knowledge_bases"] = self.knowledge_bases.stats()
+        return report
+
+    def limits_report(self) -> dict:
+        return {
+            "rate": {"allowed": self.limiter.allowed, "rejected": self.limiter.rejected},
+            "llm": self.scheduler.stats(),
+        }
+
+# -----------------------------
+# PROCESS-WIDE INSTANCE
+# -----------------------------
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine() -> MapaEngine:
+    """The one engine per process, so the UI and API share index, model and caches"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                if SOCKET_PATH:
+                    # Thin client: the retrieval daemon owns the model and vectors
+                    _engine = MapaEngine(RemoteIndex(SOCKET_PATH))
+                else:
+                    # Repeated queries skip the model; the rest share batched forward passes
+                    embeddings = CachedEmbeddings(BatchedEmbeddings(make_embeddings()))
+                    # Indexing runs in the background; until the first version is published
+                    # questions get KnowledgeBaseNotReady instead of the first user waiting on it
+                    INGEST_QUEUE.start(embeddings)
+                    if read_current_version() is None and not INGEST_QUEUE.pending(INDEX_ROOT):
+                        INGEST_QUEUE.enqueue(DEFAULT_PDFS)
+                    watcher = IndexWatcher(embeddings).start()
+                    # Other colleges' corpora are opened on first use and share the embedding model
+                    _engine = MapaEngine(watcher, embeddings,
+                                         knowledge_bases=KnowledgeBasePool(embeddings, default=watcher))
+                engine = _engine
+                REGISTRY.add_collector(lambda: serving_samples(engine, INGEST_QUEUE))
+    return _engine
+
+def make_offline_engine(embeddings, version: str, root: str, k: int, provider, workers: int, trace_path: str) -> MapaEngine:
+    """Engine pinned to one index version for batch jobs (evaluation, answer bank):
+    no hot chunks, so prompts don't depend on question order, no answer bank, own trace"""
+    index = IndexWatcher(embeddings, root=root, k=k).pin(version)
+    engine = MapaEngine(index, embeddings, provider=provider, scheduler=FairScheduler(slots=workers))
+    engine.hot_chunks = HotChunks(size=0)
+    engine.answer_bank = None
+    engine.trace = TraceLog(trace_path)
+    return engine
@@ -0,0 +1,223 @@
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import google.generativeai as genai
+from dotenv import load_dotenv
+from extractive import terms
+from index_store import (RETRIEVER_K, INDEX_ROOT, DEFAULT_PDFS,
+                         build_version, make_embeddings, prune_versions, read_current_version)
+from llm_adapter import GeminiProvider, RecordingProvider
+from engine import make_offline_engine
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+QUESTIONS_FILE = os.path.join("eval", "questions.jsonl")      # regenerate: python faq_extract.py > eval/questions.jsonl
+# Both are recorded once with a Gemini key and committed: python evaluate.py --mode record --update-baseline
+RECORDINGS_FILE = os.path.join("eval", "recordings.json")
+BASELINE_FILE = os.path.join("eval", "baseline.json")
+REPORT_FILE = os.path.join("eval", "report.json")
+TRACE_FILE = os.path.join("eval", "trace.jsonl")        # keeps eval runs out of the production analytics
+EVAL_INDEX_ROOT = os.path.join("eval", "indexes")       # --build versions; never next to the served ones
+KEEP_BUILDS = 3
+PASS_SCORE = float(os.getenv("MAPA_EVAL_PASS_SCORE", "0.5"))
+TOLERANCE = float(os.getenv("MAPA_EVAL_TOLERANCE", "0.02"))   # allowed drop in accuracy / mean score
+WORKERS = int(os.getenv("MAPA_EVAL_WORKERS", "8"))
+
+# Compared against the baseline: (metric, higher is better)
+TRACKED = [
+    ("accuracy", True), ("mean_score", True), ("mean_lexical", True), ("mean_embedding", True),
+    ("p50_total_ms", False), ("p95_total_ms", False), ("p95_retrieval_ms", False),
+    ("prompt_tokens", False), ("output_tokens", False), ("degraded", False),
+]
+
+def load_questions(path: str = QUESTIONS_FILE, limit: int = 0):
+    with open(path, "r", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return rows[:limit] if limit else rows
+
+def percentile(values, q: float):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+# -----------------------------
+# SCORING
+#   lexical    share of the reference's content words found in the answer
+#   embedding  cosine similarity of answer and reference
+# -----------------------------
+def lexical_score(answer: str, reference: str) -> float:
+    wanted = terms(reference)
+    return len(wanted & terms(answer)) / len(wanted) if wanted else 0.0
+
+def embedding_scores(embeddings, answers, references):
+    # One batch for every answer and reference, one row-wise dot product
+    vectors = np.asarray(embeddings.embed_documents(list(answers) + list(references)), dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    a, r = vectors[:len(answers)], vectors[len(answers):]
+    return np.clip((a * r).sum(axis=1), 0.0, 1.0)
+
+# -----------------------------
+# RUN: every question through the same engine the app uses
+# -----------------------------
+def run_questions(engine, questions, workers: int):
+    def one(row):
+        try:
+            answer = engine.answer(row["question"], channel="eval")
+            return {"text": answer.text, "timings": answer.timings, "tokens": answer.tokens,
+                    "degraded": answer.degraded or None, "docs": len(answer.documents), "error": None}
+        except Exception as e:
+            return {"text": "", "timings": {}, "tokens": {}, "degraded": None, "docs": 0, "error": type(e).__name__}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(one, questions))
+
+def build_report(questions, results, embeddings, meta: dict) -> dict:
+    semantic = embedding_scores(embeddings, [r["text"] or "-" for r in results], [q["answer"] for q in questions])
+    rows = []
+    for q, r, emb in zip(questions, results, semantic):
+        lexical = lexical_score(r["text"], q["answer"])
+        score = round((lexical + float(emb)) / 2, 3)
+        rows.append({
+            "question": q["question"],
+            "category": q.get("category"),
+            "score": score,
+            "lexical": round(lexical, 3),
+            "embedding": round(float(emb), 3),
+            "passed": score >= PASS_SCORE and not r["error"],
+            **r,
+        })
+    n = len(rows) or 1
+    summary = {
+        "questions": len(rows),
+        "accuracy": round(sum(r["passed"] for r in rows) / n, 3),
+        "mean_score": round(sum(r["score"] for r in rows) / n, 3),
+        "mean_lexical": round(sum(r["lexical"] for r in rows) / n, 3),
+        "mean_embedding": round(sum(r["embedding"] for r in rows) / n, 3),
+        "p50_total_ms": percentile([r["timings"].get("total_ms") for r in rows], 0.5),
+        "p95_total_ms": percentile([r["timings"].get("total_ms") for r in rows], 0.95),
+        "p95_retrieval_ms": percentile([r["timings"].get("retrieval_ms") for r in rows], 0.95),
+        "prompt_tokens": sum(r["tokens"].get("prompt", 0) for r in rows),
+        "output_tokens": sum(r["tokens"].get("output", 0) for r in rows),
+        "degraded": sum(bool(r["degraded"]) for r in rows),
+        "errors": sum(bool(r["error"]) for r in rows),
+    }
+    return {"meta": meta, "summary": summary, "questions": rows}
+
+# -----------------------------
+# BASELINE DIFF
+# -----------------------------
+def diff_reports(baseline: dict, report: dict):
+    """(lines to print, regressed?)"""
+    lines, regressed = [], False
+    old, new = baseline["summary"], report["summary"]
+    for metric, higher_is_better in TRACKED:
+        before, after = old.get(metric), new.get(metric)
+        if before is None or after is None:
+            continue
+        delta = after - before
+        worse = delta < 0 if higher_is_better else delta > 0
+        mark = "  " if delta == 0 else ("▼ " if worse else "▲ ")
+        lines.append(f"{mark}{metric:<18} {before:>10} -> {after:<10} ({delta:+.3f})")
+    for metric in ("accuracy", "mean_score"):
+        if new[metric] < old[metric] - TOLERANCE:
+            regressed = True
+
+    before_by_q = {r["question"]: r for r in baseline["questions"]}
+    flipped = [r["question"] for r in report["questions"]
+               if r["question"] in before_by_q and before_by_q[r["question"]]["passed"] and not r["passed"]]
+    if flipped:
+        lines.append(f"Newly failing ({len(flipped)}):")
+        lines.extend(f"  - {q}" for q in flipped)
+    return lines, regressed
+
+def _write_json(path: str, data: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+
+# -----------------------------
+# CLI: python evaluate.py [--mode replay|record|live] [--build] [--k 8] [--update-baseline]
+# -----------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end answer evaluation")
+    parser.add_argument("--questions", default=QUESTIONS_FILE)
+    parser.add_argument("--mode", choices=["replay", "record", "live"], default="replay",
+                        help="replay: recorded LLM only; record: call Gemini for unrecorded prompts; live: no recordings")
+    parser.add_argument("--recordings", default=RECORDINGS_FILE)
+    parser.add_argument("--root", default=INDEX_ROOT)
+    parser.add_argument("--version", help="index version to evaluate (default: CURRENT)")
+    parser.add_argument("--build", action="store_true",
+                        help="build a version with the current chunking settings under --build-root and evaluate it")
+    parser.add_argument("--build-root", default=EVAL_INDEX_ROOT)
+    parser.add_argument("--k", type=int, default=RETRIEVER_K)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--report", default=REPORT_FILE)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.mode == "replay" and not os.path.exists(args.recordings):
+        sys.exit(f"No recordings at {args.recordings}: run `python evaluate.py --mode record --update-baseline` "
+                 "once with GOOGLE_API_KEY set, then commit it and the baseline")
+    embeddings = make_embeddings()
+    root = args.root
+    if args.build:
+        root = args.build_root
+        version = build_version(DEFAULT_PDFS, embeddings, root)
+        prune_versions(KEEP_BUILDS, root)
+    else:
+        version = args.version or read_current_version(root)
+    if version is None:
+        sys.exit("No index version: run `python index_store.py build` or pass --build")
+    if args.mode != "replay":
+        load_dotenv()
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+    if args.mode == "live":
+        provider = GeminiProvider()
+    else:
+        provider = RecordingProvider(args.recordings, args.mode, base=GeminiProvider() if args.mode == "record" else None)
+
+    questions = load_questions(args.questions, args.limit)
+    # Pinned version, no hot chunks: the prompt (and so the replay key) doesn't depend on question order
+    engine = make_offline_engine(embeddings, version, root, args.k, provider, args.workers, TRACE_FILE)
+    results = run_questions(engine, questions, args.workers)
+    if args.mode == "record":
+        provider.save()
+
+    meta = {"index_version": version, "index_root": root, "k": args.k, "mode": args.mode, "questions_file": args.questions}
+    if isinstance(provider, RecordingProvider):
+        meta.update(replayed=provider.hits, missing_recordings=provider.misses if args.mode == "replay" else 0)
+    report = build_report(questions, results, embeddings, meta)
+    _write_json(args.report, report)
+
+    s = report["summary"]
+    print(f"{s['questions']} questions on index {version} (k={args.k}, {args.mode}): "
+          f"accuracy {s['accuracy']:.1%}, mean score {s['mean_score']:.3f}, p95 {s['p95_total_ms']} ms, "
+          f"{s['prompt_tokens'] + s['output_tokens']} tokens (est.)")
+    if meta.get("missing_recordings"):
+        print(f"warning: {meta['missing_recordings']} prompts had no recording; run with --mode record")
+
+    if args.update_baseline:
+        _write_json(args.baseline, report)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; save one with --update-baseline")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    lines, regressed = diff_reports(baseline, report)
+    print("\n".join(lines))
+    if regressed:
+        print(f"REGRESSION: accuracy or mean score dropped by more than {TOLERANCE}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
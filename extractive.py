@@ -0,0 +1,64 @@
+import os
+import re
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+MAX_SENTENCES = int(os.getenv("MAPA_EXTRACTIVE_SENTENCES", "3"))
+DEGRADED_PREFIX = "MAPA's AI model is slow to respond right now, so here is what the official documents say: "
+NO_MATCH_TEXT = "MAPA's AI model is slow to respond right now and I couldn't find a matching passage. Please try again shortly."
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "is", "are", "was", "be", "do", "does",
+    "i", "my", "me", "we", "you", "can", "how", "what", "when", "where", "who", "which", "why", "it",
+    "with", "at", "by", "from", "as", "this", "that", "there", "if", "will", "should", "about", "into",
+}
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+_WORD = re.compile(r"[a-z0-9']+")
+
+def terms(text: str):
+    return {w for w in _WORD.findall(text.lower()) if w not in STOPWORDS and len(w) > 1}
+
+def sentences(text: str, min_chars: int = 1):
+    """Whitespace-normalized sentences of a passage or an answer"""
+    found = []
+    for sentence in _SENTENCE_SPLIT.split(text or ""):
+        sentence = " ".join(sentence.split())
+        if len(sentence) >= min_chars:
+            found.append(sentence)
+    return found
+
+def citation(doc) -> str:
+    """[file.pdf p.N] for a retrieved chunk (PyPDFLoader pages are 0-based)"""
+    source = os.path.basename(str(doc.metadata.get("source") or "document"))
+    page = doc.metadata.get("page")
+    return f"[{source} p.{int(page) + 1}]" if isinstance(page, (int, float)) else f"[{source}]"
+
+# -----------------------------
+# EXTRACTIVE ANSWER FROM RETRIEVED CHUNKS
+# -----------------------------
+def extractive_answer(query: str, docs, max_sentences: int = MAX_SENTENCES) -> str:
+    """Best-matching sentences of the top chunks, each followed by its source"""
+    query_terms = terms(query)
+    candidates = []
+    for rank, doc in enumerate(docs):
+        for sentence in sentences(doc.page_content, min_chars=25):
+            overlap = len(query_terms & terms(sentence))
+            # Prefer overlap with the question, then the retriever's ranking
+            candidates.append((overlap, -rank, sentence, doc))
+    candidates.sort(key=lambda c: (c[0], c[1]), reverse=True)
+
+    picked, seen = [], set()
+    for overlap, _, sentence, doc in candidates:
+        if overlap == 0 and picked:
+            break
+        if sentence.lower() in seen:
+            continue
+        seen.add(sentence.lower())
+        picked.append(f"{sentence} {citation(doc)}")
+        if len(picked) >= max_sentences:
+            break
+    if not picked:
+        return NO_MATCH_TEXT
+    return DEGRADED_PREFIX + " ".join(picked)
@@ -0,0 +1,63 @@
+import re
+import sys
+import json
+from pypdf import PdfReader
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+FAQ_PDF = "qa_data.pdf"
+FIELDS = ("question", "answer", "category", "difficulty")
+# Survey rows where the respondent had nothing to report
+NON_ANSWERS = re.compile(r"can'?t (recall|remember)|^n/?a$|^none$|^no$", re.IGNORECASE)
+
+_HEADER = re.compile(r"^\s*question\s+answer\s+category\s+difficulty\s*$")
+
+# -----------------------------
+# PARSING
+# qa_data.pdf is a four-column table repeated per row. pypdf's layout mode keeps the
+# columns aligned, so each line is cut at the header's column offsets.
+# -----------------------------
+def _columns(header: str):
+    return [header.index(name) for name in FIELDS]
+
+def _cut(line: str, starts):
+    cells = []
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else None
+        cells.append(line[start:end].strip() if len(line) > start else "")
+    return cells
+
+def parse_faq(path: str = FAQ_PDF):
+    """[{question, answer, category, difficulty}] in document order"""
+    rows, row, starts = [], None, None
+    reader = PdfReader(path)
+    for page in reader.pages:
+        for line in page.extract_text(extraction_mode="layout").splitlines():
+            if _HEADER.match(line):
+                if row:
+                    rows.append(row)
+                row, starts = {name: [] for name in FIELDS}, _columns(line)
+                continue
+            if row is None or not line.strip():
+                continue
+            for name, cell in zip(FIELDS, _cut(line, starts)):
+                if cell:
+                    row[name].append(cell)
+    if row:
+        rows.append(row)
+    return [{name: " ".join(parts) for name, parts in r.items()} for r in rows]
+
+def load_faq(path: str = FAQ_PDF):
+    """FAQ rows usable as question/reference pairs (both sides present and informative)"""
+    faq = []
+    for row in parse_faq(path):
+        if not row["question"] or not row["answer"] or NON_ANSWERS.search(row["answer"]):
+            continue
+        faq.append(row)
+    return faq
+
+if __name__ == "__main__":
+    # python faq_extract.py [qa_data.pdf] > questions.jsonl
+    for row in load_faq(sys.argv[1] if len(sys.argv) > 1 else FAQ_PDF):
+        print(json.dumps(row, ensure_ascii=False))
@@ -0,0 +1,145 @@
+import os
+import time
+from dataclasses import dataclass, field, asdict
+import numpy as np
+from extractive import citation, sentences, terms
+from pipeline import chunk_key
+from retrieval_cache import ByteLRU
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+GROUNDING_THRESHOLD = float(os.getenv("MAPA_GROUNDING_THRESHOLD", "0.6"))     # cosine, answer sentence vs source sentence
+LEXICAL_THRESHOLD = 0.5          # share of a sentence's terms found in one source sentence (no local model)
+GROUNDING_WAIT_SECONDS = float(os.getenv("MAPA_GROUNDING_WAIT_SECONDS", "5"))
+CHUNK_VECTOR_CACHE_BYTES = int(float(os.getenv("MAPA_GROUNDING_CACHE_MB", "16")) * 1024 * 1024)
+MIN_CHECKED_CHARS = 20           # "Yes." or a greeting isn't a claim worth flagging
+
+# -----------------------------
+# RESULT
+# -----------------------------
+@dataclass
+class Grounding:
+    sentences: list = field(default_factory=list)   # [{"text", "score", "citation", "supported"}]; supported None = not checked
+    method: str = "embedding"
+    elapsed_ms: float = 0.0
+
+    def unsupported(self):
+        return [s["text"] for s in self.sentences if s["supported"] is False]
+
+    def supported_ratio(self) -> float:
+        checked = [s for s in self.sentences if s["supported"] is not None]
+        return round(sum(s["supported"] for s in checked) / len(checked), 3) if checked else 1.0
+
+    def cited_text(self) -> str:
+        """Answer with [file.pdf p.N] after each supported sentence and unsupported ones marked"""
+        parts = []
+        for s in self.sentences:
+            if s["supported"]:
+                parts.append(f"{s['text']} {s['citation']}")
+            elif s["supported"] is False:
+                parts.append(f"{s['text']} [unverified]")
+            else:
+                parts.append(s["text"])
+        return " ".join(parts)
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "supported_ratio": self.supported_ratio()}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(sentences=data.get("sentences", []), method=data.get("method", "embedding"),
+                   elapsed_ms=data.get("elapsed_ms", 0.0))
+
+# -----------------------------
+# VERIFIER: aligns each answer sentence with its closest retrieved source sentence
+# -----------------------------
+def _unit_rows(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+class GroundingVerifier:
+
+    def __init__(self, embeddings=None, threshold: float = GROUNDING_THRESHOLD,
+                 cache_bytes: int = CHUNK_VECTOR_CACHE_BYTES):
+        self.embeddings = embeddings    # None (retrieval daemon mode): fall back to term overlap
+        self.threshold = threshold
+        self.cache = ByteLRU(cache_bytes)
+
+    def _chunk_sentences(self, docs):
+        """Source sentences of all chunks with the chunk each came from"""
+        texts, owners = [], []
+        for doc in docs:
+            for sentence in sentences(doc.page_content, min_chars=MIN_CHECKED_CHARS):
+                texts.append(sentence)
+                owners.append(doc)
+        return texts, owners
+
+    def _chunk_vectors(self, docs) -> np.ndarray:
+        # Chunks repeat across questions; their sentence vectors are embedded once per chunk
+        blocks, missing = {}, []
+        for doc in docs:
+            key = chunk_key(doc)
+            block = self.cache.get(key)
+            if block is None:
+                missing.append((key, doc))
+            else:
+                blocks[key] = block
+        if missing:
+            per_doc = [sentences(doc.page_content, min_chars=MIN_CHECKED_CHARS) for _, doc in missing]
+            flat = [s for group in per_doc for s in group]
+            vectors = _unit_rows(self.embeddings.embed_documents(flat)) if flat else np.zeros((0, 0), np.float32)
+            start = 0
+            for (key, _), group in zip(missing, per_doc):
+                block = vectors[start:start + len(group)]
+                start += len(group)
+                blocks[key] = block
+                self.cache.put(key, block, block.nbytes)
+        rows = [blocks[chunk_key(doc)] for doc in docs if len(blocks[chunk_key(doc)])]
+        return np.vstack(rows) if rows else np.zeros((0, 0), np.float32)
+
+    def _embedding_scores(self, claims, docs):
+        sources = self._chunk_vectors(docs)
+        if not len(sources):
+            return np.zeros(len(claims)), np.zeros(len(claims), dtype=int)
+        # One matrix product scores every (answer sentence, source sentence) pair
+        similarity = _unit_rows(self.embeddings.embed_documents(claims)) @ sources.T
+        return similarity.max(axis=1), similarity.argmax(axis=1)
+
+    @staticmethod
+    def _lexical_scores(claims, source_texts):
+        source_terms = [terms(s) for s in source_texts]
+        scores, best = [], []
+        for claim in claims:
+            claim_terms = terms(claim)
+            overlaps = [len(claim_terms & source) / len(claim_terms) if claim_terms else 0.0 for source in source_terms]
+            i = int(np.argmax(overlaps)) if overlaps else 0
+            scores.append(overlaps[i] if overlaps else 0.0)
+            best.append(i)
+        return np.asarray(scores), np.asarray(best, dtype=int)
+
+    def verify(self, text: str, docs) -> Grounding:
+        started = time.perf_counter()
+        answer_sentences = sentences(text)
+        source_texts, owners = self._chunk_sentences(docs)
+        checked = [i for i, s in enumerate(answer_sentences) if len(s) >= MIN_CHECKED_CHARS]
+        claims = [answer_sentences[i] for i in checked]
+
+        method = "embedding" if self.embeddings is not None else "lexical"
+        if not claims or not source_texts:
+            scores, best = np.zeros(len(claims)), np.zeros(len(claims), dtype=int)
+        elif method == "embedding":
+            scores, best = self._embedding_scores(claims, docs)
+        else:
+            scores, best = self._lexical_scores(claims, source_texts)
+        threshold = self.threshold if method == "embedding" else LEXICAL_THRESHOLD
+
+        result = [{"text": s, "score": None, "citation": None, "supported": None} for s in answer_sentences]
+        for row, i in enumerate(checked):
+            score = float(scores[row])
+            supported = bool(source_texts) and score >= threshold
+            result[i].update(score=round(score, 3), supported=supported,
+                             citation=citation(owners[int(best[row])]) if supported else None)
+        return Grounding(sentences=result, method=method,
+                         elapsed_ms=round((time.perf_counter() - started) * 1000, 1))
@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+import argparse
+import threading
+from dataclasses import dataclass
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_chroma import Chroma
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_huggingface import HuggingFaceEmbeddings
+from vector_backends import ANN_BACKEND, hnsw_metadata, make_retriever
+from sections import assign_sections, build_sections, write_sections
+from dedup import DEDUP_ENABLED, dedupe
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+INDEX_ROOT = os.getenv("MAPA_INDEX_DIR", "indexes")
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_PDFS = ["qa_data.pdf", "llama2-deep-dataset.pdf"]
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 120
+RETRIEVER_K = 8
+POLL_SECONDS = float(os.getenv("MAPA_INDEX_POLL_SECONDS", "10"))
+WARMUP_QUERY = "When is enrollment?"
+
+# -----------------------------
+# LOAD PDFs
+# -----------------------------
+def load_local_pdfs(paths):
+    documents = []
+    for pdf_path in paths:
+        if os.path.exists(pdf_path):
+            try:
+                loader = PyPDFLoader(pdf_path)
+                docs = loader.load()
+                documents.extend(docs)
+            except Exception:
+                pass
+    return documents
+
+def make_embeddings():
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+
+# -----------------------------
+# VERSIONED INDEX DIRECTORY
+#   indexes/<version>/      one Chroma persist directory per build
+#   indexes/CURRENT         name of the version being served
+# -----------------------------
+def new_version_id() -> str:
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+def version_path(version: str, root: str = INDEX_ROOT) -> str:
+    return os.path.join(root, version)
+
+def read_current_version(root: str = INDEX_ROOT):
+    """Return the published version id, or None if nothing is published yet"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r") as f:
+            version = f.read().strip()
+    except OSError:
+        return None
+    if version and os.path.isdir(version_path(version, root)):
+        return version
+    return None
+
+def publish_version(version: str, root: str = INDEX_ROOT):
+    """Atomically point CURRENT at an already built version"""
+    if not os.path.isdir(version_path(version, root)):
+        raise FileNotFoundError(f"Index version {version} does not exist in {root}")
+    tmp_path = os.path.join(root, f".{CURRENT_FILE}.{uuid.uuid4().hex[:6]}")
+    with open(tmp_path, "w") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+
+def read_manifest(version: str, root: str = INDEX_ROOT) -> dict:
+    try:
+        with open(os.path.join(version_path(version, root), MANIFEST_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def list_versions(root: str = INDEX_ROOT):
+    """Built versions, oldest first"""
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name for name in os.listdir(root)
+        if not name.startswith(".") and os.path.isdir(os.path.join(root, name))
+    )
+
+def build_version(paths, embeddings, root: str = INDEX_ROOT) -> str:
+    """Embed the given PDFs into a new, unpublished index version"""
+    documents = load_local_pdfs(paths)
+    if not documents:
+        raise ValueError("No documents could be loaded from: " + ", ".join(paths))
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    split_docs = splitter.split_documents(documents)
+    dedup_report = None
+    if DEDUP_ENABLED:
+        # Boilerplate repeated across memos would otherwise fill several of the top-k slots
+        split_docs, dedup_report = dedupe(split_docs)
+    split_docs = assign_sections(split_docs)
+
+    version = new_version_id()
+    os.makedirs(root, exist_ok=True)
+    # Build under a hidden name so a half-written version is never visible
+    tmp_dir = os.path.join(root, f".building-{version}")
+    vectorstore = Chroma.from_documents(split_docs, embeddings, persist_directory=tmp_dir,
+                                        collection_metadata=hnsw_metadata())
+    # Section level over the chunk index: centroids and summaries, for MAPA_ANN_BACKEND=sections
+    data = vectorstore.get(include=["embeddings", "metadatas", "documents"])
+    sections, centroids = build_sections(data["embeddings"], data["metadatas"], data["documents"])
+    write_sections(tmp_dir, sections, centroids)
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+        json.dump({
+            "version": version,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "sources": [os.path.basename(p) for p in paths if os.path.exists(p)],
+            "documents": len(documents),
+            "chunks": len(split_docs),
+            "sections": len(sections),
+            "dedup": dedup_report,
+            "embedding_model": EMBEDDING_MODEL,
+            "hnsw": hnsw_metadata(),
+        }, f, indent=2)
+    os.rename(tmp_dir, version_path(version, root))
+    return version
+
+def prune_versions(keep: int = 3, root: str = INDEX_ROOT):
+    """Delete old versions, never touching the one CURRENT points at"""
+    current = read_current_version(root)
+    removed = []
+    for version in list_versions(root)[:-keep] if keep > 0 else list_versions(root):
+        if version != current:
+            shutil.rmtree(version_path(version, root), ignore_errors=True)
+            removed.append(version)
+    return removed
+
+def open_version(version: str, embeddings, root: str = INDEX_ROOT):
+    return Chroma(persist_directory=version_path(version, root), embedding_function=embeddings)
+
+# -----------------------------
+# HOT RELOAD
+# -----------------------------
+@dataclass(frozen=True)
+class IndexHandle:
+    """One opened index version. Callers keep the handle for a whole request,
+    so a swap never changes the retriever underneath an in-flight query."""
+    version: str
+    vectorstore: Chroma
+    retriever: object
+    root: str = INDEX_ROOT
+
+class IndexWatcher:
+    """Follows CURRENT and swaps the shared retriever when it moves"""
+
+    def __init__(self, embeddings, root: str = INDEX_ROOT, k: int = RETRIEVER_K,
+                 poll_seconds: float = POLL_SECONDS, backend: str = ANN_BACKEND):
+        self.embeddings = embeddings
+        self.root = root
+        self.k = k
+        self.backend = backend
+        self.poll_seconds = poll_seconds
+        self._handle = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def current(self):
+        return self._handle
+
+    def _open(self, version: str) -> IndexHandle:
+        vectorstore = open_version(version, self.embeddings, self.root)
+        retriever = make_retriever(vectorstore, self.embeddings, self.k, self.backend,
+                                   path=version_path(version, self.root))
+        # Warm up: loads the collection and embedding model before any user waits on it
+        retriever.invoke(WARMUP_QUERY)
+        return IndexHandle(version=version, vectorstore=vectorstore, retriever=retriever, root=self.root)
+
+    def refresh(self) -> bool:
+        """Swap to the published version if it changed. Returns True on swap."""
+        version = read_current_version(self.root)
+        if version is None or (self._handle and self._handle.version == version):
+            return False
+        with self._lock:
+            if self._handle and self._handle.version == version:
+                return False
+            handle = self._open(version)
+            self._handle = handle
+        logging.warning("MAPA index switched to version %s", version)
+        return True
+
+    def pin(self, version: str):
+        """Serve one version and don't follow CURRENT (evaluation, comparisons)"""
+        with self._lock:
+            self._handle = self._open(version)
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.refresh()
+            except Exception as e:
+                # Keep serving the old version if the new one fails to open
+                logging.error(e)
+
+    def start(self):
+        self.refresh()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="mapa-index-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+def ensure_published(embeddings, paths=DEFAULT_PDFS, root: str = INDEX_ROOT) -> str:
+    """Build and publish a first version if nothing is published yet"""
+    version = read_current_version(root)
+    if version is None:
+        version = build_version(paths, embeddings, root)
+        publish_version(version, root)
+    return version
+
+# -----------------------------
+# CLI: python index_store.py build|publish|list|prune
+# -----------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage MAPA's versioned vector index")
+    parser.add_argument("--root", default=INDEX_ROOT)
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Embed PDFs into a new version")
+    build.add_argument("pdfs", nargs="*", default=DEFAULT_PDFS)
+    build.add_argument("--no-publish", action="store_true")
+    build.add_argument("--answer-bank", action="store_true",
+                       help="pre-generate answers for likely questions before publishing (answer_bank.py)")
+    publish = sub.add_parser("publish", help="Point CURRENT at a version")
+    publish.add_argument("version")
+    sub.add_parser("list", help="List built versions")
+    prune = sub.add_parser("prune", help="Delete old versions")
+    prune.add_argument("--keep", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        embeddings = make_embeddings()
+        version = build_version(args.pdfs, embeddings, args.root)
+        if args.answer_bank:
+            from answer_bank import build_for_version
+            build_for_version(version, args.root, os.getenv("MAPA_LLM_PROVIDER", "gemini"), embeddings=embeddings)
+        if not args.no_publish:
+            publish_version(version, args.root)
+        print(version)
+    elif args.command == "publish":
+        publish_version(args.version, args.root)
+    elif args.command == "list":
+        current = read_current_version(args.root)
+        for version in list_versions(args.root):
+            manifest = read_manifest(version, args.root)
+            marker = "*" if version == current else " "
+            print(f"{marker} {version}  chunks={manifest.get('chunks', '?')}  sources={manifest.get('sources', [])}")
+    elif args.command == "prune":
+        for version in prune_versions(args.keep, args.root):
+            print(f"removed {version}")
+
+if __name__ == "__main__":
+    main()
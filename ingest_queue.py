@@ -0,0 +1,465 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import logging
+import argparse
+import threading
+from langchain_chroma import Chroma
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from index_store import (INDEX_ROOT, CHUNK_SIZE, CHUNK_OVERLAP, MANIFEST_FILE, EMBEDDING_MODEL, RETRIEVER_K,
+                         IndexWatcher, load_local_pdfs, make_embeddings, new_version_id, publish_version,
+                         read_current_version, read_manifest, version_path)
+from vector_backends import hnsw_metadata
+from sections import assign_sections, build_sections, write_sections
+from dedup import DEDUP_ENABLED, MAX_PROVENANCE, NearDuplicateIndex, dedupe
+from answer_bank import BANK_FILE, carry_forward
+
+# -----------------------------
+# CONFIG
+# A job adds PDFs to a knowledge base: parse -> chunk -> embed -> upsert (in batches) ->
+# publish. It works on a copy of the published version, so serving never waits on it;
+# the IndexWatcher picks the new version up like any other.
+# -----------------------------
+INGEST_DB = os.getenv("MAPA_INGEST_DB", "ingest_jobs.db")
+UPLOAD_DIR = os.getenv("MAPA_UPLOAD_DIR", "uploads")
+INGEST_WORKERS = int(os.getenv("MAPA_INGEST_WORKERS", "2"))
+BATCH_SIZE = int(os.getenv("MAPA_INGEST_BATCH", "64"))
+POLL_SECONDS = 2.0
+STALE_SECONDS = 120            # a running job without a heartbeat this long was orphaned by a crash
+HEARTBEAT_SECONDS = 15         # beaten on a timer while a job is claimed, not just between batches
+STAGES = ("parse", "chunk", "embed", "upsert", "publish")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kb TEXT NOT NULL,
+    root TEXT NOT NULL,
+    files TEXT NOT NULL,
+    state TEXT NOT NULL,            -- queued | running | done | failed
+    stage TEXT,
+    owner TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    heartbeat REAL,
+    finished REAL,
+    progress TEXT NOT NULL DEFAULT '{}',
+    chunks INTEGER NOT NULL DEFAULT 0,
+    batches INTEGER NOT NULL DEFAULT 0,  -- embedded and upserted batches, so a resumed job skips them
+    base TEXT,
+    version TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, created);
+"""
+
+def staging_path(job_id: str, root: str) -> str:
+    # Dot-prefixed: list_versions and prune never see it
+    return os.path.join(root, f".ingest-{job_id}")
+
+def _chroma_files(folder, names):
+    """copytree filter: only Chroma's own files; the rest of a version is derived from them"""
+    if os.path.exists(os.path.join(folder, MANIFEST_FILE)):
+        return [n for n in names if n != "chroma.sqlite3" and not os.path.isdir(os.path.join(folder, n))]
+    return []
+
+def _file_of(metadata) -> str:
+    return os.path.basename(str((metadata or {}).get("source") or ""))
+
+def chunk_ids(chunks):
+    """<file name>#<n>: the same for every upload of a file, so a new upload overwrites the old"""
+    counts, ids = {}, []
+    for chunk in chunks:
+        name = _file_of(chunk.metadata)
+        ids.append(f"{name}#{counts.get(name, 0)}")
+        counts[name] = counts.get(name, 0) + 1
+    return ids
+
+def _throughput(progress: dict) -> dict:
+    return {stage: round(p["done"] / p["seconds"], 1) if p.get("seconds") else None
+            for stage, p in progress.items()}
+
+# -----------------------------
+# PERSISTENT JOB QUEUE (SQLite, survives restarts)
+# -----------------------------
+class IngestQueue:
+
+    def __init__(self, path: str = INGEST_DB, upload_dir: str = UPLOAD_DIR,
+                 workers: int = INGEST_WORKERS, batch_size: int = BATCH_SIZE):
+        self.path = path
+        self.upload_dir = upload_dir
+        self.workers = workers
+        self.batch_size = batch_size
+        self._conn = None
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stop = threading.Event()
+        self._embeddings = None
+        self._embeddings_lock = threading.Lock()
+
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _update(self, job_id: str, **fields):
+        fields["heartbeat"] = time.time()
+        with self._lock:
+            db = self._db()
+            with db:
+                db.execute(f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                           (*fields.values(), job_id))
+
+    # -----------------------------
+    # SUBMITTING
+    # -----------------------------
+    def enqueue(self, paths, kb: str = "default", root: str = INDEX_ROOT) -> str:
+        job_id = time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        with self._lock:
+            db = self._db()
+            with db:
+                db.execute("INSERT INTO jobs (id, kb, root, files, state, created) VALUES (?, ?, ?, ?, 'queued', ?)",
+                           (job_id, kb, root, json.dumps([os.path.abspath(p) for p in paths]), time.time()))
+        return job_id
+
+    def submit(self, uploads, kb: str = "default", root: str = INDEX_ROOT) -> str:
+        """Save uploaded (filename, bytes) pairs and queue them as one job"""
+        folder = os.path.join(self.upload_dir, uuid.uuid4().hex[:12])
+        os.makedirs(folder, exist_ok=True)
+        paths = []
+        for name, data in uploads:
+            path = os.path.join(folder, os.path.basename(name))
+            with open(path, "wb") as f:
+                f.write(data)
+            paths.append(path)
+        return self.enqueue(paths, kb, root)
+
+    def pending(self, root: str = INDEX_ROOT) -> bool:
+        with self._lock:
+            row = self._db().execute("SELECT 1 FROM jobs WHERE root = ? AND state IN ('queued', 'running') LIMIT 1",
+                                     (root,)).fetchone()
+        return row is not None
+
+    def depth(self) -> dict:
+        """Number of jobs in each state"""
+        with self._lock:
+            return dict(self._db().execute("SELECT state, count(*) FROM jobs GROUP BY state").fetchall())
+
+    def retry(self, job_id: str):
+        """Queue a failed job again; it resumes after its last committed batch"""
+        with self._lock:
+            db = self._db()
+            with db:
+                db.execute("UPDATE jobs SET state = 'queued', error = NULL, owner = NULL WHERE id = ? AND state = 'failed'",
+                           (job_id,))
+
+    def jobs(self, limit: int = 20):
+        with self._lock:
+            cursor = self._db().execute("SELECT * FROM jobs ORDER BY created DESC LIMIT ?", (limit,))
+            names = [c[0] for c in cursor.description]
+            rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+        for row in rows:
+            row["files"] = [os.path.basename(p) for p in json.loads(row["files"])]
+            row["progress"] = json.loads(row["progress"])
+            row["throughput"] = _throughput(row["progress"])
+        return rows
+
+    def _claim(self, owner: str):
+        """Oldest queued (or orphaned) job whose knowledge base has no other job running"""
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            with db:
+                # Write lock up front: worker pools of other processes claim from the same file
+                db.execute("BEGIN IMMEDIATE")
+                busy = {r[0] for r in db.execute(
+                    "SELECT root FROM jobs WHERE state = 'running' AND heartbeat >= ?", (now - STALE_SECONDS,))}
+                for job_id, root in db.execute(
+                        "SELECT id, root FROM jobs WHERE state = 'queued' OR (state = 'running' AND heartbeat < ?) "
+                        "ORDER BY created", (now - STALE_SECONDS,)).fetchall():
+                    if root in busy:
+                        continue
+                    db.execute("UPDATE jobs SET state = 'running', owner = ?, heartbeat = ?, "
+                               "started = coalesce(started, ?) WHERE id = ?", (owner, now, now, job_id))
+                    cursor = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+                    return dict(zip([c[0] for c in cursor.description], cursor.fetchone()))
+        return None
+
+    # -----------------------------
+    # WORKER POOL
+    # -----------------------------
+    def start(self, embeddings=None):
+        """Start the worker threads (once per process); embeddings are shared with the engine"""
+        if self._threads:
+            return self
+        self._embeddings = embeddings
+        for n in range(max(1, self.workers)):
+            thread = threading.Thread(target=self._work, args=(f"{os.getpid()}-{n}",),
+                                      name=f"mapa-ingest-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def started(self) -> bool:
+        return bool(self._threads)
+
+    def _beat(self, job_id: str, owner: str, done: threading.Event):
+        # A long parse or section build must not look like a crash to other workers
+        while not done.wait(HEARTBEAT_SECONDS):
+            try:
+                with self._lock:
+                    db = self._db()
+                    with db:
+                        db.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND owner = ? AND state = 'running'",
+                                   (time.time(), job_id, owner))
+            except sqlite3.Error as e:
+                logging.error(e)
+
+    def _get_embeddings(self):
+        with self._embeddings_lock:
+            if self._embeddings is None:
+                self._embeddings = make_embeddings()
+            return self._embeddings
+
+    def _work(self, owner: str):
+        while not self._stop.is_set():
+            try:
+                job = self._claim(owner)
+            except sqlite3.Error as e:
+                logging.error(e)
+                job = None
+            if job is None:
+                self._stop.wait(POLL_SECONDS)
+                continue
+            done = threading.Event()
+            threading.Thread(target=self._beat, args=(job["id"], owner, done),
+                             name=f"mapa-ingest-heartbeat-{job['id']}", daemon=True).start()
+            try:
+                self.run(job)
+            except Exception as e:
+                logging.error(e)
+                self._update(job["id"], state="failed", error=str(e), finished=time.time())
+            finally:
+                done.set()
+
+    def run(self, job: dict):
+        """Run one claimed job to completion and return the published version,
+        or None if CURRENT moved during the job and it was queued again on top of it"""
+        job_id, root = job["id"], job["root"]
+        progress = json.loads(job["progress"] or "{}")
+
+        def report(stage, done, total, seconds):
+            progress[stage] = {"done": done, "total": total, "seconds": round(seconds, 3)}
+            self._update(job_id, stage=stage, progress=json.dumps(progress))
+
+        version = job["version"]
+        if not (version and os.path.isdir(version_path(version, root))):
+            version = self._build(job, report)
+        # else: the job crashed after its version was built, and only publishing is left
+        started = time.perf_counter()
+        current = read_current_version(root)
+        if current not in (job["base"], version):
+            self._rebase(job_id, version, root)
+            return None
+        if current != version:
+            self._carry_bank(job["base"], version, root)
+            publish_version(version, root)
+        report("publish", 1, 1, time.perf_counter() - started)
+        self._update(job_id, state="done", finished=time.time())
+        return version
+
+    def _rebase(self, job_id: str, version: str, root: str):
+        """Drop a version built on a base that is no longer CURRENT and queue the job from scratch"""
+        # Publishing it would silently undo whatever was published in between
+        logging.warning("index %s was republished during ingest job %s; queued again on the new version",
+                        root, job_id)
+        shutil.rmtree(version_path(version, root), ignore_errors=True)
+        self._update(job_id, state="queued", owner=None, stage=None, progress="{}", chunks=0, batches=0,
+                     base=None, version=None)
+
+    def _carry_bank(self, base, version: str, root: str):
+        """Bring the base version's answer bank along, minus answers the new documents may change"""
+        if not (base and os.path.exists(os.path.join(version_path(base, root), BANK_FILE))):
+            return
+        try:
+            retriever = IndexWatcher(self._get_embeddings(), root=root, k=RETRIEVER_K).pin(version).current().retriever
+            bank = carry_forward(base, version, retriever, root)
+            logging.warning("answer bank for %s: %s", version, bank["outcomes"])
+        except Exception as e:
+            # A missing bank only means live answers; never hold up publishing for it
+            logging.error(e)
+
+    def _record_provenance(self, store, existing, absorbed):
+        """Add the places of dropped new chunks to the indexed chunks they duplicate"""
+        if not absorbed:
+            return
+        metadatas = dict(zip(existing["ids"], existing["metadatas"]))
+        ids, updated = [], []
+        for chunk_id, places in absorbed.items():
+            meta = dict(metadatas.get(chunk_id) or {})
+            listed = [p for p in (meta.get("also_in") or "").split("; ") if p]
+            added = [p for p in dict.fromkeys(places) if p not in listed]
+            if not added:
+                continue
+            meta["duplicates"] = int(meta.get("duplicates", 0)) + len(added)
+            meta["also_in"] = "; ".join((listed + added)[:MAX_PROVENANCE])
+            ids.append(chunk_id)
+            updated.append(meta)
+        if ids:
+            store._collection.update(ids=ids, metadatas=updated)
+
+    def _build(self, job: dict, report) -> str:
+        """Everything up to a complete, unpublished version directory; returns its id"""
+        job_id, root = job["id"], job["root"]
+        progress = json.loads(job["progress"] or "{}")
+
+        # Parse and chunk are cheap and deterministic, so a resumed job redoes them
+        files = json.loads(job["files"])
+        documents, started = [], time.perf_counter()
+        for i, path in enumerate(files):
+            documents.extend(load_local_pdfs([path]))
+            report("parse", i + 1, len(files), time.perf_counter() - started)
+        if not documents:
+            raise ValueError("No text could be read from: " + ", ".join(os.path.basename(p) for p in files))
+
+        staging = staging_path(job_id, root)
+        base = job["base"] or read_current_version(root)
+        if not os.path.isdir(staging):
+            copy = staging + ".copy"
+            shutil.rmtree(copy, ignore_errors=True)
+            if base:
+                shutil.copytree(version_path(base, root), copy, ignore=_chroma_files)
+            else:
+                os.makedirs(copy)
+            # Renamed only once complete, so a crash mid-copy is never resumed from
+            os.rename(copy, staging)
+            self._update(job_id, base=base)
+        store = Chroma(persist_directory=staging, embedding_function=self._get_embeddings(),
+                       collection_metadata=hnsw_metadata())
+
+        # Chunks are keyed by file name: a re-uploaded file replaces its earlier chunks,
+        # and dedup runs against the rest of the index as well as within the job
+        started = time.perf_counter()
+        names = {os.path.basename(p) for p in files}
+        existing = store.get(include=["metadatas", "documents"])
+        index = NearDuplicateIndex()
+        replaced = []
+        for chunk_id, meta, text in zip(existing["ids"], existing["metadatas"], existing["documents"]):
+            if _file_of(meta) in names:
+                replaced.append(chunk_id)
+            elif DEDUP_ENABLED:
+                index.check(chunk_id, text)
+        splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+        chunks = splitter.split_documents(documents)
+        dedup_report = None
+        if DEDUP_ENABLED:
+            chunks, dedup_report = dedupe(chunks, index=index)
+        chunks = assign_sections(chunks)
+        ids = chunk_ids(chunks)
+        report("chunk", len(chunks), len(chunks), time.perf_counter() - started)
+        self._update(job_id, chunks=len(chunks))
+
+        # Both idempotent, so a resumed job can redo them: chunks this job already upserted
+        # keep their ids, and provenance already recorded is not added twice
+        new_ids = set(ids)
+        stale = [chunk_id for chunk_id in replaced if chunk_id not in new_ids]
+        if stale:
+            store._collection.delete(ids=stale)
+        self._record_provenance(store, existing, index.absorbed)
+
+        # One batch = embed + upsert + commit of the batch counter. Ids are fixed per chunk,
+        # so a batch cut off between upsert and commit is upserted again harmlessly.
+        embeddings = self._get_embeddings()
+        batches = (len(chunks) + self.batch_size - 1) // self.batch_size
+        spent = {stage: progress.get(stage, {}).get("seconds", 0.0) for stage in ("embed", "upsert")}
+        for b in range(job["batches"], batches):
+            batch = chunks[b * self.batch_size:(b + 1) * self.batch_size]
+            done = b * self.batch_size + len(batch)
+            texts = [c.page_content for c in batch]
+            started = time.perf_counter()
+            vectors = embeddings.embed_documents(texts)
+            spent["embed"] += time.perf_counter() - started
+            report("embed", done, len(chunks), spent["embed"])
+            started = time.perf_counter()
+            store._collection.upsert(
+                ids=ids[b * self.batch_size:(b + 1) * self.batch_size],
+                embeddings=vectors, metadatas=[c.metadata for c in batch], documents=texts)
+            spent["upsert"] += time.perf_counter() - started
+            report("upsert", done, len(chunks), spent["upsert"])
+            self._update(job_id, batches=b + 1)
+
+        data = store.get(include=["embeddings", "metadatas", "documents"])
+        sections, centroids = build_sections(data["embeddings"], data["metadatas"], data["documents"])
+        write_sections(staging, sections, centroids)
+        # The id is stored before the rename, so a crash after it resumes by publishing
+        # this version instead of building another one
+        version = job["version"] or new_version_id()
+        self._update(job_id, version=version)
+        previous = read_manifest(base, root) if base else {}
+        with open(os.path.join(staging, MANIFEST_FILE), "w") as f:
+            json.dump({
+                "version": version,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "base": base,
+                "ingest_job": job_id,
+                "sources": [s for s in previous.get("sources", []) if s not in names] + sorted(names),
+                "documents": len({(_file_of(m), (m or {}).get("page")) for m in data["metadatas"]}),
+                "chunks": len(data["documents"]),
+                "sections": len(sections),
+                "dedup": dedup_report,
+                "embedding_model": EMBEDDING_MODEL,
+                "hnsw": hnsw_metadata(),
+            }, f, indent=2)
+        os.rename(staging, version_path(version, root))
+        job["base"] = base
+        return version
+
+INGEST_QUEUE = IngestQueue()
+
+# -----------------------------
+# CLI: python ingest_queue.py add <pdfs...> [--root R] | list | retry <job> | work
+# -----------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MAPA's background ingestion queue")
+    sub = parser.add_subparsers(dest="command", required=True)
+    add = sub.add_parser("add", help="Queue PDFs to be added to a knowledge base")
+    add.add_argument("pdfs", nargs="+")
+    add.add_argument("--kb", default="default")
+    add.add_argument("--root", default=INDEX_ROOT)
+    sub.add_parser("list", help="Recent jobs and their progress")
+    retry = sub.add_parser("retry", help="Resume a failed job")
+    retry.add_argument("job")
+    sub.add_parser("work", help="Run the worker pool in the foreground")
+    args = parser.parse_args(argv)
+
+    if args.command == "add":
+        print(INGEST_QUEUE.enqueue(args.pdfs, args.kb, args.root))
+    elif args.command == "list":
+        for job in INGEST_QUEUE.jobs():
+            stage = job["progress"].get(job["stage"] or "", {})
+            print(f"{job['id']}  {job['state']:<8} {job['stage'] or '-':<8} "
+                  f"{stage.get('done', 0)}/{stage.get('total', 0)}  {job['kb']}  {', '.join(job['files'])}"
+                  + (f"  -> {job['version']}" if job["state"] == "done" else "")
+                  + (f"  error: {job['error']}" if job["error"] else ""))
+    elif args.command == "retry":
+        INGEST_QUEUE.retry(args.job)
+    elif args.command == "work":
+        INGEST_QUEUE.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            INGEST_QUEUE.stop()
+
+if __name__ == "__main__":
+    main()
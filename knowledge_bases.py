@@ -0,0 +1,212 @@
+import os
+import json
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from index_store import (INDEX_ROOT, DEFAULT_PDFS, RETRIEVER_K, IndexWatcher, build_version,
+                         make_embeddings, publish_version, read_current_version, version_path)
+from vector_backends import ANN_BACKEND
+
+# -----------------------------
+# CONFIG
+#   knowledge_bases.json:
+#   {"knowledge_bases": {"coe": {"title": "College of Engineering", "pdfs": ["coe_handbook.pdf"]}},
+#    "users": {"alice": "coe"}}
+# Every knowledge base has its own versioned index root (KB_DIR/<name>); "default" is the
+# original corpus in INDEX_ROOT and is always registered.
+# -----------------------------
+KB_REGISTRY = os.getenv("MAPA_KB_REGISTRY", "knowledge_bases.json")
+KB_DIR = os.getenv("MAPA_KB_DIR", "kb_indexes")     # outside INDEX_ROOT, so prune never sees it
+KB_CACHE_BYTES = int(float(os.getenv("MAPA_KB_CACHE_MB", "1024")) * 1024 * 1024)
+KB_MAX_LOADED = int(os.getenv("MAPA_KB_MAX_LOADED", "8"))
+DEFAULT_KB = "default"
+
+class UnknownKnowledgeBase(KeyError):
+    """A request named a knowledge base that is not registered"""
+
+@dataclass
+class KnowledgeBase:
+    name: str
+    title: str
+    root: str
+    pdfs: list = field(default_factory=list)
+
+# -----------------------------
+# REGISTRY: names, sources and which users land where
+# -----------------------------
+class KnowledgeBaseRegistry:
+
+    def __init__(self, path: str = KB_REGISTRY):
+        self.path = path
+        self.bases = {DEFAULT_KB: KnowledgeBase(DEFAULT_KB, "Mapua University", INDEX_ROOT, list(DEFAULT_PDFS))}
+        self.users = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        except OSError:
+            return
+        except ValueError as e:
+            logging.error(e)
+            return
+        for name, entry in config.get("knowledge_bases", {}).items():
+            self.bases[name] = KnowledgeBase(
+                name=name,
+                title=entry.get("title", name),
+                root=entry.get("root") or (INDEX_ROOT if name == DEFAULT_KB else os.path.join(KB_DIR, name)),
+                pdfs=entry.get("pdfs", []),
+            )
+        self.users = {user: name for user, name in config.get("users", {}).items() if name in self.bases}
+
+    def names(self):
+        return list(self.bases)
+
+    def get(self, name: str) -> KnowledgeBase:
+        if name not in self.bases:
+            raise UnknownKnowledgeBase(name)
+        return self.bases[name]
+
+    def route(self, user=None, requested=None) -> str:
+        """The knowledge base for a request: the one it asks for, else the user's, else the default"""
+        if requested:
+            return self.get(requested).name
+        return self.users.get(user, DEFAULT_KB)
+
+def index_bytes(path: str) -> int:
+    """Size of a version directory: a stand-in for the memory the loaded index takes
+    (HNSW graph and vectors are read into RAM; the chunk text stays in SQLite pages)"""
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(folder, name))
+            except OSError:
+                pass
+    return total
+
+# -----------------------------
+# LOADED INDEXES: memory-bounded LRU
+# Opened on first use; the least recently used are closed when over budget. Requests keep
+# their IndexHandle, so an eviction never pulls an index from under an in-flight query.
+# -----------------------------
+class KnowledgeBasePool:
+
+    def __init__(self, embeddings, registry: KnowledgeBaseRegistry = None, default=None,
+                 max_bytes: int = KB_CACHE_BYTES, max_loaded: int = KB_MAX_LOADED,
+                 k: int = RETRIEVER_K, backend: str = ANN_BACKEND):
+        self.embeddings = embeddings
+        self.registry = registry or KnowledgeBaseRegistry()
+        self.default = default          # the engine's own watcher for DEFAULT_KB, never evicted
+        self.max_bytes = max_bytes
+        self.max_loaded = max_loaded
+        self.k = k
+        self.backend = backend
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self._loaded = OrderedDict()    # name -> IndexWatcher, LRU order
+        self._sizes = {}                # (name, version) -> bytes
+        self._loading = {}              # name -> lock, so a cold index is opened once
+        self._lock = threading.Lock()
+
+    def current(self, name: str = DEFAULT_KB):
+        """Handle of the published version of a knowledge base, or None if it has none"""
+        if name == DEFAULT_KB and self.default is not None:
+            return self.default.current()
+        with self._lock:
+            watcher = self._loaded.get(name)
+            if watcher is not None:
+                self._loaded.move_to_end(name)
+                self.hits += 1
+                return watcher.current()
+            loading = self._loading.setdefault(name, threading.Lock())
+        with loading:
+            with self._lock:
+                watcher = self._loaded.get(name)
+            if watcher is None:
+                watcher = self._open(name)
+                if watcher is None:
+                    return None
+            return watcher.current()
+
+    def _open(self, name: str):
+        kb = self.registry.get(name)
+        if read_current_version(kb.root) is None:
+            logging.error("knowledge base %s has no published index in %s", name, kb.root)
+            return None
+        watcher = IndexWatcher(self.embeddings, root=kb.root, k=self.k, backend=self.backend).start()
+        with self._lock:
+            self._loaded[name] = watcher
+            self.loads += 1
+            self._evict(keep=name)
+        return watcher
+
+    def _bytes(self, name: str, watcher) -> int:
+        handle = watcher.current()
+        if handle is None:
+            return 0
+        key = (name, handle.version)
+        if key not in self._sizes:
+            self._sizes[key] = index_bytes(version_path(handle.version, watcher.root))
+        return self._sizes[key]
+
+    def _evict(self, keep: str):
+        total = sum(self._bytes(n, w) for n, w in self._loaded.items())
+        for name in list(self._loaded):
+            if total <= self.max_bytes and len(self._loaded) <= self.max_loaded:
+                break
+            if name == keep:
+                continue
+            watcher = self._loaded.pop(name)
+            total -= self._bytes(name, watcher)
+            watcher.stop()
+            self.evictions += 1
+            logging.warning("knowledge base %s unloaded (LRU)", name)
+
+    def stats(self) -> dict:
+        with self._lock:
+            loaded = {name: self._bytes(name, w) for name, w in self._loaded.items()}
+        lookups = self.hits + self.loads
+        return {
+            "registered": self.registry.names(),
+            "loaded": list(loaded),
+            "bytes": sum(loaded.values()),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+# -----------------------------
+# CLI: python knowledge_bases.py list | build <name> [--no-publish]
+# -----------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage MAPA's knowledge bases")
+    parser.add_argument("--registry", default=KB_REGISTRY)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="Registered knowledge bases and their published versions")
+    build = sub.add_parser("build", help="Embed a knowledge base's PDFs into a new version")
+    build.add_argument("name")
+    build.add_argument("--no-publish", action="store_true")
+    args = parser.parse_args(argv)
+
+    registry = KnowledgeBaseRegistry(args.registry)
+    if args.command == "list":
+        users = {}
+        for user, name in registry.users.items():
+            users.setdefault(name, []).append(user)
+        for kb in registry.bases.values():
+            print(f"{kb.name:<16} {kb.title:<32} current={read_current_version(kb.root)}  "
+                  f"root={kb.root}  users={len(users.get(kb.name, []))}")
+    elif args.command == "build":
+        kb = registry.get(args.name)
+        os.makedirs(kb.root, exist_ok=True)
+        version = build_version(kb.pdfs, make_embeddings(), kb.root)
+        if not args.no_publish:
+            publish_version(version, kb.root)
+        print(version)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import os
+import re
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from llm_adapter import PromptLayout
+from retrieval_cache import ByteLRU, normalize_query
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+TRANSLATION_MODE = os.getenv("MAPA_QUERY_TRANSLATION", "lexicon")      # lexicon | llm | off
+TRANSLATE_TIMEOUT_SECONDS = float(os.getenv("MAPA_TRANSLATE_TIMEOUT_SECONDS", "1.5"))
+TRANSLATION_CACHE_BYTES = int(float(os.getenv("MAPA_TRANSLATION_CACHE_MB", "4")) * 1024 * 1024)
+TAGALOG_SHARE = 0.5        # share of Tagalog words above which a query counts as Tagalog, not Taglish
+MIN_MARKERS = 2            # unambiguous Tagalog words needed before a query counts as Tagalog at all
+
+TRANSLATE_PROMPT = (
+    "Translate the user's question from Tagalog or Taglish into plain English for a search engine "
+    "about Mapua University. Keep names, course codes and English terms as they are. "
+    "Reply with the English question only."
+)
+
+# Tagalog words mapped into the English vocabulary of the index ("" = particle, dropped).
+# Affixed verb forms (mag-, nag-, -in) are listed where students commonly use them.
+TAGALOG_LEXICON = {
+    # question words
+    "paano": "how", "pano": "how", "saan": "where", "san": "where", "kailan": "when", "kelan": "when",
+    "ano": "what", "anong": "what", "ano-ano": "what", "sino": "who", "bakit": "why", "magkano": "how much",
+    "ilan": "how many", "ilang": "how many", "alin": "which", "pwede": "can", "puwede": "can", "pwedeng": "can",
+    "kailangan": "need", "kelangan": "need", "dapat": "should", "meron": "is there", "mayroon": "is there",
+    "may": "there is", "wala": "no", "walang": "no", "hindi": "not", "di": "not", "hanggang": "until",
+    # school vocabulary
+    "bayad": "payment", "magbayad": "pay", "nagbayad": "paid", "babayaran": "fees", "bayaran": "pay",
+    "matrikula": "tuition", "presyo": "price", "halaga": "amount", "hulugan": "installment",
+    "mag-enroll": "enroll", "magenroll": "enroll", "ma-enroll": "enrolled", "nag-enroll": "enrolled", "pag-enroll": "enrollment",
+    "pagpapatala": "enrollment", "magpatala": "enroll", "iskolarship": "scholarship", "iskolar": "scholar",
+    "klase": "class", "seksyon": "section", "seksiyon": "section", "iskedyul": "schedule",
+    "sched": "schedule", "guro": "professor", "propesor": "professor", "prof": "professor",
+    "marka": "grade", "grado": "grade", "bagsak": "failing grade", "bumagsak": "failed", "pumasa": "passed",
+    "paaralan": "school", "eskwelahan": "school", "unibersidad": "university", "silid": "room",
+    "kwarto": "room", "palapag": "floor", "opisina": "office", "aklatan": "library", "kurso": "course",
+    "asignatura": "subject", "estudyante": "student", "mag-aaral": "student", "bago": "new",
+    "papeles": "documents", "dokumento": "documents", "ipasa": "submit", "magpasa": "submit", "isumite": "submit",
+    "lumipat": "transfer", "ilipat": "move", "palitan": "change", "magpalit": "change", "baguhin": "change",
+    "mag-drop": "drop", "idrop": "drop", "tanggalin": "remove", "kumuha": "take", "kukuha": "take",
+    "makakuha": "get", "makita": "see", "makikita": "see", "tingnan": "check",
+    "kunin": "take", "kukunin": "take", "malaman": "know", "malalaman": "know", "alam": "know",
+    "lapitan": "approach", "lalapitan": "approach", "ayusin": "fix", "aayusin": "fix",
+    "mag-aral": "study", "pag-aralan": "study", "pag-aaralan": "study", "ipapasa": "submit", "humingi": "request", "magtanong": "ask", "tanong": "question", "sagot": "answer",
+    "araw": "day", "petsa": "date", "linggo": "week", "buwan": "month", "taon": "year", "unang": "first",
+    "una": "first", "ikalawang": "second", "huling": "last", "simula": "start", "magsisimula": "start",
+    "magsimula": "start", "matatapos": "end", "bukas": "tomorrow", "sarado": "closed",
+    "libre": "free", "tulong": "help", "tumulong": "help", "pagsusulit": "exam", "eksam": "exam",
+    "programa": "program", "organisasyon": "organization", "samahan": "club", "sumali": "join",
+    # function words and particles
+    "ang": "", "ng": "", "nang": "", "mga": "", "sa": "", "si": "", "kay": "", "ni": "", "na": "",
+    "ba": "", "bang": "", "po": "", "ho": "", "naman": "", "lang": "", "lamang": "", "din": "", "rin": "", "daw": "",
+    "raw": "", "kasi": "", "pala": "", "tapos": "", "yung": "", "iyong": "", "yun": "", "iyon": "", "ito": "this",
+    "ko": "my", "ako": "i", "ka": "you", "mo": "your", "namin": "our", "natin": "our", "nila": "their",
+    "kami": "we", "tayo": "we", "sila": "they", "siya": "he or she", "at": "and", "o": "or", "kung": "if",
+    "para": "for", "pag": "when", "kapag": "when", "pagkatapos": "after", "dito": "here",
+    "doon": "there", "ngayon": "now", "ngayong": "this", "lahat": "all", "iba": "other", "ibang": "other",
+}
+
+# Also English words: they don't count towards detection, and are only mapped next to a
+# Tagalog word. The connectives introduce what follows, so that word must be the next one.
+AMBIGUOUS = {"at", "may", "o", "di", "din", "raw", "na", "prof", "sched"}
+CONNECTIVES = {"at", "may"}
+VERB_PREFIXES = ("mag-", "nag-", "pag-", "ma-", "i-", "mag", "nag", "pag", "ma", "na")
+
+_WORD = re.compile(r"[a-zñ'-]+|[^a-zñ'\s-]+", re.IGNORECASE)
+
+# -----------------------------
+# DETECTION
+# -----------------------------
+def _lookup(word: str):
+    """Lexicon entry for a word or, failing that, for its verb root:
+    magbabayad -> babayad -> bayad (prefix, then the repeated first syllable);
+    mag-apply -> apply (hyphenated prefix on an English verb)"""
+    if word in TAGALOG_LEXICON:
+        return TAGALOG_LEXICON[word]
+    for prefix in VERB_PREFIXES:
+        if word.startswith(prefix) and len(word) > len(prefix) + 3:
+            root = word[len(prefix):]
+            if root[:2] == root[2:4]:
+                root = root[2:]
+            if root in TAGALOG_LEXICON and TAGALOG_LEXICON[root]:
+                return TAGALOG_LEXICON[root]
+            if prefix.endswith("-") and root.isalpha():
+                return root
+    return None
+
+def _is_word(token: str) -> bool:
+    return token[0].isalpha() or token[0] in "'-"
+
+def _names(tokens):
+    """Indexes of capitalised tokens that are names, not a capitalised Tagalog word:
+    any capital inside a sentence ("Prof. Ilan", "at May"), and a sentence's first word
+    when a capitalised word follows it ("San Francisco", "Ang Lee")"""
+    names = set()
+    for i, token in enumerate(tokens):
+        if not (_is_word(token) and token[0].isupper()):
+            continue
+        following = tokens[i + 2] if i + 2 < len(tokens) and tokens[i + 1] == "." else \
+            (tokens[i + 1] if i + 1 < len(tokens) else "")
+        starts_sentence = i == 0 or tokens[i - 1][-1] in "?!"
+        if not starts_sentence or (following and _is_word(following) and following[0].isupper()):
+            names.add(i)
+    return names
+
+def _marker(token: str) -> bool:
+    word = token.lower()
+    return word not in AMBIGUOUS and _lookup(word) is not None
+
+def _markers(query: str):
+    """(unambiguous Tagalog words, words) of a query; names are not counted as Tagalog"""
+    tokens = _WORD.findall(query)
+    names = _names(tokens)
+    words = [i for i, t in enumerate(tokens) if _is_word(t)]
+    return sum(i not in names and _marker(tokens[i]) for i in words), len(words)
+
+def tagalog_share(query: str) -> float:
+    markers, words = _markers(query)
+    return markers / words if words else 0.0
+
+def detect_language(query: str) -> str:
+    """"en", "taglish" (English with Tagalog words or particles) or "tl\""""
+    markers, words = _markers(query)
+    if markers < MIN_MARKERS:
+        return "en"
+    return "tl" if markers / words >= TAGALOG_SHARE else "taglish"
+
+def lexicon_translate(query: str) -> str:
+    """Word-by-word mapping into the index's English vocabulary; English words and names pass through"""
+    tokens = _WORD.findall(query)
+    names = _names(tokens)
+
+    def tagalog(i):
+        return 0 <= i < len(tokens) and i not in names and _marker(tokens[i])
+
+    out = []
+    for i, token in enumerate(tokens):
+        word = token.lower()
+        mapped = None
+        if i not in names and _is_word(token):
+            if word not in AMBIGUOUS:
+                mapped = _lookup(word)
+            elif tagalog(i + 1) or (word not in CONNECTIVES and tagalog(i - 1)):
+                mapped = TAGALOG_LEXICON[word]
+        if mapped is None:
+            mapped = token if i in names else word
+        if mapped:
+            out.append(mapped)
+    return re.sub(r" ([?.,!])", r"\1", " ".join(out)).strip()
+
+# -----------------------------
+# QUERY TRANSLATOR
+# The English index stays as it is: only the retrieval query is mapped into English.
+# -----------------------------
+@dataclass
+class QueryTranslation:
+    original: str
+    text: str                  # what retrieval embeds
+    language: str
+    method: str                # "none", "lexicon", "llm", "cache"
+    elapsed_ms: float = 0.0
+
+class QueryTranslator:
+
+    def __init__(self, mode: str = TRANSLATION_MODE, provider=None,
+                 timeout: float = TRANSLATE_TIMEOUT_SECONDS, cache_bytes: int = TRANSLATION_CACHE_BYTES):
+        self.mode = mode
+        self.provider = provider    # used in "llm" mode; plain prompts, no context cache
+        self.timeout = timeout
+        self.cache = ByteLRU(cache_bytes)
+        self.counts = {"en": 0, "taglish": 0, "tl": 0}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="mapa-translate")
+
+    def _llm_translate(self, query: str) -> str:
+        layout = PromptLayout(prefix=TRANSLATE_PROMPT, turns=[("human", query)])
+        return "".join(self.provider.stream(layout)).strip()
+
+    def _remember_text(self, key: str, text: str):
+        if text:
+            self.cache.put(key, text, len(key) + len(text))
+
+    def _remember(self, key: str, future):
+        if not future.exception():
+            self._remember_text(key, future.result().strip())
+
+    def translate(self, query: str) -> QueryTranslation:
+        started = time.perf_counter()
+        language = detect_language(query) if self.mode != "off" else "en"
+        with self._lock:
+            self.counts[language] += 1
+        if language == "en":
+            return QueryTranslation(query, query, language, "none")
+
+        key = normalize_query(query)
+        cached = self.cache.get(key)
+        if cached is not None:
+            text, method = cached, "cache"
+        else:
+            text, method = lexicon_translate(query), "lexicon"
+            if self.mode == "llm" and self.provider is not None:
+                future = self._pool.submit(self._llm_translate, query)
+                # A late translation still lands in the cache for the next time this is asked
+                future.add_done_callback(lambda f: self._remember(key, f))
+                try:
+                    text = future.result(self.timeout) or text
+                    method = "llm"
+                except FutureTimeout:
+                    # The lexicon mapping is good enough for retrieval; don't hold up the answer
+                    pass
+                except Exception as e:
+                    logging.error(e)
+            else:
+                self._remember_text(key, text)
+        return QueryTranslation(query, text, language, method,
+                                round((time.perf_counter() - started) * 1000, 2))
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self.counts)
+        return {"mode": self.mode, "languages": counts, **self.cache.stats()}
@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+from datetime import timedelta
+from dataclasses import dataclass, field
+import google.generativeai as genai
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+LLM_MODEL = "gemini-2.0-flash-exp"
+LLM_PROVIDER = os.getenv("MAPA_LLM_PROVIDER", "gemini")
+CACHE_TTL_SECONDS = float(os.getenv("MAPA_PROMPT_CACHE_TTL_MINUTES", "60")) * 60
+REFRESH_MARGIN_SECONDS = 10 * 60        # extend a cache used within this long of expiry
+RETRY_AFTER_FAILURE_SECONDS = 10 * 60   # provider said no: use plain prompts for a while
+# Gemini only caches prefixes of at least this many tokens, and the minimum depends on the
+# model; a create call for a shorter prefix is a wasted round trip. Longest match wins.
+GEMINI_CACHE_MIN_TOKENS = {
+    "gemini-1.5": 32768,
+    "gemini-2.0": 4096,
+    "gemini-2.5-flash": 1024,
+    "gemini-2.5-pro": 4096,
+}
+CACHE_MIN_TOKENS = os.getenv("MAPA_PROMPT_CACHE_MIN_TOKENS")   # overrides the table
+
+def gemini_cache_min_tokens(model: str) -> int:
+    if CACHE_MIN_TOKENS:
+        return int(CACHE_MIN_TOKENS)
+    matches = [name for name in GEMINI_CACHE_MIN_TOKENS if model.startswith(name)]
+    return GEMINI_CACHE_MIN_TOKENS[max(matches, key=len)] if matches else 4096
+
+# -----------------------------
+# PROMPT LAYOUT
+#   prefix  system prompt + hot chunks: identical across queries, cacheable provider-side
+#   turns   per-query part: history and the question with its retrieved context
+# -----------------------------
+@dataclass
+class PromptLayout:
+    prefix: str
+    turns: list = field(default_factory=list)     # [(role, text)], role is "human" or "ai"
+
+    def prefix_key(self) -> str:
+        return hashlib.sha256(self.prefix.encode("utf-8")).hexdigest()
+
+    def as_text(self) -> str:
+        """Whole prompt as one string, for providers without system/turn support"""
+        lines = [self.prefix]
+        for role, text in self.turns:
+            lines.append(f"{'User' if role == 'human' else 'Assistant'}: {text}")
+        return "\n\n".join(lines)
+
+@dataclass
+class CacheHandle:
+    key: str
+    ref: object               # provider's own cache object
+    expires_at: float
+    uses: int = 0
+
+# -----------------------------
+# PROVIDERS
+# Each implements create_cache / refresh_cache / stream(layout, handle), and may set
+# min_cache_tokens, the smallest prefix its cache accepts
+# -----------------------------
+class CachingUnavailable(RuntimeError):
+    """Provider can't cache this prefix (unsupported model, too few tokens, ...)"""
+
+class GeminiProvider:
+
+    def __init__(self, model: str = LLM_MODEL, temperature: float = 0):
+        self.model = model
+        self.min_cache_tokens = gemini_cache_min_tokens(model)
+        self.generation_config = {"temperature": temperature}
+
+    @staticmethod
+    def _contents(turns):
+        return [{"role": "user" if role == "human" else "model", "parts": [text]} for role, text in turns]
+
+    def create_cache(self, prefix: str, ttl: float):
+        try:
+            return genai.caching.CachedContent.create(
+                model=f"models/{self.model}",
+                system_instruction=prefix,
+                ttl=timedelta(seconds=ttl),
+            )
+        except Exception as e:
+            raise CachingUnavailable(str(e)) from e
+
+    def refresh_cache(self, ref, ttl: float):
+        ref.update(ttl=timedelta(seconds=ttl))
+
+    def stream(self, layout: PromptLayout, handle=None):
+        if handle is not None:
+            model = genai.GenerativeModel.from_cached_content(handle.ref, generation_config=self.generation_config)
+        else:
+            model = genai.GenerativeModel(self.model, system_instruction=layout.prefix,
+                                          generation_config=self.generation_config)
+        for chunk in model.generate_content(self._contents(layout.turns), stream=True):
+            text = getattr(chunk, "text", "")
+            if text:
+                yield text
+
+class FakeProvider:
+    """Local stand-in that records prompts and cache traffic; no network"""
+
+    def __init__(self, reply: str = "This is a test answer.", supports_caching: bool = True,
+                 min_cache_tokens: int = 0):
+        self.reply = reply
+        self.supports_caching = supports_caching
+        self.min_cache_tokens = min_cache_tokens
+        self.created = []         # prefixes a cache was created for
+        self.refreshed = 0
+        self.calls = []           # (layout, used_cache)
+
+    def create_cache(self, prefix: str, ttl: float):
+        if not self.supports_caching:
+            raise CachingUnavailable("fake provider has caching disabled")
+        self.created.append(prefix)
+        return f"cachedContents/fake-{len(self.created)}"
+
+    def refresh_cache(self, ref, ttl: float):
+        self.refreshed += 1
+
+    def stream(self, layout: PromptLayout, handle=None):
+        self.calls.append((layout, handle is not None))
+        for i, word in enumerate(self.reply.split(" ")):
+            yield (" " if i else "") + word
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) for reports, not billing"""
+    return (len(text) + 3) // 4
+
+class ReplayMiss(KeyError):
+    """No recorded response for this prompt"""
+
+class RecordingProvider:
+    """Record/replay wrapper for offline, deterministic runs. Responses are keyed by the
+    full prompt text; "record" calls the base provider for prompts not on file yet,
+    "replay" never touches the network. Caching is disabled so keys don't depend on it."""
+
+    def __init__(self, path: str, mode: str = "replay", base=None):
+        self.path = path
+        self.mode = mode
+        self.base = base
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.recordings = json.load(f)
+        except (OSError, ValueError):
+            self.recordings = {}
+
+    @staticmethod
+    def key(layout: PromptLayout) -> str:
+        return hashlib.sha256(layout.as_text().encode("utf-8")).hexdigest()
+
+    def create_cache(self, prefix: str, ttl: float):
+        raise CachingUnavailable("record/replay provider sends plain prompts")
+
+    def refresh_cache(self, ref, ttl: float):
+        pass
+
+    def stream(self, layout: PromptLayout, handle=None):
+        key = self.key(layout)
+        with self._lock:
+            recorded = self.recordings.get(key)
+        if recorded is not None:
+            self.hits += 1
+            yield from recorded["chunks"]
+            return
+        self.misses += 1
+        if self.mode != "record" or self.base is None:
+            raise ReplayMiss(key)
+        chunks = []
+        for chunk in self.base.stream(layout):
+            chunks.append(chunk)
+            yield chunk
+        with self._lock:
+            self.recordings[key] = {"chunks": chunks}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with self._lock, open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.recordings, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+def make_provider(name: str = LLM_PROVIDER):
+    if name == "fake":
+        return FakeProvider()
+    return GeminiProvider()
+
+# -----------------------------
+# ADAPTER: owns provider-side cache handles for stable prefixes
+# -----------------------------
+class LLMAdapter:
+
+    def __init__(self, provider, ttl: float = CACHE_TTL_SECONDS):
+        self.provider = provider
+        self.ttl = ttl
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.plain_calls = 0
+        self.min_tokens = getattr(provider, "min_cache_tokens", 0)
+        self._handles = {}            # prefix key -> CacheHandle
+        self._pending = {}            # prefix key -> Future of the CacheHandle being created or refreshed
+        self._unavailable_until = 0.0
+        self._lock = threading.Lock()
+
+    def _handle_for(self, layout: PromptLayout):
+        now = time.time()
+        if now < self._unavailable_until or estimate_tokens(layout.prefix) < self.min_tokens:
+            return None
+        key = layout.prefix_key()
+        # The lock only guards the handle table; create/refresh calls go over the network
+        # outside it, one per prefix, while other requests wait on (or keep using) its handle
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is not None and handle.expires_at <= now:
+                handle = None
+            pending = self._pending.get(key)
+            owner = pending is None and (handle is None or handle.expires_at - now < REFRESH_MARGIN_SECONDS)
+            if owner:
+                pending = self._pending[key] = Future()
+            elif handle is not None:
+                self.cache_hits += 1
+                handle.uses += 1
+                return handle
+        if not owner:
+            handle = pending.result()
+            if handle is not None:
+                with self._lock:
+                    self.cache_hits += 1
+                    handle.uses += 1
+            return handle
+
+        created = handle is None
+        try:
+            if created:
+                ref = self.provider.create_cache(layout.prefix, self.ttl)
+                handle = CacheHandle(key=key, ref=ref, expires_at=now + self.ttl)
+            else:
+                self.provider.refresh_cache(handle.ref, self.ttl)
+        except CachingUnavailable as e:
+            logging.warning("Prompt caching unavailable, using plain prompts: %s", e)
+            handle = None
+        except Exception as e:
+            logging.error(e)
+            handle = None
+        with self._lock:
+            del self._pending[key]
+            if handle is None:
+                self._handles.pop(key, None)
+                self._unavailable_until = now + RETRY_AFTER_FAILURE_SECONDS
+            else:
+                if created:
+                    # Only the newest prefix is kept; older hot-chunk sets expire on their own TTL
+                    self._handles = {key: handle}
+                    self.cache_misses += 1
+                else:
+                    handle.expires_at = now + self.ttl
+                    self.cache_hits += 1
+                handle.uses += 1
+        pending.set_result(handle)
+        return handle
+
+    def stream(self, layout: PromptLayout):
+        handle = self._handle_for(layout)
+        if handle is None:
+            self.plain_calls += 1
+        return self.provider.stream(layout, handle)
+
+    def stats(self) -> dict:
+        calls = self.cache_hits + self.cache_misses + self.plain_calls
+        return {
+            "hit_rate": round(self.cache_hits / calls, 3) if calls else 0.0,
+            "cache_hits": self.cache_hits,
+            "cache_creates": self.cache_misses,
+            "plain_calls": self.plain_calls,
+            "caching": time.time() >= self._unavailable_until,
+            "min_prefix_tokens": self.min_tokens,
+        }
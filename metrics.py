@@ -0,0 +1,325 @@
+import os
+import time
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from chat_store import CHAT_STORE
+from index_store import read_manifest
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+METRICS_HOST = os.getenv("MAPA_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("MAPA_METRICS_PORT", "0"))      # 0 = no separate /metrics listener
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Stage latency bucket upper bounds (ms), from an embedding lookup to a full LLM answer
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# -----------------------------
+# THREAD SHARDS
+# Every thread adds into its own list, so the request path never takes a lock (or
+# contends on a cache line) to count. The lock is only taken the first time a thread
+# touches a metric and when a scrape sums the shards. Shards of threads that have
+# exited (Streamlit runs each rerun on a new one) are folded into one whenever a new
+# thread registers, so the list stays as long as the live threads, scraped or not.
+# -----------------------------
+class _Shards:
+
+    def __init__(self, size: int):
+        self.size = size
+        self._local = threading.local()
+        self._live = []                 # (thread, values)
+        self._retired = [0.0] * size
+        self._lock = threading.Lock()
+
+    def mine(self):
+        values = getattr(self._local, "values", None)
+        if values is None:
+            values = [0.0] * self.size
+            with self._lock:
+                self._fold_dead()
+                self._live.append((threading.current_thread(), values))
+            self._local.values = values
+        return values
+
+    def _fold_dead(self):
+        # Called with the lock held; a dead thread's shard can no longer change
+        live = []
+        for thread, values in self._live:
+            if thread.is_alive():
+                live.append((thread, values))
+            else:
+                self._retired = [a + b for a, b in zip(self._retired, values)]
+        self._live = live
+
+    def total(self):
+        with self._lock:
+            self._fold_dead()
+            live = list(self._live)
+            totals = list(self._retired)
+        for _, values in live:
+            totals = [a + b for a, b in zip(totals, values)]
+        return totals
+
+# -----------------------------
+# METRIC TYPES
+# -----------------------------
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        for key, child in list(self._children.items()):
+            yield from child.samples(self.name, self.labelnames, key)
+
+class _CounterChild:
+
+    def __init__(self):
+        self._shards = _Shards(1)
+
+    def inc(self, amount: float = 1.0):
+        self._shards.mine()[0] += amount
+
+    def samples(self, name, labelnames, key):
+        yield name, _format_labels(labelnames, key), self._shards.total()[0]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].inc(amount)
+
+class _HistogramChild:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._shards = _Shards(len(buckets) + 2)     # one per bucket, +Inf, then the sum
+
+    def observe(self, value: float):
+        values = self._shards.mine()
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def samples(self, name, labelnames, key):
+        totals = self._shards.total()
+        cumulative = 0
+        for bound, count in zip(self.buckets + [float("inf")], totals[:-1]):
+            cumulative += count
+            yield (f"{name}_bucket", _format_labels(labelnames + ("le",), key + (_number(float(bound)),)),
+                   int(cumulative))
+        yield f"{name}_sum", _format_labels(labelnames, key), round(totals[-1], 3)
+        yield f"{name}_count", _format_labels(labelnames, key), int(cumulative)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=LATENCY_BUCKETS_MS):
+        self.buckets = list(buckets)
+        super().__init__(name, help_text, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+# -----------------------------
+# REGISTRY
+# Counters and histograms are updated where things happen; gauges (sessions, queue depth,
+# cache ratios, index size, RSS) are read from the existing reports at scrape time.
+# -----------------------------
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames=()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames=(), buckets=LATENCY_BUCKETS_MS) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def add_collector(self, collector):
+        """collector() -> [(name, type, help, [(labels dict, value)])], called on every scrape"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in metric.samples())
+        for collector in collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                # A failing source must not take the whole scrape down
+                logging.error(e)
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_number(value)}"
+                             for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+REQUESTS = REGISTRY.counter("mapa_requests_total", "Answered requests by channel and outcome",
+                            ("channel", "outcome"))
+STAGE_LATENCY = REGISTRY.histogram("mapa_stage_latency_ms", "Latency of each RAG stage in milliseconds",
+                                   ("stage",))
+
+def observe_answer(answer, channel: str, error=None):
+    """Count a finished request and its stage timings (the same data as its trace record)"""
+    if error is not None:
+        outcome = "error"
+    elif answer is None:
+        outcome = "unknown"
+    elif answer.from_bank:
+        outcome = "bank"
+    elif answer.degraded:
+        outcome = "degraded"
+    else:
+        outcome = "ok"
+    REQUESTS.labels(channel, outcome).inc()
+    if answer is None:
+        return
+    for key, value in answer.timings.items():
+        if key.endswith("_ms") and isinstance(value, (int, float)):
+            STAGE_LATENCY.labels(key[:-3]).observe(value)
+
+# -----------------------------
+# SCRAPE-TIME GAUGES
+# -----------------------------
+def process_samples():
+    rss = None
+    try:
+        with open("/proc/self/statm", "r") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        try:
+            import resource
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024   # peak, in KB on Linux
+        except ImportError:
+            pass
+    families = [
+        ("process_cpu_seconds_total", "counter", "CPU time of this process", [({}, round(time.process_time(), 3))]),
+        ("process_threads", "gauge", "Live threads", [({}, threading.active_count())]),
+    ]
+    if rss is not None:
+        families.append(("process_resident_memory_bytes", "gauge", "Resident memory", [({}, rss)]))
+    return families
+
+def serving_samples(engine, ingest_queue=None):
+    """Collector over the engine's own reports"""
+    families = []
+    store = CHAT_STORE.report()
+    families.append(("mapa_active_sessions", "gauge", "Sessions with chats in memory", [({}, store["sessions"])]))
+    families.append(("mapa_chat_store_bytes", "gauge", "Bytes of chat messages held in memory", [({}, store["bytes"])]))
+
+    limits = engine.limits_report()
+    llm = limits["llm"]
+    families.append(("mapa_llm_in_flight", "gauge", "LLM calls running now", [({}, llm["in_flight"])]))
+    families.append(("mapa_llm_slots", "gauge", "Concurrent LLM calls allowed", [({}, llm["slots"])]))
+    families.append(("mapa_llm_queue_depth", "gauge", "Requests waiting for an LLM slot", [({}, llm["queued"])]))
+    families.append(("mapa_rate_limited_total", "counter", "Requests rejected by the per-user rate limit",
+                     [({}, limits["rate"]["rejected"])]))
+
+    ratios = [({"cache": name}, c["hit_rate"]) for name, c in engine.cache_report().items() if "hit_rate" in c]
+    families.append(("mapa_cache_hit_ratio", "gauge", "Hit ratio of each cache since start", ratios))
+
+    handle = engine.index.current() if hasattr(engine.index, "current") else None
+    if handle is not None and getattr(handle, "root", None):
+        manifest = read_manifest(handle.version, handle.root)
+        families.append(("mapa_index_info", "gauge", "Index version being served",
+                         [({"version": handle.version}, 1)]))
+        families.append(("mapa_index_documents", "gauge", "Pages in the served index",
+                         [({}, manifest.get("documents", 0))]))
+        families.append(("mapa_index_chunks", "gauge", "Chunks in the served index", [({}, manifest.get("chunks", 0))]))
+
+    if ingest_queue is not None:
+        depth = ingest_queue.depth()
+        families.append(("mapa_ingest_jobs", "gauge", "Ingestion jobs by state",
+                         [({"state": state}, depth.get(state, 0)) for state in ("queued", "running", "failed")]))
+    return families
+
+REGISTRY.add_collector(process_samples)
+
+# -----------------------------
+# TEXT ENDPOINT (for the Streamlit process; api_server serves the same text at /metrics)
+# -----------------------------
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_in_background(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """Serve /metrics from a thread; None if the port can't be bound (e.g. another
+    Streamlit worker holds it). A missing scrape endpoint must never stop answering."""
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        logging.error(e)
+        return None
+    thread = threading.Thread(target=server.serve_forever, name="mapa-metrics", daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,111 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import google.generativeai as genai
+from index_store import WARMUP_QUERY
+from llm_adapter import LLM_MODEL, LLM_PROVIDER, PromptLayout
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+HISTORY_TURNS = int(os.getenv("MAPA_HISTORY_TURNS", "6"))   # messages carried into the prompt
+POOL_WORKERS = int(os.getenv("MAPA_PIPELINE_WORKERS", "8"))
+HOT_CHUNKS = int(os.getenv("MAPA_HOT_CHUNKS", "4"))         # most retrieved chunks moved into the cached prefix
+HOT_REFRESH_SECONDS = float(os.getenv("MAPA_HOT_CHUNKS_REFRESH_MINUTES", "60")) * 60
+
+SYSTEM_PROMPT = (
+    "You are MAPA, an AI assistant for Mapua University. "
+    "Use the retrieved context to answer concisely, in the language of the question "
+    "(English, Tagalog or Taglish). "
+    "If you don't know, say you don't know."
+)
+
+# Shared by every session in the process; work here must not touch st.* APIs
+POOL = ThreadPoolExecutor(max_workers=POOL_WORKERS, thread_name_prefix="mapa-pipeline")
+
+# -----------------------------
+# PROMPT PARTS
+# -----------------------------
+def format_docs(docs) -> str:
+    return "\n\n".join(doc.page_content for doc in docs)
+
+def chunk_key(doc) -> str:
+    return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+def history_messages(history, turns: int = HISTORY_TURNS):
+    """Last few chat messages as (role, text) pairs for a MessagesPlaceholder"""
+    messages = []
+    for message in history[-turns:] if turns > 0 else []:
+        if "user" in message:
+            messages.append(("human", message["user"]))
+        if "assistant" in message:
+            messages.append(("ai", message["assistant"]))
+    return messages
+
+def build_layout(hot_docs, docs, history_turns, query: str) -> PromptLayout:
+    """Stable prefix (system prompt + hot chunks) and per-query turns after history_turns.
+    Chunks already in the prefix are not repeated in the question."""
+    prefix = SYSTEM_PROMPT
+    if hot_docs:
+        prefix += "\n\nFrequently needed reference material:\n\n" + format_docs(hot_docs)
+    hot_keys = {chunk_key(d) for d in hot_docs}
+    context = format_docs([d for d in docs if chunk_key(d) not in hot_keys])
+    question = f"Retrieved context:\n{context}\n\nQuestion: {query}" if context else query
+    return PromptLayout(prefix=prefix, turns=list(history_turns) + [("human", question)])
+
+class HotChunks:
+    """Counts how often each chunk is retrieved. The hot set only changes per index
+    version or every HOT_REFRESH_SECONDS, so the prompt prefix stays cacheable."""
+
+    def __init__(self, size: int = HOT_CHUNKS, refresh_seconds: float = HOT_REFRESH_SECONDS):
+        self.size = size
+        self.refresh_seconds = refresh_seconds
+        self._counts = Counter()
+        self._docs = {}
+        self._version = None
+        self._hot = []
+        self._computed_at = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, version: str, docs):
+        with self._lock:
+            if version != self._version:
+                self._counts.clear()
+                self._docs.clear()
+                self._version = version
+                self._hot = []
+                self._computed_at = time.monotonic()
+            for doc in docs:
+                key = chunk_key(doc)
+                self._counts[key] += 1
+                self._docs[key] = doc
+
+    def current(self):
+        with self._lock:
+            if self.size > 0 and time.monotonic() - self._computed_at > self.refresh_seconds:
+                self._hot = [self._docs[key] for key, _ in self._counts.most_common(self.size)]
+                self._computed_at = time.monotonic()
+            return list(self._hot)
+
+# -----------------------------
+# SESSION WARM-UP
+# -----------------------------
+def _warm(embeddings, retriever):
+    try:
+        if embeddings is not None:
+            embeddings.embed_query(WARMUP_QUERY)
+        if retriever is not None:
+            retriever.invoke(WARMUP_QUERY)
+        # Opens (and keeps alive) the HTTPS connection to the Gemini API
+        if LLM_PROVIDER == "gemini":
+            genai.get_model(f"models/{LLM_MODEL}")
+    except Exception as e:
+        logging.error(e)
+
+def warm_session(embeddings, retriever):
+    """Touch the embedding model, index pages and LLM connection in the background"""
+    return POOL.submit(_warm, embeddings, retriever)
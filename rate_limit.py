@@ -0,0 +1,171 @@
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+RATE_PER_MINUTE = float(os.getenv("MAPA_RATE_PER_MINUTE", "6"))   # sustained questions per user
+BURST = float(os.getenv("MAPA_RATE_BURST", "3"))                   # back-to-back questions allowed
+LLM_CONCURRENCY = int(os.getenv("MAPA_LLM_CONCURRENCY", "4"))      # Gemini calls in flight per process
+QUEUE_TIMEOUT = float(os.getenv("MAPA_QUEUE_TIMEOUT", "60"))
+POLL_SECONDS = 0.5
+SWEEP_SECONDS = 60             # how often buckets that have refilled are dropped
+
+# -----------------------------
+# ERRORS
+# -----------------------------
+class RateLimited(RuntimeError):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit reached, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+class QueueTimeout(RuntimeError):
+    """Waited longer than QUEUE_TIMEOUT (or the caller's own budget) for an LLM slot"""
+
+# -----------------------------
+# PER-USER TOKEN BUCKETS
+# -----------------------------
+class RateLimiter:
+
+    def __init__(self, per_minute: float = RATE_PER_MINUTE, burst: float = BURST):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, burst)
+        self.allowed = 0
+        self.rejected = 0
+        self._buckets = {}          # user -> [tokens, last refill]
+        self._swept_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _sweep(self, now: float):
+        # A full bucket is the same as no bucket; without this every caller ever seen stays
+        for user, (tokens, last) in list(self._buckets.items()):
+            if tokens + (now - last) * self.rate >= self.capacity:
+                del self._buckets[user]
+        self._swept_at = now
+
+    def check(self, user: str):
+        """Take one token for user or raise RateLimited"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._swept_at >= SWEEP_SECONDS:
+                self._sweep(now)
+            tokens, last = self._buckets.get(user, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * self.rate)
+            if tokens < 1.0:
+                self._buckets[user] = (tokens, now)
+                self.rejected += 1
+                raise RateLimited((1.0 - tokens) / self.rate if self.rate else float("inf"))
+            self._buckets[user] = (tokens - 1.0, now)
+            self.allowed += 1
+
+# -----------------------------
+# FAIR-SHARE SCHEDULER IN FRONT OF THE LLM
+# Slots are handed out round-robin across users, so one user's backlog
+# cannot starve the others however many requests they queue.
+# -----------------------------
+class _Ticket:
+    __slots__ = ("user", "granted", "queued_at")
+
+    def __init__(self, user):
+        self.user = user
+        self.granted = threading.Event()
+        self.queued_at = time.monotonic()
+
+class FairScheduler:
+
+    def __init__(self, slots: int = LLM_CONCURRENCY, timeout: float = QUEUE_TIMEOUT):
+        self.slots = max(1, slots)
+        self.timeout = timeout
+        self.in_flight = 0
+        self.admitted = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self._queues = OrderedDict()    # user -> deque of tickets; order is the round-robin ring
+        self._lock = threading.Lock()
+
+    def _dispatch(self):
+        while self.in_flight < self.slots and self._queues:
+            user, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            if queue:
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+            self.in_flight += 1
+            ticket.granted.set()
+
+    def _position(self, ticket) -> int:
+        """1-based place in the order slots will be granted"""
+        queues = [list(q) for q in self._queues.values()]
+        position = 0
+        for depth in range(max((len(q) for q in queues), default=0)):
+            for queue in queues:
+                if depth < len(queue):
+                    position += 1
+                    if queue[depth] is ticket:
+                        return position
+        return 0
+
+    def acquire(self, user: str, on_wait=None, timeout: float = None):
+        """Block until this user's turn. on_wait(position) is called while queued.
+        timeout (seconds) shortens QUEUE_TIMEOUT, e.g. to what is left of a request's budget."""
+        ticket = _Ticket(user)
+        with self._lock:
+            self._queues.setdefault(user, deque()).append(ticket)
+            self._dispatch()
+        deadline = ticket.queued_at + (self.timeout if timeout is None else min(self.timeout, timeout))
+        while not ticket.granted.wait(max(0.0, min(POLL_SECONDS, deadline - time.monotonic()))):
+            with self._lock:
+                if ticket.granted.is_set():
+                    break
+                if time.monotonic() >= deadline:
+                    queue = self._queues.get(user)
+                    queue.remove(ticket)
+                    if not queue:
+                        del self._queues[user]
+                    self.timeouts += 1
+                    raise QueueTimeout("Timed out waiting for an LLM slot")
+                position = self._position(ticket)
+            if on_wait:
+                on_wait(position)
+        with self._lock:
+            self.admitted += 1
+            self.total_wait += time.monotonic() - ticket.queued_at
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._dispatch()
+
+    def slot(self, user: str, on_wait=None):
+        return _Slot(self, user, on_wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "slots": self.slots,
+                "in_flight": self.in_flight,
+                "queued": sum(len(q) for q in self._queues.values()),
+                "queued_users": len(self._queues),
+                "admitted": self.admitted,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.total_wait / self.admitted * 1000, 1) if self.admitted else 0.0,
+            }
+
+class _Slot:
+    """with scheduler.slot(user): ... holds one LLM slot for the block"""
+
+    def __init__(self, scheduler, user, on_wait):
+        self.scheduler = scheduler
+        self.user = user
+        self.on_wait = on_wait
+
+    def __enter__(self):
+        self.scheduler.acquire(self.user, self.on_wait)
+        return self
+
+    def __exit__(self, *exc):
+        self.scheduler.release()
+        return False
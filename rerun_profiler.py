@@ -0,0 +1,288 @@
+import os
+import sys
+import json
+import time
+import bisect
+import pstats
+import cProfile
+import argparse
+import logging
+import threading
+from collections import Counter
+from analytics import percentile
+
+# -----------------------------
+# CONFIG
+#   off       no timing at all (default)
+#   sections  wall time of every named section of app.py, per rerun
+#   cprofile  sections, plus one rerun in MAPA_RERUN_CPROFILE_EVERY under cProfile
+# -----------------------------
+PROFILE_MODE = os.getenv("MAPA_RERUN_PROFILE", "off")
+PROFILE_REPORT = os.getenv("MAPA_RERUN_PROFILE_REPORT", os.path.join("logs", "rerun_profile.json"))
+CPROFILE_EVERY = int(os.getenv("MAPA_RERUN_CPROFILE_EVERY", "20"))
+SAVE_SECONDS = 30              # report file rewritten at most this often
+STALE_SECONDS = 30             # a sampled rerun still going after this stops its cProfile at its next mark
+TOP_FUNCTIONS = 25
+REGRESSION_TOLERANCE = 0.25    # relative growth of a section's mean that counts as a regression...
+REGRESSION_MIN_MS = 1.0        # ...if it is also at least this much slower
+
+# Section histogram bucket upper bounds (ms): most sections of a rerun take well under 5 ms
+SECTION_BOUNDS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+def _empty_section() -> dict:
+    return {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "histogram": [0] * (len(SECTION_BOUNDS) + 1)}
+
+def _add(stats: dict, ms: float):
+    stats["count"] += 1
+    stats["total_ms"] += ms
+    stats["max_ms"] = max(stats["max_ms"], ms)
+    stats["histogram"][bisect.bisect_left(SECTION_BOUNDS, ms)] += 1
+
+def _summarize(name: str, stats: dict, total_ms: float) -> dict:
+    return {
+        "section": name,
+        "count": stats["count"],
+        "mean_ms": round(stats["total_ms"] / stats["count"], 3) if stats["count"] else None,
+        "p50_ms": percentile(stats["histogram"], 0.5, SECTION_BOUNDS),
+        "p95_ms": percentile(stats["histogram"], 0.95, SECTION_BOUNDS),
+        "max_ms": round(stats["max_ms"], 3),
+        "total_ms": round(stats["total_ms"], 1),
+        "share": round(stats["total_ms"] / total_ms, 3) if total_ms else 0.0,
+    }
+
+class _Run:
+    __slots__ = ("started", "section", "section_started", "profile", "thread")
+
+    def __init__(self, section: str, now: float):
+        self.started = now
+        self.section = section
+        self.section_started = now
+        self.profile = None
+        self.thread = threading.current_thread()    # the only thread that may disable profile
+
+# -----------------------------
+# PROFILER
+# app.py calls begin() at the top, mark(name) where a section starts and end() where a run
+# finishes. A run cut short by st.rerun() loses only its open section (its end isn't known);
+# the next begin() on the same script thread closes it as "interrupted".
+# -----------------------------
+class RerunProfiler:
+
+    def __init__(self, mode: str = PROFILE_MODE, report_path: str = PROFILE_REPORT,
+                 cprofile_every: int = CPROFILE_EVERY):
+        self.mode = mode
+        self.enabled = mode in ("sections", "cprofile")
+        self.report_path = report_path
+        self.cprofile_every = max(1, cprofile_every)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._saved_at = time.monotonic()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._sections = {}
+            self._reruns = _empty_section()
+            self._outcomes = Counter()
+            self._stats = None
+            self._begun = 0
+            self._sampled = 0
+            self._sampling = None      # the one run under cProfile, if any
+            self._started = time.time()
+
+    def begin(self, section: str = "setup"):
+        if not self.enabled:
+            return
+        previous = getattr(self._local, "run", None)
+        if previous is not None:
+            self._finish(previous, completed=False)
+        run = _Run(section, time.perf_counter())
+        self._local.run = run
+        if self.mode == "cprofile" and self._claim_sampling(run):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                run.profile = profile
+            except ValueError as e:
+                # Another profiler is active in this interpreter
+                logging.error(e)
+                with self._lock:
+                    self._sampling = None
+
+    def mark(self, section: str):
+        """End the running section and start the next one"""
+        run = getattr(self._local, "run", None) if self.enabled else None
+        if run is None:
+            return
+        now = time.perf_counter()
+        self._record(run.section, (now - run.section_started) * 1000)
+        run.section, run.section_started = section, now
+        if run.profile is not None and now - run.started > STALE_SECONDS:
+            # Too long to be one rerun; free the sample for another run without its stats
+            run.profile.disable()
+            run.profile = None
+            with self._lock:
+                if self._sampling is run:
+                    self._sampling = None
+
+    def end(self):
+        """Close the last section of a run that reached its end (or an st.stop())"""
+        run = getattr(self._local, "run", None) if self.enabled else None
+        if run is None:
+            return
+        self._record(run.section, (time.perf_counter() - run.section_started) * 1000)
+        self._finish(run, completed=True)
+
+    def _claim_sampling(self, run) -> bool:
+        with self._lock:
+            self._begun += 1
+            sampling = self._sampling
+            # cProfile hooks the thread that enabled it, so only that thread disables it: a live
+            # owner keeps the sample until it ends or marks past STALE_SECONDS, a dead one took
+            # its hook with it
+            if sampling is not None and not sampling.thread.is_alive():
+                sampling, self._sampling = None, None
+            if sampling is not None or (self._begun - 1) % self.cprofile_every:
+                return False
+            self._sampling = run
+            return True
+
+    def _record(self, section: str, ms: float):
+        with self._lock:
+            _add(self._sections.setdefault(section, _empty_section()), ms)
+
+    def _finish(self, run, completed: bool):
+        self._local.run = None
+        total_ms = (time.perf_counter() - run.started) * 1000
+        stats = None
+        if run.profile is not None:
+            run.profile.disable()
+            if completed:
+                stats = pstats.Stats(run.profile)
+        with self._lock:
+            if self._sampling is run:
+                self._sampling = None
+            if completed:
+                _add(self._reruns, total_ms)
+                self._outcomes["completed"] += 1
+            else:
+                self._outcomes["interrupted"] += 1
+            if stats is not None:
+                self._sampled += 1
+                if self._stats is None:
+                    self._stats = stats
+                else:
+                    self._stats.add(stats)
+        if time.monotonic() - self._saved_at > SAVE_SECONDS:
+            self._saved_at = time.monotonic()
+            try:
+                self.save()
+            except OSError as e:
+                logging.error(e)
+
+    # -----------------------------
+    # REPORTS
+    # -----------------------------
+    def _top_functions(self, n: int):
+        if self._stats is None:
+            return []
+        rows = []
+        for (filename, line, function), (_, calls, own, cumulative, _) in self._stats.stats.items():
+            rows.append({
+                "function": f"{os.path.basename(filename)}:{line}({function})",
+                "calls_per_rerun": round(calls / self._sampled, 1),
+                "own_ms": round(own * 1000 / self._sampled, 3),
+                "cumulative_ms": round(cumulative * 1000 / self._sampled, 3),
+            })
+        rows.sort(key=lambda r: r["cumulative_ms"], reverse=True)
+        return rows[:n]
+
+    def report(self, top: int = TOP_FUNCTIONS) -> dict:
+        with self._lock:
+            spent = sum(s["total_ms"] for s in self._sections.values())
+            sections = [_summarize(name, s, spent) for name, s in self._sections.items()]
+            sections.sort(key=lambda s: s["total_ms"], reverse=True)
+            return {
+                "mode": self.mode,
+                "since": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self._started)),
+                "reruns": dict(self._outcomes),
+                "rerun": _summarize("rerun", self._reruns, 0),
+                "sections": sections,
+                "sampled_reruns": self._sampled,
+                "functions": self._top_functions(top),
+            }
+
+    def save(self, path: str = None):
+        path = path or self.report_path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=1)
+        os.replace(tmp_path, path)
+
+PROFILER = RerunProfiler()
+
+# -----------------------------
+# BASELINE DIFF
+# -----------------------------
+def compare(baseline: dict, report: dict, tolerance: float = REGRESSION_TOLERANCE,
+            min_ms: float = REGRESSION_MIN_MS):
+    """(lines to print, regressed?) on mean time per rerun, section by section"""
+    lines, regressed = [], False
+    before = {s["section"]: s for s in baseline["sections"] + [baseline["rerun"]]}
+    for section in [report["rerun"]] + report["sections"]:
+        old = before.get(section["section"])
+        if old is None or old["mean_ms"] is None or section["mean_ms"] is None:
+            continue
+        delta = section["mean_ms"] - old["mean_ms"]
+        worse = delta >= min_ms and section["mean_ms"] > old["mean_ms"] * (1 + tolerance)
+        regressed = regressed or worse
+        mark = "▼ " if worse else "  "
+        lines.append(f"{mark}{section['section']:<18} {old['mean_ms']:>9.2f} -> {section['mean_ms']:<9.2f} ms ({delta:+.2f})")
+    return lines, regressed
+
+def format_report(report: dict) -> str:
+    rerun = report["rerun"]
+    lines = [f"{rerun['count']} completed reruns ({report['reruns']}), mean {rerun['mean_ms']} ms, "
+             f"p95 {rerun['p95_ms']} ms",
+             f"{'section':<18}{'count':>7}{'mean ms':>10}{'p95 ms':>9}{'max ms':>10}{'share':>8}"]
+    for s in report["sections"]:
+        lines.append(f"{s['section']:<18}{s['count']:>7}{s['mean_ms']:>10.2f}{s['p95_ms']:>9}"
+                     f"{s['max_ms']:>10.2f}{s['share']:>8.1%}")
+    if report["functions"]:
+        lines.append(f"\nTop functions over {report['sampled_reruns']} cProfile-sampled reruns (cumulative ms per rerun)")
+        lines.extend(f"{f['cumulative_ms']:>10.2f}  {f['function']}" for f in report["functions"])
+    return "\n".join(lines)
+
+# -----------------------------
+# CLI: python rerun_profiler.py [--report logs/rerun_profile.json] [--baseline B] [--update-baseline]
+# -----------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-section Streamlit rerun timings")
+    parser.add_argument("--report", default=PROFILE_REPORT)
+    parser.add_argument("--baseline", help="earlier report to compare with; exits 1 on a regression")
+    parser.add_argument("--update-baseline", action="store_true", help="copy the report to --baseline")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    with open(args.report, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    print(format_report(report))
+    if not args.baseline:
+        return 0
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    lines, regressed = compare(baseline, report, args.tolerance)
+    print("\n" + "\n".join(lines))
+    if regressed:
+        print(f"REGRESSION: a section got more than {args.tolerance:.0%} (and {REGRESSION_MIN_MS} ms) slower")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import os
+import re
+import json
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future
+from langchain_core.embeddings import Embeddings
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+RETRIEVAL_CACHE_BYTES = int(float(os.getenv("MAPA_RETRIEVAL_CACHE_MB", "32")) * 1024 * 1024)
+EMBEDDING_CACHE_BYTES = int(float(os.getenv("MAPA_EMBED_CACHE_MB", "16")) * 1024 * 1024)
+ENTRY_OVERHEAD = 256    # rough cost of the key, dict slot and containers
+
+_SPACES = re.compile(r"\s+")
+
+def normalize_query(query: str) -> str:
+    """Case, whitespace and trailing punctuation don't change what retrieval finds"""
+    return _SPACES.sub(" ", query.strip().lower()).rstrip("?!. ")
+
+# -----------------------------
+# BYTE-BOUNDED LRU
+# -----------------------------
+class ByteLRU:
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()     # key -> (value, size)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, size: int):
+        size += ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._items[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.bytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._items),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+# -----------------------------
+# QUERY EMBEDDING CACHE
+# -----------------------------
+class CachedEmbeddings(Embeddings):
+    """Remembers query vectors (as float32 arrays) by normalized text"""
+
+    def __init__(self, base: Embeddings, max_bytes: int = EMBEDDING_CACHE_BYTES):
+        self.base = base
+        self.cache = ByteLRU(max_bytes)
+
+    def embed_documents(self, texts):
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text):
+        key = normalize_query(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = array("f", self.base.embed_query(text))
+            self.cache.put(key, vector, len(key) + vector.itemsize * len(vector))
+        return list(vector)
+
+# -----------------------------
+# RETRIEVAL RESULT CACHE
+# Keyed by index version, so a re-index never serves stale chunks.
+# -----------------------------
+def _docs_size(docs) -> int:
+    return sum(len(d.page_content.encode("utf-8")) + len(json.dumps(d.metadata, default=str)) + 64 for d in docs)
+
+class RetrievalCache:
+
+    def __init__(self, max_bytes: int = RETRIEVAL_CACHE_BYTES):
+        self.cache = ByteLRU(max_bytes)
+
+    @staticmethod
+    def key(query: str, version: str, k: int, filters=None):
+        return (normalize_query(query), json.dumps(filters, sort_keys=True) if filters else "", k, version)
+
+    def retrieve(self, pool, retriever, query: str, version: str, k: int, filters=None):
+        """(future of the documents, cache hit). On a hit the future is already resolved;
+        on a miss retrieval is submitted to pool and its result cached."""
+        key = self.key(query, version, k, filters)
+        docs = self.cache.get(key)
+        if docs is not None:
+            future = Future()
+            future.set_result(list(docs))
+            return future, True
+
+        def _run():
+            result = retriever.invoke(query)
+            # A remote index may have swapped since version was read; file under the one searched
+            searched = getattr(result, "version", None) or version
+            self.cache.put(self.key(query, searched, k, filters), tuple(result), _docs_size(result))
+            return result
+
+        return pool.submit(_run), False
+
+    def stats(self) -> dict:
+        return self.cache.stats()
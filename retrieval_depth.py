@@ -0,0 +1,96 @@
+import os
+import threading
+from collections import Counter
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+# -----------------------------
+# CONFIG
+#   fixed     always the configured k (default)
+#   adaptive  fetch up to DEPTH_MAX candidates and keep as many as their scores justify;
+#             opt in once evaluate.py shows it doesn't cost accuracy on your documents
+# -----------------------------
+RETRIEVAL_DEPTH = os.getenv("MAPA_RETRIEVAL_DEPTH", "fixed")
+DEPTH_MIN = int(os.getenv("MAPA_DEPTH_MIN", "2"))
+DEPTH_MAX = int(os.getenv("MAPA_DEPTH_MAX", "16"))
+MIN_SCORE = float(os.getenv("MAPA_DEPTH_MIN_SCORE", "0.25"))       # cosine similarity floor
+RELATIVE_SCORE = float(os.getenv("MAPA_DEPTH_RELATIVE", "0.75"))   # keep chunks within this share of the top score
+SCORE_GAP = float(os.getenv("MAPA_DEPTH_GAP", "0.08"))             # a drop this large ends the useful run
+CONTEXT_TOKEN_BUDGET = int(os.getenv("MAPA_CONTEXT_TOKEN_BUDGET", "3000"))
+CHARS_PER_TOKEN = 4
+
+def choose_depth(scores, token_costs, depth_min: int = DEPTH_MIN, depth_max: int = DEPTH_MAX,
+                 min_score: float = MIN_SCORE, relative: float = RELATIVE_SCORE,
+                 gap: float = SCORE_GAP, budget: int = CONTEXT_TOKEN_BUDGET):
+    """(how many of the best-first candidates to keep, why the cut was made).
+    A clear winner with a gap below it keeps depth_min chunks; a flat distribution of
+    good scores (broad questions) keeps going until the token budget or depth_max."""
+    if not scores:
+        return 0, "empty"
+    keep = min(len(scores), max(1, depth_min))
+    tokens = sum(token_costs[:keep])
+    cutoff = max(min_score, scores[0] * relative)
+    for i in range(keep, min(len(scores), depth_max)):
+        if scores[i] < cutoff:
+            return i, "threshold"
+        if scores[i - 1] - scores[i] >= gap:
+            return i, "gap"
+        if tokens + token_costs[i] > budget:
+            return i, "budget"
+        tokens += token_costs[i]
+    n = min(len(scores), depth_max)
+    return max(keep, n), "max" if n == depth_max else "all"
+
+class DepthStats:
+    """Chosen depths and cut reasons, for /v1/stats and tuning"""
+
+    def __init__(self):
+        self.depths = Counter()
+        self.reasons = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, depth: int, reason: str):
+        with self._lock:
+            self.depths[depth] += 1
+            self.reasons[reason] += 1
+
+    def report(self) -> dict:
+        with self._lock:
+            total = sum(self.depths.values())
+            return {
+                "mode": RETRIEVAL_DEPTH,
+                "queries": total,
+                "mean_depth": round(sum(d * c for d, c in self.depths.items()) / total, 2) if total else None,
+                "depths": dict(sorted(self.depths.items())),
+                "reasons": dict(self.reasons),
+            }
+
+DEPTH_STATS = DepthStats()
+
+# -----------------------------
+# RETRIEVER
+# -----------------------------
+class AdaptiveRetriever(BaseRetriever):
+    """Drop-in retriever whose k follows the score distribution of each query.
+    search(vector, k) must return [(Document, cosine similarity)] best first."""
+    search: object
+    embeddings: object
+    depth_max: int = DEPTH_MAX
+
+    def search_by_vector(self, vector, k: int = 0):
+        # The caller's k is only the fixed-mode default; adaptive mode picks its own
+        candidates = self.search(vector, self.depth_max)
+        scores = [float(score) for _, score in candidates]
+        costs = [len(doc.page_content) // CHARS_PER_TOKEN + 1 for doc, _ in candidates]
+        depth, reason = choose_depth(scores, costs, depth_max=self.depth_max)
+        DEPTH_STATS.record(depth, reason)
+        # Copies: backends may hand out shared Document objects. The cut reason travels with
+        # the chunks (through the retrieval cache and daemon) into the request's trace record.
+        return [
+            Document(page_content=doc.page_content,
+                     metadata={**doc.metadata, "score": round(score, 4), "depth_reason": reason})
+            for doc, score in candidates[:depth]
+        ]
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.search_by_vector(self.embeddings.embed_query(query))
@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import threading
+from typing import Any
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from index_store import IndexHandle, IndexWatcher, ensure_published, make_embeddings, RETRIEVER_K
+from vector_backends import search_by_vector
+from ingest_queue import INGEST_QUEUE
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+SOCKET_PATH = os.getenv("MAPA_RETRIEVAL_SOCKET", "")
+BATCH_WAIT_MS = float(os.getenv("MAPA_DAEMON_BATCH_WAIT_MS", "5"))
+MAX_BATCH = int(os.getenv("MAPA_DAEMON_MAX_BATCH", "32"))
+CLIENT_TIMEOUT = float(os.getenv("MAPA_RETRIEVAL_TIMEOUT", "30"))
+VERSION_MAX_AGE_SECONDS = 5.0      # a client asks for the version only if no search reported one this recently
+
+# -----------------------------
+# WIRE FORMAT: one JSON object per line, one request per connection
+#   {"op": "search", "query": "...", "k": 8} -> {"version": "...", "documents": [...]}
+#   {"op": "info"}                           -> {"version": "...", "batches": n, "queries": n}
+# -----------------------------
+def _doc_to_dict(doc):
+    return {"page_content": doc.page_content, "metadata": doc.metadata}
+
+def _dict_to_doc(data):
+    return Document(page_content=data["page_content"], metadata=data.get("metadata") or {})
+
+class SearchResult(list):
+    """Documents of one search, with the index version that actually served it"""
+
+    def __init__(self, documents=(), version: str = None):
+        super().__init__(documents)
+        self.version = version
+
+# -----------------------------
+# DAEMON
+# -----------------------------
+class RetrievalDaemon:
+    """Owns the embedding model and the index for every app process on this host.
+    Queries that arrive within BATCH_WAIT_MS of each other share one embedding pass."""
+
+    def __init__(self, watcher, batch_wait_ms: float = BATCH_WAIT_MS, max_batch: int = MAX_BATCH):
+        self.watcher = watcher
+        self.batch_wait = batch_wait_ms / 1000.0
+        self.max_batch = max_batch
+        self.batches = 0
+        self.queries = 0
+        self._queue = None
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                results = await loop.run_in_executor(None, self._search_batch, batch)
+                for (_, _, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _search_batch(self, batch):
+        # One handle for the whole batch: a hot swap mid-batch cannot mix versions
+        handle = self.watcher.current()
+        if handle is None:
+            raise RuntimeError("No index version is published")
+        vectors = self.watcher.embeddings.embed_documents([query for query, _, _ in batch])
+        self.batches += 1
+        self.queries += len(batch)
+        return [
+            {
+                "version": handle.version,
+                "documents": [_doc_to_dict(d) for d in search_by_vector(handle, vector, k)],
+            }
+            for (_, k, _), vector in zip(batch, vectors)
+        ]
+
+    async def _handle_client(self, reader, writer):
+        try:
+            line = await reader.readline()
+            request = json.loads(line or b"{}")
+            op = request.get("op")
+            if op == "search":
+                future = asyncio.get_running_loop().create_future()
+                await self._queue.put((str(request["query"]), int(request.get("k", RETRIEVER_K)), future))
+                response = await future
+            elif op == "info":
+                handle = self.watcher.current()
+                response = {
+                    "version": handle.version if handle else None,
+                    "batches": self.batches,
+                    "queries": self.queries,
+                }
+            else:
+                response = {"error": f"unknown op: {op}"}
+        except Exception as e:
+            logging.error(e)
+            response = {"error": str(e)}
+        writer.write((json.dumps(response) + "\n").encode("utf-8"))
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path: str):
+        self._queue = asyncio.Queue()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = await asyncio.start_unix_server(self._handle_client, path=socket_path)
+        os.chmod(socket_path, 0o660)
+        batcher = asyncio.create_task(self._batch_loop())
+        logging.warning("MAPA retrieval daemon listening on %s", socket_path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+# -----------------------------
+# CLIENT
+# -----------------------------
+def _request(socket_path: str, payload: dict, timeout: float = CLIENT_TIMEOUT) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(payload) + "\n").encode("utf-8"))
+        with sock.makefile("rb") as f:
+            response = json.loads(f.readline() or b"{}")
+    if "error" in response:
+        raise RuntimeError(f"Retrieval daemon error: {response['error']}")
+    return response
+
+class RemoteRetriever(BaseRetriever):
+    """Drop-in for vectorstore.as_retriever() that asks the retrieval daemon instead"""
+    socket_path: str
+    k: int = RETRIEVER_K
+    index: Any = None           # RemoteIndex to tell which version answered
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        response = _request(self.socket_path, {"op": "search", "query": query, "k": self.k})
+        if self.index is not None:
+            self.index.seen(response["version"])
+        return SearchResult((_dict_to_doc(d) for d in response["documents"]), response["version"])
+
+class RemoteIndex:
+    """Thin-client counterpart of IndexWatcher: same current() interface, no local model.
+    The version comes from the last search response; the daemon is only asked for it
+    when no search has reported one for VERSION_MAX_AGE_SECONDS."""
+
+    def __init__(self, socket_path: str = SOCKET_PATH, k: int = RETRIEVER_K):
+        self.socket_path = socket_path
+        self.retriever = RemoteRetriever(socket_path=socket_path, k=k, index=self)
+        self._version = None
+        self._seen_at = 0.0
+        self._lock = threading.Lock()
+
+    def seen(self, version: str):
+        with self._lock:
+            self._version, self._seen_at = version, time.monotonic()
+
+    def current(self):
+        with self._lock:
+            version = self._version if time.monotonic() - self._seen_at < VERSION_MAX_AGE_SECONDS else None
+        if version is None:
+            try:
+                version = _request(self.socket_path, {"op": "info"}, timeout=5).get("version")
+            except OSError as e:
+                logging.error(e)
+                return None
+            if version is None:
+                return None
+            self.seen(version)
+        return IndexHandle(version=version, vectorstore=None, retriever=self.retriever)
+
+# -----------------------------
+# ENTRYPOINT: python retrieval_server.py --socket /tmp/mapa-retrieval.sock
+# -----------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve MAPA retrieval to local app processes")
+    parser.add_argument("--socket", default=SOCKET_PATH or "/tmp/mapa-retrieval.sock")
+    parser.add_argument("--batch-wait-ms", type=float, default=BATCH_WAIT_MS)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    started = time.time()
+    embeddings = make_embeddings()
+    ensure_published(embeddings)
+    # App processes are thin clients without workers: uploads are ingested here, next to the model
+    INGEST_QUEUE.start(embeddings)
+    watcher = IndexWatcher(embeddings).start()
+    logging.warning("Index %s loaded in %.1fs", watcher.current().version, time.time() - started)
+    daemon = RetrievalDaemon(watcher, args.batch_wait_ms, args.max_batch)
+    asyncio.run(daemon.serve(args.socket))
+
+if __name__ == "__main__":
+    main()
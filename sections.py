@@ -0,0 +1,88 @@
+import os
+import json
+from collections import Counter, OrderedDict
+import numpy as np
+from extractive import sentences, terms
+
+# -----------------------------
+# CONFIG
+# A section is a run of SECTION_PAGES pages of one PDF: the loaders give no headings,
+# and a few pages of a handbook or memo usually stay on one topic.
+# -----------------------------
+SECTION_PAGES = int(os.getenv("MAPA_SECTION_PAGES", "4"))
+SUMMARY_SENTENCES = 3
+SUMMARY_CHARS = 600
+SECTIONS_FILE = "sections.json"
+SECTION_VECTORS_FILE = "section_vectors.npy"
+
+def section_id(metadata: dict, pages: int = SECTION_PAGES) -> str:
+    source = os.path.basename(str(metadata.get("source", "unknown")))
+    page = metadata.get("page")
+    if not isinstance(page, int):
+        return f"{source}#all"
+    start = page // pages * pages
+    return f"{source}#p{start + 1}-{start + pages}"
+
+def assign_sections(docs, pages: int = SECTION_PAGES):
+    """Tag each chunk with its section (metadata["section"]) before it is embedded"""
+    for doc in docs:
+        doc.metadata["section"] = section_id(doc.metadata, pages)
+    return docs
+
+def summarize(texts, max_sentences: int = SUMMARY_SENTENCES, max_chars: int = SUMMARY_CHARS) -> str:
+    """Extractive summary: the sentences sharing most terms with the section as a whole, in reading order"""
+    candidates = [s for text in texts for s in sentences(text, min_chars=30)]
+    if not candidates:
+        return ""
+    frequency = Counter(t for s in candidates for t in terms(s))
+    scored = sorted(range(len(candidates)),
+                    key=lambda i: -sum(frequency[t] for t in terms(candidates[i])) / (len(terms(candidates[i])) + 5))
+    chosen, seen, length = [], set(), 0
+    for i in scored:
+        if len(chosen) == max_sentences or length + len(candidates[i]) > max_chars:
+            break
+        # Overlapping chunks repeat sentences
+        if candidates[i] not in seen:
+            seen.add(candidates[i])
+            chosen.append(i)
+            length += len(candidates[i])
+    return " ".join(candidates[i] for i in sorted(chosen))
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+# -----------------------------
+# SECTION INDEX: one centroid vector and summary per section
+# -----------------------------
+def build_sections(vectors, metadatas, texts=None):
+    """(sections [{id, source, chunks, summary}], normalized centroid vectors) from the chunks;
+    without texts the summaries are left empty (enough for searching)"""
+    groups = OrderedDict()
+    for row, meta in enumerate(metadatas):
+        groups.setdefault((meta or {}).get("section") or section_id(meta or {}), []).append(row)
+    vectors = _normalize(vectors)
+    sections, centroids = [], []
+    for sid, rows in groups.items():
+        sections.append({
+            "id": sid,
+            "source": sid.split("#")[0],
+            "chunks": len(rows),
+            "summary": summarize(texts[r] for r in rows) if texts is not None else "",
+        })
+        centroids.append(vectors[rows].mean(axis=0))
+    return sections, _normalize(np.asarray(centroids))
+
+def write_sections(path: str, sections, centroids):
+    with open(os.path.join(path, SECTIONS_FILE), "w", encoding="utf-8") as f:
+        json.dump(sections, f, ensure_ascii=False, indent=1)
+    np.save(os.path.join(path, SECTION_VECTORS_FILE), centroids)
+
+def read_sections(path: str):
+    """(sections, centroids) written at ingestion, or None for versions built before sections"""
+    try:
+        with open(os.path.join(path, SECTIONS_FILE), "r", encoding="utf-8") as f:
+            sections = json.load(f)
+        return sections, np.load(os.path.join(path, SECTION_VECTORS_FILE))
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,18 @@
+import json
+import time
+from analytics import Rollups
+
+def test_window_is_wall_clock_time_not_bucket_count(tmp_path):
+    now = time.mktime((2026, 3, 2, 12, 30, 0, 0, 0, -1))
+    log = tmp_path / "trace.jsonl"
+    # Traffic now, 10 minutes ago, 3 hours ago and 2 days ago, nothing in between
+    with open(log, "w") as f:
+        for ago in (0, 10 * 60, 3 * 3600, 2 * 86400):
+            f.write(json.dumps({"ts": now - ago, "query": "q", "docs": 4, "timings": {"total_ms": 100}}) + "\n")
+    rollups = Rollups(str(log), str(tmp_path / "rollups.json"))
+    rollups.refresh()
+
+    assert [row["time"] for row in rollups.series("minute", 60, now=now)] == ["2026-03-02 12:20", "2026-03-02 12:30"]
+    assert rollups.summary("minute", 60, now=now)["requests"] == 2
+    assert rollups.summary("hour", 24, now=now)["requests"] == 3
+    assert rollups.summary("hour", 24 * 7, now=now)["requests"] == 4
@@ -0,0 +1,41 @@
+import os
+import json
+from types import SimpleNamespace
+from answer_bank import BANK_FILE, carry_forward, read_bank
+from index_store import version_path
+
+def entry(question, chunks):
+    return {"question": question, "answer": "...", "grounding": {},
+            "documents": [{"page_content": c, "metadata": {}} for c in chunks]}
+
+class Retriever:
+
+    def __init__(self, results):
+        self.results = results
+
+    def invoke(self, question):
+        return [SimpleNamespace(page_content=c, metadata={}) for c in self.results[question]]
+
+def test_carry_forward_keeps_only_answers_whose_chunks_are_unchanged(tmp_path):
+    root = str(tmp_path)
+    for version in ("v1", "v2"):
+        os.makedirs(version_path(version, root))
+    bank = {"version": "v1", "built": "2026-01-01T00:00:00", "entries": {
+        "tuition": entry("Tuition?", ["fees table", "payment modes"]),
+        "enrollment": entry("Enrollment?", ["enrollment steps"]),
+    }}
+    with open(os.path.join(version_path("v1", root), BANK_FILE), "w") as f:
+        json.dump(bank, f)
+
+    retriever = Retriever({"Tuition?": ["payment modes", "fees table"],
+                           "Enrollment?": ["enrollment steps", "new memo on enrollment"]})
+    carried = carry_forward("v1", "v2", retriever, root)
+    assert list(carried["entries"]) == ["tuition"]
+    assert carried["outcomes"] == {"carried": 1, "invalidated": 1}
+    assert read_bank("v2", root)["carried_from"] == "v1"
+
+def test_no_previous_bank_writes_nothing(tmp_path):
+    root = str(tmp_path)
+    os.makedirs(version_path("v2", root))
+    assert carry_forward("v1", "v2", Retriever({}), root) is None
+    assert read_bank("v2", root) is None
@@ -0,0 +1,35 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+import api_server
+from engine import KnowledgeBaseNotReady
+
+def request():
+    return SimpleNamespace(headers={}, client=SimpleNamespace(host="10.0.0.5"))
+
+def body(stream=False):
+    return SimpleNamespace(query="When is enrollment?", history=[], stream=stream, kb="")
+
+class NotReadyEngine:
+    def route(self, user, requested):
+        raise KnowledgeBaseNotReady("Knowledge base is not ready")
+
+def test_failures_before_answering_give_the_slot_back(monkeypatch):
+    monkeypatch.setattr(api_server, "_slots", None)
+
+    def broken():
+        raise RuntimeError("index failed to load")
+
+    async def run():
+        monkeypatch.setattr(api_server, "get_engine", broken)
+        for _ in range(api_server.MAX_CONCURRENCY + 1):
+            with pytest.raises(RuntimeError):
+                await api_server.ask(body(), request())
+        monkeypatch.setattr(api_server, "get_engine", NotReadyEngine)
+        for stream in (False, True):
+            response = await api_server.ask(body(stream), request())
+            assert response.status_code == 503
+        return api_server._get_slots()
+
+    slots = asyncio.run(run())
+    assert slots._value == api_server.MAX_CONCURRENCY
@@ -0,0 +1,30 @@
+from chat_history import ChatHistory
+
+def history(tmp_path):
+    return ChatHistory(str(tmp_path / "chats.db"))
+
+def ids(results):
+    return [r["id"] for r in results[0]]
+
+def test_search_groups_message_hits_by_chat(tmp_path):
+    chats = history(tmp_path)
+    chats.append("ana", "c1", {"user": "When is enrollment?"})
+    for n in range(20):
+        chats.append("ana", "c1", {"assistant": f"Answer {n} about schedules"})
+    chats.append("ana", "c1", {"user": "And the tuition deadline?"})
+    chats.append("ana", "c2", {"user": "Tuition installment plans", "assistant": "Tuition can be paid in three parts."})
+    chats.append("ben", "c3", {"user": "Tuition for transferees?"})
+
+    results = chats.search("ana", "tuition")
+    assert results[1] == 2 and ids(results) == ["c2", "c1"]
+    assert "**tuition**" in results[0][1]["snippet"].lower()
+    assert chats._db().execute("SELECT count(*) FROM message_fts").fetchone()[0] == 22 + 1 + 1 + 3
+
+def test_rename_and_delete_update_the_index(tmp_path):
+    chats = history(tmp_path)
+    chats.append("ana", "c1", {"user": "Library hours?"})
+    chats.rename("c1", "Aklatan")
+    assert ids(chats.search("ana", "aklatan")) == ["c1"]
+    chats.delete_chat("c1")
+    assert chats.search("ana", "library") == ([], 0)
+    assert chats._db().execute("SELECT count(*) FROM message_fts").fetchone()[0] == 0
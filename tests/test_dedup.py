@@ -0,0 +1,37 @@
+import random
+from types import SimpleNamespace
+from dedup import NearDuplicateIndex, dedupe, near_duplicate_groups
+
+WORDS = [f"w{i}" for i in range(3000)]
+
+def _text(seed: int, n: int = 200):
+    return random.Random(seed).choices(WORDS, k=n)
+
+def _doc(words, source="memo.pdf", page=0):
+    return SimpleNamespace(page_content=" ".join(words), metadata={"source": source, "page": page})
+
+def test_chain_does_not_merge_distant_ends():
+    a = _text(1)
+    b = list(a)
+    b[0:15] = ["b"] * 15            # ~0.90 Jaccard with a
+    c = list(b)
+    c[100:115] = ["c"] * 15         # ~0.86 with b, ~0.77 with a
+    assert near_duplicate_groups([" ".join(x) for x in (a, b, c)]) == [[0, 1], [2]]
+
+def test_dedupe_keeps_first_and_records_provenance():
+    a = _text(2)
+    docs = [_doc(a, "a.pdf", 0), _doc(_text(3), "a.pdf", 1), _doc(a, "b.pdf", 4)]
+    kept, report = dedupe(docs)
+    assert [d.metadata["source"] for d in kept] == ["a.pdf", "a.pdf"]
+    assert kept[0].metadata["duplicates"] == 1
+    assert kept[0].metadata["also_in"] == "b.pdf p.5"
+    assert report["removed"] == 1
+
+def test_dedupe_against_existing_index():
+    index = NearDuplicateIndex()
+    boilerplate = _text(4)
+    index.check("base-1", " ".join(boilerplate))
+    kept, report = dedupe([_doc(boilerplate, "new.pdf", 2), _doc(_text(5), "new.pdf", 3)], index=index)
+    assert len(kept) == 1
+    assert report["duplicates_of_index"] == 1
+    assert index.absorbed == {"base-1": ["new.pdf p.3"]}
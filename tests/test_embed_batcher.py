@@ -0,0 +1,31 @@
+import time
+import threading
+from embed_batcher import EmbeddingDispatcher
+
+class Recorder:
+
+    def __init__(self):
+        self.batches = []
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        return [[float(len(t))] for t in texts]
+
+def test_batch_window_does_not_slide():
+    base = Recorder()
+    dispatcher = EmbeddingDispatcher(base, batch_wait_ms=100, max_batch=100)
+    started = time.monotonic()
+    first = dispatcher.submit("first")
+
+    def trickle():
+        # Each item lands well inside the previous one's wait; a sliding window never closes
+        for n in range(12):
+            time.sleep(0.03)
+            dispatcher.submit(f"late {n}")
+
+    feeder = threading.Thread(target=trickle)
+    feeder.start()
+    first.result(timeout=2)
+    assert time.monotonic() - started < 0.3
+    feeder.join()
+    assert len(base.batches[0]) < 13
@@ -0,0 +1,34 @@
+from types import SimpleNamespace
+from engine import MapaEngine
+from language import QueryTranslator
+from rate_limit import RateLimiter
+from retrieval_cache import RetrievalCache
+
+class EveryQuestionBank:
+    """Has an English answer for anything it is asked"""
+
+    def __init__(self):
+        self.lookups = []
+
+    def lookup(self, version, *queries, root=None):
+        self.lookups.append(queries)
+        return {"question": queries[0], "answer": "Tuition is paid per term.", "documents": [], "grounding": {}}
+
+def engine():
+    handle = SimpleNamespace(version="v1", root="indexes", retriever=SimpleNamespace(invoke=lambda query: []))
+    mapa = object.__new__(MapaEngine)
+    mapa.knowledge_bases = None
+    mapa.limiter = RateLimiter()
+    mapa.index = SimpleNamespace(current=lambda: handle)
+    mapa.translator = QueryTranslator("lexicon")
+    mapa.answer_bank = EveryQuestionBank()
+    mapa.retrieval_cache = RetrievalCache()
+    return mapa
+
+def test_bank_answers_english_questions_only():
+    mapa = engine()
+    answer, _, _ = mapa._prepare("How much is the tuition?", [], None, None)
+    assert answer.from_bank
+    answer, retrieval, _ = mapa._prepare("Magkano po ang tuition?", [], None, None)
+    assert not answer.from_bank and answer.language != "en" and retrieval is not None
+    assert mapa.answer_bank.lookups == [("How much is the tuition?",)]
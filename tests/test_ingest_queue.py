@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import shutil
+import threading
+from types import SimpleNamespace
+import pytest
+import ingest_queue
+from index_store import new_version_id, publish_version, read_current_version, read_manifest, version_path
+
+# -----------------------------
+# FAKES: a Chroma that keeps its rows as JSON in chroma.sqlite3 (the one file the
+# queue copies from a base version), and PDFs whose pages are given as text
+# -----------------------------
+class FakeCollection:
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.rows = json.load(f)
+
+    def _save(self):
+        with open(self.path, "w") as f:
+            json.dump(self.rows, f)
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        for i, vector, meta, text in zip(ids, embeddings, metadatas, documents):
+            self.rows[i] = {"embedding": list(vector), "metadata": dict(meta), "document": text}
+        self._save()
+
+    def delete(self, ids):
+        for i in ids:
+            self.rows.pop(i, None)
+        self._save()
+
+    def update(self, ids, metadatas):
+        for i, meta in zip(ids, metadatas):
+            self.rows[i]["metadata"] = dict(meta)
+        self._save()
+
+class FakeChroma:
+
+    def __init__(self, persist_directory, embedding_function=None, collection_metadata=None):
+        os.makedirs(persist_directory, exist_ok=True)
+        self._collection = FakeCollection(os.path.join(persist_directory, "chroma.sqlite3"))
+
+    def get(self, include=None):
+        rows = self._collection.rows
+        return {"ids": list(rows),
+                "embeddings": [r["embedding"] for r in rows.values()],
+                "metadatas": [r["metadata"] for r in rows.values()],
+                "documents": [r["document"] for r in rows.values()]}
+
+class FakeEmbeddings:
+
+    def __init__(self, fail_on_call=None):
+        self.calls = 0
+        self.fail_on_call = fail_on_call
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.calls == self.fail_on_call:
+            raise RuntimeError("worker killed")
+        return [[float(len(t)), 1.0, float(sum(map(ord, t)) % 97)] for t in texts]
+
+class OnePagePerChunk:
+
+    def __init__(self, **kwargs):
+        pass
+
+    def split_documents(self, documents):
+        return [SimpleNamespace(page_content=d.page_content, metadata=dict(d.metadata)) for d in documents]
+
+PAGES = {}
+
+def fake_load(paths):
+    return [SimpleNamespace(page_content=text, metadata={"source": path, "page": n})
+            for path in paths for n, text in enumerate(PAGES.get(os.path.basename(path), []))]
+
+def page(seed: int) -> str:
+    return " ".join(f"word{(seed * 7919 + i * 104729) % 5000}" for i in range(120))
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest_queue, "Chroma", FakeChroma)
+    monkeypatch.setattr(ingest_queue, "RecursiveCharacterTextSplitter", OnePagePerChunk)
+    monkeypatch.setattr(ingest_queue, "load_local_pdfs", fake_load)
+    PAGES.clear()
+    q = ingest_queue.IngestQueue(path=str(tmp_path / "jobs.db"), upload_dir=str(tmp_path / "uploads"), batch_size=2)
+    q.root = str(tmp_path / "indexes")
+    return q
+
+def claim(q, job_id):
+    job = q._claim("test")
+    assert job["id"] == job_id
+    return job
+
+def fail(q, job_id):
+    q._update(job_id, state="failed", error="crash")
+    q.retry(job_id)
+
+def chunk_sources(root):
+    store = FakeChroma(version_path(read_current_version(root), root))
+    return sorted(os.path.basename(m["source"]) for m in store.get()["metadatas"])
+
+# -----------------------------
+# CRASH / RESUME
+# -----------------------------
+def test_resume_skips_committed_batches(queue):
+    PAGES["memo.pdf"] = [page(n) for n in range(5)]      # 3 batches of 2
+    job_id = queue.enqueue(["memo.pdf"], root=queue.root)
+    queue._embeddings = FakeEmbeddings(fail_on_call=2)
+    with pytest.raises(RuntimeError):
+        queue.run(claim(queue, job_id))
+    fail(queue, job_id)
+    queue._embeddings = FakeEmbeddings()
+    version = queue.run(claim(queue, job_id))
+    assert queue._embeddings.calls == 2                   # batches 2 and 3 only
+    assert read_current_version(queue.root) == version
+    assert chunk_sources(queue.root) == ["memo.pdf"] * 5
+
+def test_crash_between_rename_and_publish_publishes_built_version(queue, monkeypatch):
+    PAGES["memo.pdf"] = [page(n) for n in range(3)]
+    job_id = queue.enqueue(["memo.pdf"], root=queue.root)
+    queue._embeddings = FakeEmbeddings()
+
+    def crash(version, root):
+        raise OSError("power cut")
+    real_publish = ingest_queue.publish_version
+    monkeypatch.setattr(ingest_queue, "publish_version", crash)
+    with pytest.raises(OSError):
+        queue.run(claim(queue, job_id))
+    monkeypatch.setattr(ingest_queue, "publish_version", real_publish)
+    fail(queue, job_id)
+    built = queue.jobs()[0]["version"]
+    assert os.path.isdir(version_path(built, queue.root))
+
+    assert queue.run(claim(queue, job_id)) == built
+    assert read_current_version(queue.root) == built
+    assert chunk_sources(queue.root) == ["memo.pdf"] * 3
+    assert read_manifest(built, queue.root)["ingest_job"] == job_id
+
+def test_current_republished_during_job_queues_it_again(queue, monkeypatch):
+    PAGES["policy.pdf"] = [page(1)]
+    first = run_job(queue, ["policy.pdf"])
+    PAGES["memo.pdf"] = [page(2), page(3)]
+    job_id = queue.enqueue(["memo.pdf"], root=queue.root)
+    queue._embeddings = FakeEmbeddings()
+    concurrent = new_version_id()
+    real_build = queue._build
+
+    def build_then_republish(job, report):
+        # Someone else publishes while this job is between build and publish
+        built = real_build(job, report)
+        shutil.copytree(version_path(first, queue.root), version_path(concurrent, queue.root))
+        publish_version(concurrent, queue.root)
+        return built
+    monkeypatch.setattr(queue, "_build", build_then_republish)
+    assert queue.run(claim(queue, job_id)) is None
+    job = queue.jobs()[0]
+    assert (job["state"], job["version"], job["base"], job["batches"]) == ("queued", None, None, 0)
+    assert read_current_version(queue.root) == concurrent
+    assert sorted(os.listdir(queue.root)) == sorted(["CURRENT", first, concurrent])
+
+    monkeypatch.setattr(queue, "_build", real_build)
+    version = queue.run(claim(queue, job_id))
+    assert read_current_version(queue.root) == version
+    assert read_manifest(version, queue.root)["base"] == concurrent
+    assert chunk_sources(queue.root) == ["memo.pdf", "memo.pdf", "policy.pdf"]
+
+# -----------------------------
+# RE-UPLOADS AND DEDUP AGAINST THE PUBLISHED INDEX
+# -----------------------------
+def run_job(q, names):
+    job_id = q.enqueue(names, root=q.root)
+    q._embeddings = FakeEmbeddings()
+    return q.run(claim(q, job_id))
+
+def test_reupload_replaces_the_files_chunks(queue):
+    PAGES["memo.pdf"] = [page(n) for n in range(4)]
+    PAGES["other.pdf"] = [page(10)]
+    run_job(queue, ["memo.pdf", "other.pdf"])
+    PAGES["memo.pdf"] = [page(20), page(21)]              # shorter, updated memo
+    run_job(queue, ["memo.pdf"])
+    store = FakeChroma(version_path(read_current_version(queue.root), queue.root))
+    data = store.get()
+    assert sorted(data["ids"]) == ["memo.pdf#0", "memo.pdf#1", "other.pdf#0"]
+    assert page(20) in data["documents"] and page(0) not in data["documents"]
+    assert read_manifest(read_current_version(queue.root), queue.root)["sources"] == ["other.pdf", "memo.pdf"]
+
+def test_dedup_against_the_published_index(queue):
+    PAGES["policy.pdf"] = [page(1), page(2)]
+    run_job(queue, ["policy.pdf"])
+    PAGES["memo.pdf"] = [page(1), page(3)]                # page 1 is the copied policy paragraph
+    version = run_job(queue, ["memo.pdf"])
+    store = FakeChroma(version_path(version, queue.root))
+    rows = store._collection.rows
+    assert sorted(rows) == ["memo.pdf#0", "policy.pdf#0", "policy.pdf#1"]
+    assert rows["policy.pdf#0"]["metadata"]["also_in"] == "memo.pdf p.1"
+    assert rows["policy.pdf#0"]["metadata"]["duplicates"] == 1
+    assert read_manifest(version, queue.root)["dedup"]["duplicates_of_index"] == 1
+
+# -----------------------------
+# HEARTBEAT
+# -----------------------------
+def heartbeat(q, job_id):
+    return q._db().execute("SELECT heartbeat FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+
+def test_heartbeat_runs_on_a_timer_for_the_owner_only(queue, monkeypatch):
+    monkeypatch.setattr(ingest_queue, "HEARTBEAT_SECONDS", 0.02)
+    job_id = queue.enqueue(["memo.pdf"], root=queue.root)
+    claim(queue, job_id)
+    first = heartbeat(queue, job_id)
+    for owner, moves in (("test", True), ("someone-else", False)):
+        before = heartbeat(queue, job_id)
+        done = threading.Event()
+        beater = threading.Thread(target=queue._beat, args=(job_id, owner, done))
+        beater.start()
+        time.sleep(0.1)
+        done.set()
+        beater.join()
+        assert (heartbeat(queue, job_id) > before) == moves
+    assert heartbeat(queue, job_id) > first
@@ -0,0 +1,19 @@
+import pytest
+from language import detect_language, lexicon_translate
+
+@pytest.mark.parametrize("query", ["San Francisco office hours", "Prof. Ilan schedule", "Ang Lee films",
+                                   "meeting at May", "Magkano?"])
+def test_names_homographs_and_single_words_stay_english(query):
+    assert detect_language(query) == "en"
+
+@pytest.mark.parametrize("query, expected", [
+    ("Saan ang library sa San Francisco campus?", "where library San Francisco campus?"),
+    ("Sino si Prof. Ilan?", "who Prof. Ilan?"),
+    ("Saan po ang office ni Ang Lee?", "where office Ang Lee?"),
+    ("Saan ang meeting at May?", "where meeting at May?"),
+    ("may klase ba bukas?", "there is class tomorrow?"),
+    ("Nag-enroll ako tapos saan magbabayad?", "enrolled i where payment?"),
+])
+def test_tagalog_queries_keep_names_and_homographs(query, expected):
+    assert detect_language(query) != "en"
+    assert lexicon_translate(query) == expected
@@ -0,0 +1,80 @@
+import time
+import threading
+import llm_adapter
+from llm_adapter import FakeProvider, GeminiProvider, LLMAdapter, PromptLayout, REFRESH_MARGIN_SECONDS
+
+TURNS = [("human", "When is enrollment?")]
+
+def ask(adapter, prefix="You are MAPA."):
+    return "".join(adapter.stream(PromptLayout(prefix=prefix, turns=TURNS)))
+
+def test_same_prefix_reuses_the_cache():
+    fake = FakeProvider()
+    adapter = LLMAdapter(fake)
+    for _ in range(3):
+        assert ask(adapter) == fake.reply
+    assert len(fake.created) == 1
+    assert [used for _, used in fake.calls] == [True] * 3
+    assert adapter.stats()["cache_hits"] == 2
+
+def test_changed_prefix_misses():
+    fake = FakeProvider()
+    adapter = LLMAdapter(fake)
+    ask(adapter)
+    ask(adapter, "You are MAPA. New hot chunks.")
+    assert fake.created == ["You are MAPA.", "You are MAPA. New hot chunks."]
+    assert adapter.stats()["cache_creates"] == 2
+
+def test_refreshes_before_the_ttl_runs_out():
+    fake = FakeProvider()
+    adapter = LLMAdapter(fake)
+    ask(adapter)
+    handle = next(iter(adapter._handles.values()))
+    handle.expires_at = time.time() + REFRESH_MARGIN_SECONDS / 2
+    ask(adapter)
+    assert fake.refreshed == 1 and len(fake.created) == 1
+    assert handle.expires_at > time.time() + REFRESH_MARGIN_SECONDS
+
+def test_falls_back_to_plain_prompts_when_creation_fails():
+    fake = FakeProvider(supports_caching=False)
+    adapter = LLMAdapter(fake)
+    assert ask(adapter) == fake.reply
+    assert ask(adapter) == fake.reply
+    assert [used for _, used in fake.calls] == [False, False]
+    assert adapter.stats()["plain_calls"] == 2 and not adapter.stats()["caching"]
+
+def test_prefix_below_the_provider_minimum_is_not_cached():
+    fake = FakeProvider(min_cache_tokens=1000)
+    adapter = LLMAdapter(fake)
+    ask(adapter)
+    assert fake.created == [] and adapter.stats()["caching"]
+
+def test_gemini_minimum_follows_the_configured_model(monkeypatch):
+    assert GeminiProvider(llm_adapter.LLM_MODEL).min_cache_tokens == 4096
+    assert GeminiProvider("gemini-1.5-flash-002").min_cache_tokens == 32768
+    assert GeminiProvider("gemini-2.5-flash").min_cache_tokens == 1024
+    monkeypatch.setattr(llm_adapter, "CACHE_MIN_TOKENS", "2048")
+    assert GeminiProvider().min_cache_tokens == 2048
+
+def test_concurrent_requests_create_one_cache_outside_the_lock():
+    release = threading.Event()
+
+    class SlowProvider(FakeProvider):
+        def create_cache(self, prefix, ttl):
+            # Another request must get the lock while this one is on the network
+            assert adapter._lock.acquire(timeout=1)
+            adapter._lock.release()
+            release.wait(1)
+            return super().create_cache(prefix, ttl)
+
+    fake = SlowProvider()
+    adapter = LLMAdapter(fake)
+    threads = [threading.Thread(target=ask, args=(adapter,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(fake.created) == 1
+    assert [used for _, used in fake.calls] == [True] * 4
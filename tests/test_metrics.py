@@ -0,0 +1,20 @@
+import threading
+from metrics import Counter
+
+def test_dead_thread_shards_are_folded_without_a_scrape():
+    counter = Counter("t_total", "test")
+    for _ in range(50):
+        worker = threading.Thread(target=counter.inc)
+        worker.start()
+        worker.join()
+    shards = counter._children[()]._shards
+    assert len(shards._live) <= 1
+    assert shards.total() == [50.0]
+
+def test_taken_port_does_not_raise():
+    import socket
+    from metrics import start_in_background
+    with socket.socket() as taken:
+        taken.bind(("127.0.0.1", 0))
+        taken.listen()
+        assert start_in_background("127.0.0.1", taken.getsockname()[1]) is None
@@ -0,0 +1,61 @@
+import time
+from types import SimpleNamespace
+import pytest
+import api_server
+import rate_limit
+from rate_limit import FairScheduler, QueueTimeout, RateLimited, RateLimiter
+
+# -----------------------------
+# PER-USER TOKEN BUCKETS
+# -----------------------------
+def test_burst_then_rejected_with_retry_after():
+    limiter = RateLimiter(per_minute=6, burst=2)
+    limiter.check("a")
+    limiter.check("a")
+    with pytest.raises(RateLimited) as rejected:
+        limiter.check("a")
+    assert 0 < rejected.value.retry_after <= 10
+    limiter.check("b")                      # other users have their own bucket
+    assert (limiter.allowed, limiter.rejected) == (3, 1)
+
+def test_refilled_buckets_are_dropped(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: clock[0])
+    limiter = RateLimiter(per_minute=60, burst=2)
+    for user in ("a", "b", "c"):
+        limiter.check(user)
+    clock[0] += 0.5
+    limiter.check("a")
+    clock[0] += rate_limit.SWEEP_SECONDS
+    limiter.check("d")
+    assert set(limiter._buckets) == {"d"}
+
+# -----------------------------
+# API CALLER IDENTITY
+# -----------------------------
+def request(headers, host="10.0.0.5"):
+    return SimpleNamespace(headers=headers, client=SimpleNamespace(host=host))
+
+def test_api_user_ignores_claimed_identity(monkeypatch):
+    monkeypatch.setattr(api_server, "API_KEYS", {"k-123": "cie"})
+    assert api_server._api_user(request({"X-MAPA-User": "admin"})) == "api:10.0.0.5"
+    assert api_server._api_user(request({"Authorization": "Bearer k-123"})) == "cie"
+    with pytest.raises(api_server.Unauthorized):
+        api_server._api_user(request({"Authorization": "Bearer guessed"}))
+
+# -----------------------------
+# FAIR SCHEDULER
+# -----------------------------
+def test_queueing_is_bounded_by_the_callers_budget():
+    scheduler = FairScheduler(slots=1, timeout=60)
+    scheduler.acquire("a")
+    started = time.monotonic()
+    with pytest.raises(QueueTimeout):
+        scheduler.acquire("b", timeout=0.2)
+    assert time.monotonic() - started < 1.0
+    assert scheduler.stats()["queued"] == 0
+
+def test_free_slot_is_granted_with_no_budget_left():
+    scheduler = FairScheduler(slots=1, timeout=60)
+    scheduler.acquire("a", timeout=0)
+    assert scheduler.stats()["in_flight"] == 1
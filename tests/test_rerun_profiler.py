@@ -0,0 +1,58 @@
+import threading
+import rerun_profiler
+from rerun_profiler import RerunProfiler
+
+class FakeProfile:
+    """Records which thread enabled and disabled it"""
+    made = []
+
+    def __init__(self):
+        self.enabled_by = None
+        self.disabled_by = []
+        FakeProfile.made.append(self)
+
+    def enable(self):
+        self.enabled_by = threading.current_thread()
+
+    def disable(self):
+        self.disabled_by.append(threading.current_thread())
+
+    def create_stats(self):
+        self.stats = {("app.py", 1, "<module>"): (1, 1, 0.001, 0.001, {})}
+
+def in_thread(target):
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread
+
+def test_cprofile_is_only_disabled_by_its_own_thread(monkeypatch):
+    monkeypatch.setattr(rerun_profiler.cProfile, "Profile", FakeProfile)
+    monkeypatch.setattr(rerun_profiler, "STALE_SECONDS", 0)
+    FakeProfile.made.clear()
+    profiler = RerunProfiler(mode="cprofile", report_path="unused.json", cprofile_every=1)
+    begun, release = threading.Event(), threading.Event()
+
+    def long_rerun():
+        profiler.begin()
+        begun.set()
+        release.wait()
+        profiler.mark("widgets")           # past STALE_SECONDS: the owner stops its own profile
+        profiler.end()
+    owner = in_thread(long_rerun)
+    begun.wait()
+    sampled = FakeProfile.made[0]
+    try:
+        profiler.begin()                   # owner alive: no claim, no disable from here
+        profiler.end()
+        assert len(FakeProfile.made) == 1 and sampled.disabled_by == []
+    finally:
+        release.set()
+        owner.join()
+    assert sampled.disabled_by == [owner]
+
+    in_thread(profiler.begin).join()       # a rerun whose thread died without end()
+    orphan = FakeProfile.made[1]
+    profiler.begin()
+    profiler.end()
+    assert orphan.disabled_by == [] and len(FakeProfile.made) == 3
+    assert all(p.disabled_by in ([], [p.enabled_by]) for p in FakeProfile.made)
@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import retrieval_server
+from retrieval_cache import RetrievalCache
+from retrieval_server import RemoteIndex, SearchResult
+
+POOL = ThreadPoolExecutor(max_workers=1)
+
+class SwappedRetriever:
+    """Answers from a newer version than the caller read before searching"""
+
+    def __init__(self, version):
+        self.version = version
+        self.calls = 0
+
+    def invoke(self, query):
+        self.calls += 1
+        return SearchResult([SimpleNamespace(page_content="chunk", metadata={})], self.version)
+
+def test_results_are_cached_under_the_version_searched():
+    cache = RetrievalCache()
+    retriever = SwappedRetriever("v2")
+    future, hit = cache.retrieve(POOL, retriever, "When is enrollment?", "v1", 4)
+    assert not hit and future.result().version == "v2"
+    future, hit = cache.retrieve(POOL, retriever, "When is enrollment?", "v1", 4)
+    assert not hit and future.result().version == "v2"
+    future, hit = cache.retrieve(POOL, retriever, "when is enrollment", "v2", 4)
+    assert hit and retriever.calls == 2
+
+def test_remote_index_takes_the_version_from_searches(monkeypatch):
+    requests = []
+
+    def fake_request(socket_path, payload, timeout=None):
+        requests.append(payload["op"])
+        return {"version": "v1"}
+
+    monkeypatch.setattr(retrieval_server, "_request", fake_request)
+    index = RemoteIndex("/tmp/mapa-test.sock")
+    assert index.current().version == "v1"
+    index.seen("v2")                         # a search was answered by v2
+    assert index.current().version == "v2"
+    assert index.current().version == "v2"
+    assert requests == ["info"]
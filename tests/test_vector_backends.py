@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+import vector_backends
+from vector_backends import ExactIndex, IVFPQIndex, ivfpq_index
+
+def vectors(n, dim=16, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+def test_small_corpus_is_searched_exactly():
+    data = vectors(200)                       # fewer than the 256 codes of one 8-bit codebook
+    index = ivfpq_index(data, nbits=8)
+    assert isinstance(index, ExactIndex)
+    ids, scores = index.search(data[7], 3)
+    assert ids[0] == 7 and scores[0] == pytest.approx(1.0, abs=1e-5)
+
+def test_large_enough_corpus_uses_ivfpq():
+    pytest.importorskip("faiss")
+    n = vector_backends.TRAIN_POINTS * 2 ** 4
+    dim = vector_backends.PQ_M                # one dimension per sub-quantizer
+    assert isinstance(ivfpq_index(vectors(n - 1, dim), nbits=4), ExactIndex)
+    assert isinstance(ivfpq_index(vectors(n, dim), nbits=4), IVFPQIndex)
@@ -0,0 +1,60 @@
+import os
+import json
+import time
+import logging
+import threading
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+TRACE_LOG = os.getenv("MAPA_TRACE_LOG", os.path.join("logs", "requests.jsonl"))
+IDK_MARKERS = ("don't know", "do not know", "not sure", "couldn't find", "no information")
+
+def is_idk(text: str) -> bool:
+    text = (text or "").lower()
+    return any(marker in text for marker in IDK_MARKERS)
+
+# -----------------------------
+# APPEND-ONLY REQUEST TRACE (one JSON object per line)
+# -----------------------------
+class TraceLog:
+
+    def __init__(self, path: str = TRACE_LOG):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+        except OSError as e:
+            # Tracing must never break answering
+            logging.error(e)
+
+def answer_record(answer, query: str, user, channel: str, error=None) -> dict:
+    """Trace record for one engine request"""
+    return {
+        "ts": time.time(),
+        "request_id": answer.request_id if answer else None,
+        "channel": channel,
+        "user": user,
+        "query": query,
+        "index_version": answer.index_version if answer else None,
+        "knowledge_base": answer.knowledge_base if answer else None,
+        "language": answer.language if answer else None,
+        "timings": answer.timings if answer else {},
+        "tokens": answer.tokens if answer else {},
+        "docs": len(answer.documents) if answer else 0,
+        "depth_reason": answer.documents[0].metadata.get("depth_reason") if answer and answer.documents else None,
+        "top_score": answer.documents[0].metadata.get("score") if answer and answer.documents else None,
+        "retrieval_cache_hit": bool(answer and answer.retrieval_cache_hit),
+        "from_bank": bool(answer and answer.from_bank),
+        "degraded": (answer.degraded or None) if answer else None,
+        "idk": bool(answer and not answer.degraded and is_idk(answer.text)),
+        "error": type(error).__name__ if error else None,
+    }
+
+TRACE = TraceLog()
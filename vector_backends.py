@@ -0,0 +1,339 @@
+import os
+import json
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from retrieval_depth import RETRIEVAL_DEPTH, AdaptiveRetriever
+from sections import build_sections, read_sections, section_id
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# -----------------------------
+# CONFIG
+#   chroma  Chroma's built-in HNSW (default), tuned by the MAPA_HNSW_* settings
+#   exact   brute-force search over all vectors, for validating ANN recall
+#   ivfpq   FAISS IVF-PQ over compressed codes (pip install faiss-cpu)
+#   int8    int8 codes in memory, shortlist rescored against memory-mapped float16 vectors
+#   binary  same with 1 bit per dimension (sign), hamming distance for the first pass
+#   sections  two stages: the best sections (page ranges of one PDF) first, then exact search
+#             over only their chunks
+# -----------------------------
+ANN_BACKEND = os.getenv("MAPA_ANN_BACKEND", "chroma")
+HNSW_M = int(os.getenv("MAPA_HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("MAPA_HNSW_EF_CONSTRUCTION", "100"))
+HNSW_EF_SEARCH = int(os.getenv("MAPA_HNSW_EF_SEARCH", "64"))
+IVF_NLIST = int(os.getenv("MAPA_IVF_NLIST", "0"))       # 0 = about 4*sqrt(n)
+IVF_NPROBE = int(os.getenv("MAPA_IVF_NPROBE", "8"))
+PQ_M = int(os.getenv("MAPA_PQ_M", "48"))                 # sub-quantizers; must divide the dimension
+PQ_NBITS = int(os.getenv("MAPA_PQ_NBITS", "8"))
+# k-means wants this many training points per centroid, for the IVF lists and for each
+# 2**PQ_NBITS-entry PQ codebook alike; smaller corpora are searched exactly instead
+TRAIN_POINTS = 39
+# Shortlist = k * factor, rescored in float; 1-bit codes need a much longer one for the same recall
+RESCORE_FACTOR = {
+    "int8": int(os.getenv("MAPA_INT8_RESCORE", "4")),
+    "binary": int(os.getenv("MAPA_BINARY_RESCORE", "40")),
+}
+RESCORE_MIN = int(os.getenv("MAPA_RESCORE_MIN", "32"))
+BLOCK_ROWS = 512               # int8 rows widened to float32 at a time (cache-sized temporary)
+
+# Written into the index version directory the first time a quantized backend opens it
+QUANTIZED_FILES = {"int8": "codes_int8.npy", "binary": "codes_binary.npy"}
+INT8_SCALES_FILE = "codes_int8_scales.npy"
+RESCORE_FILE = "vectors_f16.npy"
+VECTOR_IDS_FILE = "vector_ids.json"    # written last: its presence means the set is complete
+
+TOP_SECTIONS = int(os.getenv("MAPA_TOP_SECTIONS", "6"))
+MIN_CANDIDATES = 4             # keep adding sections until there are at least k * this chunks
+
+BACKENDS = ("chroma", "exact", "ivfpq", "int8", "binary", "sections")
+
+def hnsw_metadata() -> dict:
+    """Chroma collection metadata carrying the HNSW build/search parameters"""
+    return {
+        "hnsw:space": "cosine",
+        "hnsw:M": HNSW_M,
+        "hnsw:construction_ef": HNSW_EF_CONSTRUCTION,
+        "hnsw:search_ef": HNSW_EF_SEARCH,
+    }
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+# -----------------------------
+# INDEXES
+# Each takes normalized float32 vectors and answers search(query, k) -> (ids, scores)
+# -----------------------------
+class ExactIndex:
+    """Brute-force cosine similarity: the ground truth other backends are measured against"""
+
+    def __init__(self, vectors):
+        self.vectors = _normalize(vectors)
+
+    def search(self, query, k: int):
+        scores = self.vectors @ _normalize(query)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+    def nbytes(self) -> int:
+        return self.vectors.nbytes
+
+class IVFPQIndex:
+    """Inverted file + product quantization: ~PQ_M bytes per vector instead of dim*4"""
+
+    def __init__(self, vectors, nlist: int = IVF_NLIST, nprobe: int = IVF_NPROBE,
+                 pq_m: int = PQ_M, nbits: int = PQ_NBITS):
+        if faiss is None:
+            raise ImportError("MAPA_ANN_BACKEND=ivfpq needs faiss: pip install faiss-cpu")
+        vectors = _normalize(vectors)
+        n, dim = vectors.shape
+        nlist = nlist or max(1, int(4 * np.sqrt(n)))
+        # Training needs a few dozen points per centroid; shrink nlist on small corpora
+        nlist = max(1, min(nlist, n // TRAIN_POINTS))
+        quantizer = faiss.IndexFlatIP(dim)
+        self.index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, nbits, faiss.METRIC_INNER_PRODUCT)
+        self.index.train(vectors)
+        self.index.add(vectors)
+        self.index.nprobe = nprobe
+
+    def search(self, query, k: int):
+        scores, ids = self.index.search(_normalize(query)[None, :], k)
+        keep = ids[0] >= 0
+        return ids[0][keep], scores[0][keep]
+
+    def nbytes(self) -> int:
+        return int(faiss.serialize_index(self.index).nbytes)
+
+def ivfpq_index(vectors, nbits: int = PQ_NBITS):
+    """IVFPQIndex, or ExactIndex when there are too few vectors to train the PQ codebooks"""
+    if len(vectors) < TRAIN_POINTS * 2 ** nbits:
+        return ExactIndex(vectors)
+    return IVFPQIndex(vectors, nbits=nbits)
+
+# 1-bits per byte value, for hamming distances on numpy without bitwise_count
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def _popcount(x):
+    return np.bitwise_count(x) if hasattr(np, "bitwise_count") else _POPCOUNT[x]
+
+def quantize(vectors) -> dict:
+    """int8 codes with per-dimension scales, sign bits, float16 copy of normalized vectors"""
+    vectors = _normalize(vectors)
+    scales = np.maximum(np.abs(vectors).max(axis=0), 1e-12) / 127.0
+    return {
+        "int8": np.round(vectors / scales).astype(np.int8),
+        "scales": scales.astype(np.float32),
+        "binary": np.packbits(vectors > 0, axis=1),
+        "full": vectors.astype(np.float16),
+    }
+
+def _save_npy(path: str, array):
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+class QuantizedIndex:
+    """First pass over every vector with int8 (384 B) or binary (48 B) codes held in memory;
+    the best k * rescore are then rescored exactly against float16 vectors that are
+    memory-mapped, so only the shortlisted rows are ever read from disk"""
+
+    def __init__(self, codes, scales, full, kind: str, rescore: int = 0):
+        self.codes = codes
+        self.scales = scales
+        self.full = full
+        self.kind = kind
+        self.rescore = rescore or RESCORE_FACTOR[kind]
+
+    @classmethod
+    def from_vectors(cls, vectors, kind: str, rescore: int = 0):
+        q = quantize(vectors)
+        return cls(q[kind], q["scales"] if kind == "int8" else None, q["full"], kind, rescore)
+
+    @staticmethod
+    def write(path: str, vectors, ids):
+        """Codes for both kinds plus the float16 rescoring file; later opens skip Chroma's float32"""
+        q = quantize(vectors)
+        _save_npy(os.path.join(path, QUANTIZED_FILES["int8"]), q["int8"])
+        _save_npy(os.path.join(path, INT8_SCALES_FILE), q["scales"])
+        _save_npy(os.path.join(path, QUANTIZED_FILES["binary"]), q["binary"])
+        _save_npy(os.path.join(path, RESCORE_FILE), q["full"])
+        tmp_path = os.path.join(path, VECTOR_IDS_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(list(ids), f)
+        os.replace(tmp_path, os.path.join(path, VECTOR_IDS_FILE))
+
+    @classmethod
+    def load(cls, path: str, kind: str, rescore: int = 0):
+        codes = np.load(os.path.join(path, QUANTIZED_FILES[kind]))
+        scales = np.load(os.path.join(path, INT8_SCALES_FILE)) if kind == "int8" else None
+        full = np.load(os.path.join(path, RESCORE_FILE), mmap_mode="r")
+        return cls(codes, scales, full, kind, rescore)
+
+    def _first_pass(self, query):
+        if self.kind == "binary":
+            hamming = _popcount(np.bitwise_xor(self.codes, np.packbits(query > 0))).sum(axis=1, dtype=np.int32)
+            return -hamming
+        # (codes * scales) . q == codes . (q * scales); widened block by block to bound the temporary
+        q = query * self.scales
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), BLOCK_ROWS):
+            block = self.codes[start:start + BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ q
+        return scores
+
+    def search(self, query, k: int):
+        query = _normalize(query)
+        approx = self._first_pass(query)
+        n = len(approx)
+        k = min(k, n)
+        m = min(n, max(k * self.rescore, RESCORE_MIN))
+        shortlist = np.argpartition(-approx, m - 1)[:m] if m < n else np.arange(n)
+        shortlist.sort()       # ascending rows: sequential reads from the memory map
+        scores = np.asarray(self.full[shortlist], dtype=np.float32) @ query
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return shortlist[top], scores[top]
+
+    def nbytes(self) -> int:
+        """Resident memory; the float16 file is paged in on demand (see mapped_bytes)"""
+        resident = self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+        return resident + (0 if isinstance(self.full, np.memmap) else self.full.nbytes)
+
+    def mapped_bytes(self) -> int:
+        return self.full.nbytes if isinstance(self.full, np.memmap) else 0
+
+def quantized_index(vectorstore, kind: str, path: str = None):
+    """(QuantizedIndex, documents in index order) for a Chroma store. With a version directory,
+    the codes are written there on first open and loaded from it afterwards."""
+    if path and os.path.exists(os.path.join(path, VECTOR_IDS_FILE)):
+        with open(os.path.join(path, VECTOR_IDS_FILE), "r", encoding="utf-8") as f:
+            ids = json.load(f)
+        data = vectorstore.get(ids=ids, include=["documents", "metadatas"])
+        by_id = {i: Document(page_content=text, metadata=meta or {})
+                 for i, text, meta in zip(data["ids"], data["documents"], data["metadatas"])}
+        return QuantizedIndex.load(path, kind), [by_id[i] for i in ids]
+    data = vectorstore.get(include=["embeddings", "documents", "metadatas"])
+    documents = [Document(page_content=text, metadata=meta or {})
+                 for text, meta in zip(data["documents"], data["metadatas"])]
+    if path:
+        QuantizedIndex.write(path, data["embeddings"], data["ids"])
+        return QuantizedIndex.load(path, kind), documents
+    return QuantizedIndex.from_vectors(data["embeddings"], kind), documents
+
+class HierarchicalIndex:
+    """Sections are scored by their centroid first; only the chunks of the top ones are then
+    scored exactly. Chunks are stored grouped by section so each one is a contiguous slice."""
+
+    def __init__(self, vectors, metadatas, stored=None, top_sections: int = TOP_SECTIONS):
+        vectors = _normalize(vectors)
+        row_ids = [(meta or {}).get("section") or section_id(meta or {}) for meta in metadatas]
+        if stored is None or not set(row_ids) <= {s["id"] for s in stored[0]}:
+            # Versions built before sections: group the chunks now, without summaries
+            stored = build_sections(vectors, metadatas)
+        self.sections, self.centroids = stored
+        position = {s["id"]: i for i, s in enumerate(self.sections)}
+        row_section = np.array([position[sid] for sid in row_ids], dtype=np.int64)
+        self.rows = np.argsort(row_section, kind="stable")      # stored order -> document index
+        self.vectors = vectors[self.rows]
+        self.counts = np.bincount(row_section, minlength=len(self.sections))
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)])
+        self.top_sections = top_sections
+
+    def select(self, query, k: int):
+        """Indexes of the sections searched for this query, best first"""
+        order = np.argsort(-(self.centroids @ query))
+        chosen, candidates = [], 0
+        for s in order:
+            if len(chosen) >= self.top_sections and candidates >= k * MIN_CANDIDATES:
+                break
+            chosen.append(s)
+            candidates += self.counts[s]
+        return chosen
+
+    def search(self, query, k: int):
+        query = _normalize(query)
+        chosen = self.select(query, k)
+        scores = np.concatenate([self.vectors[self.offsets[s]:self.offsets[s + 1]] @ query for s in chosen])
+        positions = np.concatenate([np.arange(self.offsets[s], self.offsets[s + 1]) for s in chosen])
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return self.rows[positions[top]], scores[top]
+
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + self.centroids.nbytes + self.rows.nbytes
+
+def load_collection(vectorstore):
+    """All vectors, texts and metadata of a Chroma store, in matching order"""
+    data = vectorstore.get(include=["embeddings", "documents", "metadatas"])
+    docs = [
+        Document(page_content=text, metadata=meta or {})
+        for text, meta in zip(data["documents"], data["metadatas"])
+    ]
+    return np.asarray(data["embeddings"], dtype=np.float32), docs
+
+# -----------------------------
+# RETRIEVER
+# -----------------------------
+class VectorIndexRetriever(BaseRetriever):
+    """Same interface as vectorstore.as_retriever(), backed by an in-memory index"""
+    index: object
+    documents: list
+    embeddings: object
+    k: int = 8
+
+    def search_by_vector(self, vector, k: int):
+        ids, _ = self.index.search(vector, k)
+        return [self.documents[i] for i in ids]
+
+    def search_with_scores(self, vector, k: int):
+        ids, scores = self.index.search(vector, k)
+        return [(self.documents[i], float(s)) for i, s in zip(ids, scores)]
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.search_by_vector(self.embeddings.embed_query(query), self.k)
+
+def chroma_search_with_scores(vectorstore):
+    """(vector, k) -> [(doc, cosine similarity)] on a Chroma store built with hnsw_metadata()"""
+    def search(vector, k: int):
+        # Chroma reports cosine distance for "hnsw:space": "cosine"
+        hits = vectorstore.similarity_search_by_vector_with_relevance_scores(vector, k=k)
+        return [(doc, 1.0 - float(distance)) for doc, distance in hits]
+    return search
+
+def search_by_vector(handle, vector, k: int):
+    """Vector search on an IndexHandle, whichever backend its retriever uses"""
+    if isinstance(handle.retriever, (VectorIndexRetriever, AdaptiveRetriever)):
+        return handle.retriever.search_by_vector(vector, k)
+    return handle.vectorstore.similarity_search_by_vector(vector, k=k)
+
+def make_retriever(vectorstore, embeddings, k: int, backend: str = ANN_BACKEND, depth: str = RETRIEVAL_DEPTH,
+                   path: str = None):
+    """Retriever for an opened index version using the configured ANN backend.
+    depth="adaptive" wraps it so each query keeps as many chunks as its scores justify.
+    path is the version directory, where the quantized backends keep their files."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown MAPA_ANN_BACKEND {backend!r}; expected one of {BACKENDS}")
+    if backend == "chroma":
+        if depth == "adaptive":
+            return AdaptiveRetriever(search=chroma_search_with_scores(vectorstore), embeddings=embeddings)
+        return vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": k})
+    if backend in QUANTIZED_FILES:
+        index, documents = quantized_index(vectorstore, backend, path)
+    elif backend == "sections":
+        vectors, documents = load_collection(vectorstore)
+        index = HierarchicalIndex(vectors, [d.metadata for d in documents], read_sections(path) if path else None)
+    else:
+        vectors, documents = load_collection(vectorstore)
+        index = ExactIndex(vectors) if backend == "exact" else ivfpq_index(vectors)
+    retriever = VectorIndexRetriever(index=index, documents=documents, embeddings=embeddings, k=k)
+    if depth == "adaptive":
+        return AdaptiveRetriever(search=retriever.search_with_scores, embeddings=embeddings)
+    return retriever